@@ -0,0 +1,333 @@
+"""Нагрузочный прогон обработчиков бота без сети.
+
+Бот работает с настоящими обработчиками из bot.py и настоящей базой
+(временный файл SQLite с заданным числом товаров), а вместо Telegram
+подставляется FakeBot, который отвечает на запросы API локально и считает
+их. N пользователей параллельно проходят типичный сценарий: /start,
+каталог, листание, добавление в корзину, корзина, оформление и оплата,
+история заказов.
+
+Запуск: python benchmark.py --users 100 --products 5000 --rounds 3
+
+Выводятся пропускная способность, задержки p50/p95/p99 по каждому шагу и
+в целом, число запросов к БД и вызовов API на обновление. С --save
+результат записывается как эталон; при следующих запусках с теми же
+параметрами результат сравнивается с эталоном, и если он хуже больше чем
+на --tolerance, скрипт завершается с кодом 1.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+import config
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'JoJo Shop', 'username': 'jojo_shop_bot'}
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summary(latencies):
+    return {
+        'count': len(latencies),
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+
+
+def create_fake_bot():
+    # Возвращает бота и счётчик вызовов API по методам
+    from telegram.ext import ExtBot
+    calls = {}
+    message_ids = itertools.count(1)
+
+    class FakeBot(ExtBot):
+        """Bot, который не ходит в сеть: запросы API записываются, а ответ
+        собирается из переданных параметров."""
+
+        async def _do_post(self, endpoint, data, **kwargs):
+            calls[endpoint] = calls.get(endpoint, 0) + 1
+            if endpoint == 'getMe':
+                return BOT_USER
+            if not endpoint.startswith(('send', 'edit')):
+                return True
+            message = {
+                'message_id': data.get('message_id') or next(message_ids),
+                'date': int(time.time()),
+                'chat': {'id': data.get('chat_id', 0), 'type': 'private'},
+                'from': BOT_USER,
+            }
+            if 'text' in data:
+                message['text'] = data['text']
+            if endpoint in ('sendPhoto', 'editMessageMedia'):
+                file_id = f"photo_{message['message_id']}"
+                message['photo'] = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 1280, 'height': 1280}]
+            return message
+
+    return FakeBot('0:benchmark'), calls
+
+
+class Simulation:
+    def __init__(self, bot_module, application, products, seed):
+        self.bot_module = bot_module
+        self.application = application
+        self.products = products
+        self.random = random.Random(seed)
+        self.update_ids = itertools.count(1)
+        self.latencies = {}
+        self.errors = 0
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+
+    def message(self, user_id, text):
+        update_id = next(self.update_ids)
+        message = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': update_id, 'message': message}
+
+    def callback(self, user_id, data):
+        update_id = next(self.update_ids)
+        return {'update_id': update_id, 'callback_query': {
+            'id': str(update_id),
+            'from': self._user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': '✨',
+            },
+        }}
+
+    def scenario(self, user_id):
+        # Шаги одного визита пользователя: (название шага, обновление)
+        from callback_router import encode
+        labels = {action: label for label, action in self.bot_module.menu_buttons()}
+        product_ids = [self.random.choice(self.products) for _ in range(4)]
+        return [
+            ('start', self.message(user_id, '/start')),
+            ('catalog', self.message(user_id, labels['catalog'])),
+            ('show_products', self.callback(user_id, 'cat_all')),
+            ('nav_next', self.callback(user_id, encode('nav_next_', 'all', product_ids[0]))),
+            ('nav_next', self.callback(user_id, encode('nav_next_', 'all', product_ids[1]))),
+            ('add_to_cart', self.callback(user_id, encode('add_to_cart_', product_ids[2]))),
+            ('add_to_cart', self.callback(user_id, encode('add_to_cart_', product_ids[3]))),
+            ('show_cart', self.message(user_id, labels['cart'])),
+            ('checkout', self.callback(user_id, 'checkout')),
+            ('pay_order', self.callback(user_id, 'pay_order')),
+            ('orders', self.message(user_id, labels['orders'])),
+        ]
+
+    async def process(self, step, data):
+        from telegram import Update
+        application = self.application
+        update = Update.de_json(data, application.bot)
+        started = time.perf_counter()
+        await application.update_processor.process_update(update, application.process_update(update))
+        self.latencies.setdefault(step, []).append(time.perf_counter() - started)
+
+    async def run_user(self, user_id, rounds):
+        for _ in range(rounds):
+            for step, data in self.scenario(user_id):
+                await self.process(step, data)
+
+
+async def seed_products(database, count, seed):
+    from keyboards import CATEGORIES
+    rng = random.Random(seed)
+    words = ['Джотаро', 'Дио', 'Джорно', 'Джоске', 'Стенд', 'Куджо', 'Бруно', 'Стар Платинум', 'Золотой ветер']
+    kinds = ['Фигурка', 'Футболка', 'Брелок', 'Том', 'Постер', 'Кружка']
+    rows = []
+    for i in range(count):
+        name = f"{rng.choice(kinds)} {rng.choice(words)} #{i}"
+        rows.append((name, f"Описание товара {name}", rng.randint(100, 10000), rng.choice(CATEGORIES)[2]))
+    async with database.pool.writer() as db:
+        await db.executemany('INSERT INTO products (name, description, price, category) VALUES (?, ?, ?, ?)', rows)
+        async with db.execute('SELECT id FROM products WHERE is_active = 1') as cursor:
+            return [row['id'] for row in await cursor.fetchall()]
+
+
+async def count_queries(database, counter):
+    # Все выражения SQL на соединениях пула, кроме выполняемых триггерами
+    def trace(statement):
+        if not statement.startswith('--'):
+            counter[0] += 1
+    pool = database.pool
+    for db in [pool._writer, *pool._all_readers]:
+        await db.set_trace_callback(trace)
+
+
+async def run(args):
+    from telegram.ext import Application
+    import database
+    import bot
+    # bot.py включает журнал уровня INFO, прогону нужны только ошибки
+    logging.getLogger().setLevel(logging.WARNING)
+
+    await database.init_db()
+    try:
+        products = await seed_products(database, args.products, args.seed)
+        await bot.payments.start()
+
+        fake_bot, api_calls = create_fake_bot()
+        application = (
+            Application.builder()
+            .bot(fake_bot)
+            .updater(None)
+            .concurrent_updates(bot.PerUserUpdateProcessor(args.concurrency))
+            .build()
+        )
+        bot.add_handlers(application)
+        simulation = Simulation(bot, application, products, args.seed)
+
+        async def on_error(update, context):
+            simulation.errors += 1
+            if simulation.errors <= 5:
+                logging.getLogger(__name__).error('Ошибка обработчика', exc_info=context.error)
+        application.add_error_handler(on_error)
+        await application.initialize()
+        api_calls.clear()
+
+        queries = [0]
+        await count_queries(database, queries)
+        first_user = 10_000_000
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            simulation.run_user(first_user + i, args.rounds) for i in range(args.users)
+        ))
+        elapsed = time.perf_counter() - started
+
+        await application.shutdown()
+        await bot.payments.close()
+    finally:
+        # Отложенная запись корзин и профилей тоже входит в стоимость обновлений
+        await database.close_db()
+
+    all_latencies = [value for values in simulation.latencies.values() for value in values]
+    updates = len(all_latencies)
+    return {
+        'updates': updates,
+        'errors': simulation.errors,
+        'seconds': elapsed,
+        'updates_per_second': updates / elapsed if elapsed else 0.0,
+        'queries_per_update': queries[0] / updates if updates else 0.0,
+        'api_calls_per_update': sum(api_calls.values()) / updates if updates else 0.0,
+        'total': summary(all_latencies),
+        'steps': {step: summary(values) for step, values in simulation.latencies.items()},
+    }
+
+
+def print_report(result):
+    print(f"Обновлений: {result['updates']} за {result['seconds']:.2f} с "
+          f"({result['updates_per_second']:.0f}/с), ошибок: {result['errors']}")
+    print(f"Запросов к БД на обновление: {result['queries_per_update']:.2f}, "
+          f"вызовов API: {result['api_calls_per_update']:.2f}")
+    print(f"{'шаг':<16}{'кол-во':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for step, stats in [*result['steps'].items(), ('ВСЕГО', result['total'])]:
+        print(f"{step:<16}{stats['count']:>8}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+
+
+def compare(result, baseline, tolerance):
+    """Список ухудшений относительно эталона больше чем на tolerance."""
+    regressions = []
+
+    def check(name, current, previous, higher_is_better=False):
+        if not previous:
+            return
+        change = (previous - current) / previous if higher_is_better else (current - previous) / previous
+        if change > tolerance:
+            regressions.append(f"{name}: {previous:.2f} -> {current:.2f} ({change:+.0%})")
+
+    check('обновлений/с', result['updates_per_second'], baseline['updates_per_second'], higher_is_better=True)
+    check('запросов к БД на обновление', result['queries_per_update'], baseline['queries_per_update'])
+    check('вызовов API на обновление', result['api_calls_per_update'], baseline['api_calls_per_update'])
+    for step, stats in [*result['steps'].items(), ('ВСЕГО', result['total'])]:
+        previous = baseline['total'] if step == 'ВСЕГО' else baseline['steps'].get(step)
+        if previous:
+            check(f"{step} p95, мс", stats['p95_ms'], previous['p95_ms'])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный прогон обработчиков бота')
+    parser.add_argument('--users', type=int, default=50, help='пользователей одновременно')
+    parser.add_argument('--rounds', type=int, default=3, help='повторов сценария на пользователя')
+    parser.add_argument('--products', type=int, default=1000, help='товаров в базе')
+    parser.add_argument('--concurrency', type=int, default=config.CONCURRENT_UPDATES,
+                        help='обновлений в обработке одновременно')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', default='data/benchmark_baseline.json', help='файл с эталонными результатами')
+    parser.add_argument('--save', action='store_true', help='сохранить результат как эталон')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимое ухудшение, доля')
+    parser.add_argument('--json', action='store_true', help='вывести результат в JSON')
+    args = parser.parse_args()
+
+    # Временная база и настройки без внешних сервисов; задаются до импорта
+    # database и bot, которые читают config при загрузке
+    workdir = tempfile.mkdtemp(prefix='jojo_bench_')
+    config.DATABASE_PATH = os.path.join(workdir, 'products.db')
+    config.IMAGES_PATH = os.path.join(workdir, 'images')
+    config.STATE_STORE = 'memory'
+    config.PAYMENT_PROVIDER = 'stub'
+
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print_report(result)
+
+    # Эталоны хранятся по параметрам прогона
+    key = f"users={args.users},rounds={args.rounds},products={args.products},concurrency={args.concurrency}"
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baselines = json.load(f)
+
+    exit_code = 0
+    if key in baselines:
+        regressions = compare(result, baselines[key], args.tolerance)
+        if regressions:
+            print(f"\n❌ Хуже эталона ({key}):")
+            for line in regressions:
+                print(f"  {line}")
+            exit_code = 1
+        else:
+            print(f"\n✅ В пределах эталона ({key})")
+    elif not args.save:
+        print(f"\nЭталона для {key} нет, сохраните его с --save")
+
+    if args.save:
+        baselines[key] = result
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, ensure_ascii=False, indent=2)
+        print(f"Эталон сохранён в {args.baseline}")
+    if result['errors']:
+        exit_code = 1
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,54 @@
 import asyncio
+import functools
+import html
+import io
 import logging
-import sys
+import os
+import tempfile
+import time
 
-# Фикс для Python 3.11+ на Raspberry Pi
-if sys.version_info >= (3, 11):
-    try:
-        import nest_asyncio
-        nest_asyncio.apply()
-    except ImportError:
-        pass
-
-from telegram import Update, ReplyKeyboardRemove
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
+from telegram import Update, ReplyKeyboardRemove, Message, InputMediaPhoto, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InlineQueryResultCachedPhoto, InputTextMessageContent
+from telegram.error import BadRequest
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, InlineQueryHandler, filters, ContextTypes
 
-from config import TELEGRAM_TOKEN, is_admin, ADMIN_USER_IDS, ADMIN_CHAT_ID
-from database import init_db, get_products, get_product, add_to_cart, get_user_cart, clear_cart, create_order, add_order_items, save_user_info, get_user_info, get_user_orders, add_product, get_all_users, get_statistics, get_all_products, update_product, delete_product
-from keyboards import main_menu, category_menu, product_keyboard, cart_keyboard, checkout_keyboard, admin_orders_keyboard, cancel_keyboard, admin_edit_products_keyboard, product_edit_keyboard, confirm_delete_keyboard
-from payment import create_payment_stub
+from config import TELEGRAM_TOKEN, YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY, PAYMENT_PROVIDER, YOOKASSA_API_URL, PAYMENT_RETURN_URL, PAYMENT_TIMEOUT, PAYMENT_RETRIES, PAYMENT_WEBHOOK_HOST, PAYMENT_WEBHOOK_PORT, PAYMENT_WEBHOOK_PATH, PAYMENT_RECONCILE_INTERVAL, PAYMENT_EXPIRY, NOTIFY_RATE, IMAGES_PATH, IMAGE_MAX_SIZE, IMAGE_THUMB_SIZE, IMAGE_QUALITY, IMAGE_WORKERS, is_admin, ADMIN_USER_IDS, ADMIN_CHAT_ID, STATE_STORE, STATE_TTL, STATE_MAX_SIZE, STATE_PURGE_INTERVAL, UPDATE_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_QUEUE_SIZE, CONCURRENT_UPDATES, USER_QUEUE_SIZE, ADMIN_PAGE_SIZE, SEARCH_PAGE_SIZE, SEARCH_CACHE_TIME, ORDERS_PAGE_SIZE, METRICS_HOST, METRICS_PORT, IMPORT_CHUNK_SIZE, IMPORT_MAX_FILE_SIZE, IMPORT_PROGRESS_INTERVAL, IMPORT_ERRORS_SHOWN
+from database import init_db, close_db, get_products_page, search_products, get_product, add_to_cart, get_user_cart, clear_cart, checkout, set_order_payment_id, get_order, update_user_profile, get_user_info, get_user_orders_page, get_order_items, add_product, get_all_users, get_statistics, get_period_statistics, rebuild_statistics, get_admin_products_page, update_product, delete_product, set_product_file_id, catalog, search_cache, pool
+from keyboards import keyboard_cache, CATEGORY_NAMES, CANCEL_LABEL, menu_buttons, main_menu, category_menu, product_keyboard, cart_keyboard, checkout_keyboard, admin_orders_keyboard, cancel_keyboard, admin_edit_products_keyboard, admin_page_data, SEARCH_QUERY_MAX_BYTES, product_edit_keyboard, confirm_delete_keyboard, search_result_keyboard, PRODUCT_DEEP_LINK, orders_keyboard, order_detail_keyboard, order_status_label
+from payment import create_payment_provider, PaymentError
+from broadcast import BroadcastEngine
+from notifier import Notifier
+from payment_sync import PaymentSync
+from images import ImagePipeline, is_stored, thumbnail_path
+from state_store import create_state_store
+from webhook import run_webhook
+from dispatcher import PerUserUpdateProcessor
+from callback_router import CallbackRouter, encode
+from text_router import TextRouter
+from metrics import metrics, MetricsServer
+from product_import import import_products, detect_format
 
 # Настройка логирования
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Глобальное состояние пользователей
-user_states = {}
+# Состояния диалогов пользователей (память или SQLite, см. config.STATE_STORE)
+user_states = create_state_store(STATE_STORE, pool, ttl=STATE_TTL, max_size=STATE_MAX_SIZE)
+
+# Обработка изображений товаров в пуле процессов
+images = ImagePipeline(IMAGES_PATH, IMAGE_MAX_SIZE, IMAGE_THUMB_SIZE, IMAGE_QUALITY, IMAGE_WORKERS)
+
+# Платёжная система (заглушка или ЮKassa, см. config.PAYMENT_PROVIDER)
+payments = create_payment_provider(
+    PAYMENT_PROVIDER, YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY, PAYMENT_RETURN_URL,
+    YOOKASSA_API_URL, timeout=PAYMENT_TIMEOUT, retries=PAYMENT_RETRIES
+)
+
+# Клавиатуры товаров сбрасываются вместе с изменением каталога
+catalog.subscribe(keyboard_cache.invalidate_product)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    await save_user_info(
+    update_user_profile(
         user_id=user.id,
         username=user.username,
         first_name=user.first_name,
@@ -46,53 +67,177 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         welcome_text,
         reply_markup=main_menu(is_user_admin)
     )
+    
+    # Переход по ссылке из результата поиска: /start product_<id>
+    if context.args and context.args[0].startswith(PRODUCT_DEEP_LINK):
+        product_id = context.args[0][len(PRODUCT_DEEP_LINK):]
+        product = await get_product(int(product_id)) if product_id.isdigit() else None
+        if product and product['is_active']:
+            user_cart = await get_user_cart(user.id)
+            quantity_in_cart = sum(item['quantity'] for item in user_cart if item['product_id'] == product['id'])
+            await send_product_card(update.message, product, product_keyboard(product['id'], quantity_in_cart))
 
 async def show_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("📂 Выберите категорию:", reply_markup=category_menu())
 
-async def show_products(update: Update, context: ContextTypes.DEFAULT_TYPE):
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def product_card_text(product):
+    text = f"✨ <b>{product['name']}</b>\n"
+    text += f"💰 Цена: {product['price']} руб.\n"
+    text += f"📁 Категория: {product['category']}\n"
+    text += f"📝 {product['description']}"
+    return text
+
+# Ответы Telegram на устаревший или чужой file_id
+FILE_ID_ERRORS = ('wrong file identifier', 'wrong remote file identifier', 'file_id_invalid', 'wrong file_id')
+
+async def send_product_photo(message, product, caption, keyboard, edit=False):
+    async def send(photo):
+        if edit:
+            return await message.edit_media(
+                InputMediaPhoto(photo, caption=caption, parse_mode='HTML'),
+                reply_markup=keyboard
+            )
+        return await message.reply_photo(
+            photo=photo,
+            caption=caption,
+            parse_mode='HTML',
+            reply_markup=keyboard
+        )
+    
+    # Повторно используем file_id, чтобы не загружать файл в Telegram каждый раз
+    if product['image_file_id']:
+        try:
+            return await send(product['image_file_id'])
+        except BadRequest as e:
+            # Загружаем файл заново, только если Telegram не знает этот file_id;
+            # «message is not modified» и прочие ошибки обрабатывает вызывающий код
+            if not any(error in str(e).lower() for error in FILE_ID_ERRORS):
+                raise
+            logger.warning(f"file_id товара {product['id']} недействителен, загружаем файл заново: {e}")
+    
+    # Товар добавлен до появления обработки изображений: приводим файл
+    # к нормальному размеру один раз и запоминаем новый путь
+    image_path = product['image_path']
+    if not is_stored(image_path):
+        image_path = await images.ingest(image_path)
+        await update_product(product['id'], image_path=image_path)
+    
+    # Чтение файла выполняем вне цикла событий
+    photo = await asyncio.to_thread(read_file, image_path)
+    sent = await send(photo)
+    if isinstance(sent, Message) and sent.photo:
+        await set_product_file_id(product['id'], sent.photo[-1].file_id)
+    return sent
+
+async def send_product_card(message, product, keyboard, edit=False):
+    text = product_card_text(product)
+    
+    # Тип сообщения (фото/текст) изменить нельзя: заменяем карточку новой
+    if edit and bool(message.photo) != bool(product['image_path']):
+        await message.delete()
+        edit = False
+    
+    if product['image_path']:
+        try:
+            return await send_product_photo(message, product, text, keyboard, edit)
+        except Exception as e:
+            if isinstance(e, BadRequest) and 'not modified' in str(e):
+                raise
+            logger.warning(f"Не удалось отправить фото товара {product['id']}: {e}")
+            if edit:
+                await message.delete()
+            return await message.reply_text(text, parse_mode='HTML', reply_markup=keyboard)
+    if edit:
+        return await message.edit_text(text, parse_mode='HTML', reply_markup=keyboard)
+    return await message.reply_text(text, parse_mode='HTML', reply_markup=keyboard)
+
+async def show_products(update: Update, context: ContextTypes.DEFAULT_TYPE, category_slug='all', cursor_id=None, backward=False, edit=False):
+    # Карусель каталога: одно сообщение с одним товаром, листается кнопками ◀️/▶️
     query = update.callback_query
-    await query.answer()
+    category = CATEGORY_NAMES.get(category_slug)
     
-    # Пока показываем все товары
-    products = await get_products()
+    page = await get_products_page(category, cursor_id, limit=1, backward=backward)
+    if not page and cursor_id is not None:
+        # Дошли до края списка — переходим на другой конец
+        page = await get_products_page(category, None, limit=1, backward=backward)
     
-    if not products:
-        await query.message.reply_text("😔 Каталог пуст")
+    if not page:
+        await query.message.reply_text("😔 В этой категории пока нет товаров" if category else "😔 Каталог пуст")
         return
+    product = page[0]
     
     # Получаем корзину пользователя для отображения количества
     user_cart = await get_user_cart(query.from_user.id)
     cart_dict = {item['product_id']: item['quantity'] for item in user_cart}
     
-    for product in products:
-        text = f"✨ <b>{product['name']}</b>\n"
-        text += f"💰 Цена: {product['price']} руб.\n"
-        text += f"📁 Категория: {product['category']}\n"
-        text += f"📝 {product['description']}"
-        
-        quantity_in_cart = cart_dict.get(product['id'], 0)
-        keyboard = product_keyboard(product['id'], quantity_in_cart)
-        
-        if product['image_path']:
-            try:
-                await query.message.reply_photo(
-                    photo=open(product['image_path'], 'rb'),
-                    caption=text,
-                    parse_mode='HTML',
-                    reply_markup=keyboard
-                )
-            except:
-                await query.message.reply_text(text, parse_mode='HTML', reply_markup=keyboard)
-        else:
-            await query.message.reply_text(text, parse_mode='HTML', reply_markup=keyboard)
+    quantity_in_cart = cart_dict.get(product['id'], 0)
+    keyboard = product_keyboard(product['id'], quantity_in_cart, category_slug)
+    
+    try:
+        await send_product_card(query.message, product, keyboard, edit)
+    except BadRequest as e:
+        # Повторное нажатие на ту же кнопку: сообщение не изменилось
+        if 'not modified' not in str(e):
+            raise
+
+def thumbnail_url(product):
+    # Миниатюры раздаёт webhook-сервер, в режиме polling публичного адреса нет
+    if UPDATE_MODE != 'webhook' or not WEBHOOK_URL or not is_stored(product['image_path']):
+        return None
+    relative = os.path.relpath(thumbnail_path(product['image_path']), IMAGES_PATH)
+    return f"{WEBHOOK_URL.rstrip('/')}/images/{relative}"
+
+def search_result(product, bot_username):
+    text = product_card_text(product)
+    keyboard = search_result_keyboard(product['id'], bot_username)
+    if product['image_file_id']:
+        return InlineQueryResultCachedPhoto(
+            id=str(product['id']),
+            photo_file_id=product['image_file_id'],
+            title=product['name'],
+            caption=text,
+            parse_mode='HTML',
+            reply_markup=keyboard
+        )
+    return InlineQueryResultArticle(
+        id=str(product['id']),
+        title=product['name'],
+        description=f"{product['price']} руб. · {product['category']}",
+        input_message_content=InputTextMessageContent(text, parse_mode='HTML'),
+        reply_markup=keyboard,
+        thumbnail_url=thumbnail_url(product)
+    )
+
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Поиск товаров в inline-режиме; следующая страница запрашивается
+    # Telegram при прокрутке, её начало передаётся в offset
+    inline_query = update.inline_query
+    text = inline_query.query.strip()
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    
+    if text:
+        products = await search_products(text, offset, SEARCH_PAGE_SIZE)
+        next_offset = str(offset + len(products))
+    else:
+        # Пустой запрос — весь каталог по порядку, offset — id последнего товара
+        products = await get_products_page(None, offset or None, SEARCH_PAGE_SIZE)
+        next_offset = str(products[-1]['id']) if products else ''
+    if len(products) < SEARCH_PAGE_SIZE:
+        next_offset = ''
+    
+    results = [search_result(product, context.bot.username) for product in products]
+    await inline_query.answer(results, cache_time=SEARCH_CACHE_TIME, next_offset=next_offset)
 
 async def show_cart(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     cart_items = await get_user_cart(user_id)
     
     if not cart_items:
-        await update.message.reply_text("🛒 Ваша корзина пуста")
+        await update.effective_message.reply_text("🛒 Ваша корзина пуста")
         return
     
     total = 0
@@ -105,24 +250,52 @@ async def show_cart(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     text += f"\n<b>ИТОГО: {total} руб.</b>"
     
-    await update.message.reply_text(text, parse_mode='HTML', reply_markup=cart_keyboard())
+    await update.effective_message.reply_text(text, parse_mode='HTML', reply_markup=cart_keyboard())
 
-async def show_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def show_orders(update: Update, context: ContextTypes.DEFAULT_TYPE, direction='older', cursor_id=None, edit=False):
+    # История заказов постранично, от новых к старым
     user_id = update.effective_user.id
-    orders = await get_user_orders(user_id)
+    orders, has_newer, has_older = await get_user_orders_page(user_id, cursor_id, ORDERS_PAGE_SIZE, direction)
     
-    if not orders:
-        await update.message.reply_text("📦 У вас пока нет заказов")
+    if not orders and cursor_id is None:
+        await update.effective_message.reply_text("📦 У вас пока нет заказов")
         return
     
+    newer_data = encode("ord_page_newer_", orders[0]['id']) if orders and has_newer else None
+    older_data = encode("ord_page_older_", orders[-1]['id']) if orders and has_older else None
+    
     text = "📦 <b>Ваши заказы:</b>\n\n"
-    for order in orders:
-        text += f"🆔 Заказ #{order['id']}\n"
-        text += f"💰 Сумма: {order['total_amount']} руб.\n"
-        text += f"📅 Дата: {order['created_at']}\n"
-        text += f"📊 Статус: {order['status']}\n\n"
+    if orders:
+        text += "Выберите заказ, чтобы посмотреть состав:"
+    else:
+        text += "Заказов больше нет"
+    keyboard = orders_keyboard(orders, newer_data, older_data)
     
-    await update.message.reply_text(text, parse_mode='HTML')
+    if edit:
+        await update.effective_message.edit_text(text, parse_mode='HTML', reply_markup=keyboard)
+    else:
+        await update.effective_message.reply_text(text, parse_mode='HTML', reply_markup=keyboard)
+
+async def orders_page(update: Update, context: ContextTypes.DEFAULT_TYPE, direction, cursor_id):
+    await show_orders(update, context, direction, cursor_id, edit=True)
+
+async def order_detail(update: Update, context: ContextTypes.DEFAULT_TYPE, order_id, page_id):
+    # Состав заказа загружается только при открытии карточки
+    query = update.callback_query
+    order = await get_order(order_id)
+    if not order or order['user_id'] != query.from_user.id:
+        await query.message.reply_text("❌ Заказ не найден")
+        return
+    
+    text = f"🆔 <b>Заказ #{order['id']}</b>\n"
+    text += f"📅 Дата: {order['created_at']}\n"
+    text += f"📊 Статус: {order_status_label(order['status'])}\n\n"
+    for item in await get_order_items(order_id):
+        name = item['name'] or f"Товар #{item['product_id']}"
+        text += f"• {name} — {item['quantity']} шт. × {item['price']} руб.\n"
+    text += f"\n💰 <b>Итого: {order['total_amount']} руб.</b>"
+    
+    await query.message.edit_text(text, parse_mode='HTML', reply_markup=order_detail_keyboard(order['id'], order['status'], page_id))
 
 async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -154,76 +327,88 @@ async def support(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(text, parse_mode='HTML')
 
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Обработчики inline-кнопок, маршрутизация — в таблице callbacks ниже
+async def add_to_cart_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, product_id):
+    query = update.callback_query
+    await add_to_cart(query.from_user.id, product_id)
+    await query.message.reply_text("✅ Товар добавлен в корзину!")
+
+async def back_to_main(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    is_user_admin = is_admin(query.from_user.id)
+    await query.message.reply_text("🏠 Главное меню", reply_markup=main_menu(is_user_admin))
+
+async def back_to_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.message.reply_text("📂 Выберите категорию:", reply_markup=category_menu())
+
+async def show_category(update: Update, context: ContextTypes.DEFAULT_TYPE, category_slug):
+    await show_products(update, context, category_slug)
+
+async def catalog_prev(update: Update, context: ContextTypes.DEFAULT_TYPE, category_slug, product_id):
+    await show_products(update, context, category_slug, product_id, backward=True, edit=True)
+
+async def catalog_next(update: Update, context: ContextTypes.DEFAULT_TYPE, category_slug, product_id):
+    await show_products(update, context, category_slug, product_id, edit=True)
+
+async def checkout_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.message.reply_text("📦 Оформление заказа", reply_markup=checkout_keyboard())
+
+async def pay_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
     
-    if query.data.startswith('add_to_cart_'):
-        product_id = int(query.data.split('_')[-1])
-        await add_to_cart(query.from_user.id, product_id)
-        await query.message.reply_text("✅ Товар добавлен в корзину!")
-        
-    elif query.data == 'back_to_main':
-        is_user_admin = is_admin(query.from_user.id)
-        await query.message.reply_text("🏠 Главное меню", reply_markup=main_menu(is_user_admin))
-        
-    elif query.data == 'back_to_catalog':
-        await show_products(update, context)
-        
-    elif query.data == 'checkout':
-        await query.message.reply_text("📦 Оформление заказа", reply_markup=checkout_keyboard())
-        
-    elif query.data == 'pay_order':
-        # Здесь будет логика оплаты
-        cart_items = await get_user_cart(query.from_user.id)
-        if not cart_items:
-            await query.message.reply_text("🛒 Корзина пуста")
-            return
-            
-        total = sum(item['price'] * item['quantity'] for item in cart_items)
-        payment_url, payment_id = create_payment_stub(total, "Заказ в JoJo Shop", query.from_user.id)
-        
-        # Создаем заказ в БД
-        order_id = await create_order(query.from_user.id, total, payment_id)
-        
-        # Сохраняем элементы заказа
-        order_items = [
-            {
-                'product_id': item['product_id'],
-                'quantity': item['quantity'],
-                'price': item['price']
-            }
-            for item in cart_items
-        ]
-        await add_order_items(order_id, order_items)
-        
-        # Очищаем корзину
-        await clear_cart(query.from_user.id)
-        
-        text = f"💳 <b>Оплата заказа #{order_id}</b>\n\n"
-        text += f"💰 Сумма к оплате: {total} руб.\n\n"
-        text += "Нажмите кнопку ниже для перехода к оплате:"
-        
+    # Заказ создаётся из корзины одной транзакцией
+    result = await checkout(query.from_user.id)
+    if not result:
+        await query.message.reply_text("🛒 Корзина пуста")
+        return
+    order_id, total = result
+    await send_payment(query, order_id, total)
+
+async def retry_payment(update: Update, context: ContextTypes.DEFAULT_TYPE, order_id):
+    # Повторное создание платежа для уже оформленного заказа; ключ
+    # идемпотентности не даст создать второй платёж, если первый дошёл
+    query = update.callback_query
+    order = await get_order(order_id)
+    if not order or order['user_id'] != query.from_user.id or order['status'] != 'pending':
+        await query.message.reply_text("❌ Заказ не найден или уже оплачен")
+        return
+    await send_payment(query, order_id, order['total_amount'])
+
+async def send_payment(query, order_id, total):
+    try:
+        payment_url, payment_id = await payments.create_payment(
+            order_id, total, f"Заказ #{order_id} в JoJo Shop", query.from_user.id
+        )
+    except PaymentError as e:
+        logger.error(f"Не удалось создать платёж для заказа {order_id}: {e}")
         keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("💳 Перейти к оплате", url=payment_url)],
-            [InlineKeyboardButton("🏠 « Назад", callback_data="back_to_main")]
+            [InlineKeyboardButton("🔄 Повторить", callback_data=encode("pay_retry_", order_id))]
         ])
-        
-        await query.message.reply_text(text, parse_mode='HTML', reply_markup=keyboard)
-        
-    elif query.data.startswith('cat_'):
-        category = query.data.split('_')[1]
-        await query.message.reply_text(f"Категория: {category}")
-        
-    elif query.data == 'clear_cart':
-        await clear_cart(query.from_user.id)
-        await query.message.reply_text("🗑 Корзина очищена")
-        
-    elif query.data == 'back_to_cart':
-        await show_cart(query, context)
-        
-    elif query.data == 'back_to_admin':
-        await query.message.reply_text("👑 Админ-панель", reply_markup=main_menu(True))
+        await query.message.reply_text(
+            f"⚠️ Заказ #{order_id} оформлен, но платёжная система сейчас недоступна. Попробуйте ещё раз через минуту.",
+            reply_markup=keyboard
+        )
+        return
+    await set_order_payment_id(order_id, payment_id)
+    
+    text = f"💳 <b>Оплата заказа #{order_id}</b>\n\n"
+    text += f"💰 Сумма к оплате: {total} руб.\n\n"
+    text += "Нажмите кнопку ниже для перехода к оплате:"
+    
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("💳 Перейти к оплате", url=payment_url)],
+        [InlineKeyboardButton("🏠 « Назад", callback_data="back_to_main")]
+    ])
+    
+    await query.message.reply_text(text, parse_mode='HTML', reply_markup=keyboard)
+
+async def clear_cart_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await clear_cart(query.from_user.id)
+    await query.message.reply_text("🗑 Корзина очищена")
+
+async def back_to_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.message.reply_text("👑 Админ-панель", reply_markup=main_menu(True))
 
 # Админские функции
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -233,11 +418,11 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
     await update.message.reply_text("👑 Админ-панель JoJo Shop", reply_markup=main_menu(True))
 
+async def show_admin_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("📦 Управление заказами", reply_markup=admin_orders_keyboard())
+
 async def add_product_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        return
-        
-    user_states[update.effective_user.id] = 'adding_product'
+    await user_states.set(update.effective_user.id, 'adding_product')
     await update.message.reply_text(
         "➕ Добавление нового товара\n\n"
         "Введите данные в формате:\n"
@@ -247,43 +432,38 @@ async def add_product_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=cancel_keyboard()
     )
 
-async def handle_product_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def handle_product_input(update: Update, context: ContextTypes.DEFAULT_TYPE, state):
     user_id = update.effective_user.id
     
-    if not is_admin(user_id):
+    if update.message.text == CANCEL_LABEL:
+        await user_states.delete(user_id)
+        await update.message.reply_text("❌ Добавление товара отменено", reply_markup=main_menu(True))
         return
         
-    if user_id in user_states and user_states[user_id] == 'adding_product':
-        if update.message.text == "❌ Отмена":
-            user_states.pop(user_id, None)
-            await update.message.reply_text("❌ Добавление товара отменено", reply_markup=main_menu(True))
-            return
-            
-        try:
-            parts = update.message.text.split('|')
-            if len(parts) < 4:
-                raise ValueError("Недостаточно параметров")
-                
-            name = parts[0].strip()
-            description = parts[1].strip()
-            price = int(parts[2].strip())
-            category = parts[3].strip()
-            image_path = parts[4].strip() if len(parts) > 4 else None
-            
-            product_id = await add_product(name, description, price, category, image_path)
+    try:
+        parts = update.message.text.split('|')
+        if len(parts) < 4:
+            raise ValueError("Недостаточно параметров")
             
-            user_states.pop(user_id, None)
-            await update.message.reply_text(
-                f"✅ Товар успешно добавлен!\nID: {product_id}\nНазвание: {name}",
-                reply_markup=main_menu(True)
-            )
-        except Exception as e:
-            await update.message.reply_text(f"❌ Ошибка: {str(e)}\nПопробуйте ещё раз или нажмите 'Отмена'")
+        name = parts[0].strip()
+        description = parts[1].strip()
+        price = int(parts[2].strip())
+        category = parts[3].strip()
+        image_path = parts[4].strip() if len(parts) > 4 else None
+        if image_path:
+            image_path = await images.ingest(image_path)
+        
+        product_id = await add_product(name, description, price, category, image_path)
+        
+        await user_states.delete(user_id)
+        await update.message.reply_text(
+            f"✅ Товар успешно добавлен!\nID: {product_id}\nНазвание: {name}",
+            reply_markup=main_menu(True)
+        )
+    except Exception as e:
+        await update.message.reply_text(f"❌ Ошибка: {str(e)}\nПопробуйте ещё раз или нажмите 'Отмена'")
 
 async def show_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        return
-        
     stats = await get_statistics()
     
     text = "📊 <b>Статистика магазина:</b>\n\n"
@@ -291,12 +471,63 @@ async def show_statistics(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text += f"📦 Заказов: {stats['orders_count']}\n"
     text += f"💰 Доход: {stats['total_revenue']} руб.\n"
     
+    for period in await get_period_statistics():
+        text += f"\n📅 <b>{period['title']}:</b> заказов {period['orders_count']}, "
+        text += f"оплачено {period['paid_count']}, доход {period['revenue']} руб.\n"
+        for category in period['categories']:
+            text += f"   • {category['category'] or 'Без категории'}: {category['items_count']} шт., {category['revenue']} руб.\n"
+    
+    cache_stats = catalog.stats()
+    text += f"\n🗂 Кэш каталога: {cache_stats['size']} товаров, "
+    text += f"попаданий {cache_stats['hits']}, промахов {cache_stats['misses']} "
+    text += f"({cache_stats['hit_rate']:.0%})\n"
+    
+    processor_stats = context.application.update_processor.stats()
+    text += f"⚙️ Обновлений в работе: {processor_stats['running']}/{processor_stats['max_concurrent']}, "
+    text += f"в очередях: {processor_stats['queue_depth']} ({processor_stats['active_users']} польз.), "
+    text += f"отброшено: {processor_stats['dropped']}\n"
+    
+    keyboard_stats = keyboard_cache.stats()
+    text += f"⌨️ Кэш клавиатур: {keyboard_stats['size']}, попаданий {keyboard_stats['hits']}, "
+    text += f"промахов {keyboard_stats['misses']} ({keyboard_stats['hit_rate']:.0%})\n"
+    
+    search_stats = search_cache.stats()
+    text += f"🔍 Кэш поиска: {search_stats['size']}, попаданий {search_stats['hits']}, "
+    text += f"промахов {search_stats['misses']} ({search_stats['hit_rate']:.0%})\n"
+    
+    state_stats = await user_states.stats()
+    text += f"💬 Активных диалогов: {state_stats['size']}, вытеснено: {state_stats['evictions']}\n"
+    
     await update.message.reply_text(text, parse_mode='HTML')
 
-async def show_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def rebuild_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         return
-        
+    
+    await rebuild_statistics()
+    await update.message.reply_text("✅ Статистика пересчитана по истории заказов")
+
+def metrics_lines(kind, title, limit=10):
+    top = metrics.top(kind, limit)
+    if not top:
+        return f"\n<b>{title}</b>: вызовов пока не было\n"
+    text = f"\n<b>{title}</b> (вызовов, ошибок, среднее, p95):\n"
+    for name, timer in top:
+        average = timer.total / timer.count * 1000
+        text += f"• <code>{name}</code>: {timer.count}, {timer.errors}, {average:.1f} мс, ≤{timer.quantile(0.95) * 1000:g} мс\n"
+    return text
+
+async def show_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        return
+    
+    # Самые затратные обработчики и запросы по суммарному времени
+    text = "⏱ <b>Метрики с момента запуска</b>\n"
+    text += metrics_lines('handler', "Обработчики")
+    text += metrics_lines('query', "Запросы к БД")
+    await update.message.reply_text(text, parse_mode='HTML')
+
+async def show_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     users = await get_all_users()
     
     if not users:
@@ -313,82 +544,212 @@ async def show_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(text, parse_mode='HTML')
 
 async def broadcast_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        return
-        
-    user_states[update.effective_user.id] = 'broadcast'
+    await user_states.set(update.effective_user.id, 'broadcast')
     await update.message.reply_text(
         "📢 Рассылка сообщения всем пользователям\n\n"
         "Введите текст сообщения для рассылки:",
         reply_markup=cancel_keyboard()
     )
 
-async def handle_broadcast_input(update: Update, context: Application):
+async def handle_broadcast_input(update: Update, context: ContextTypes.DEFAULT_TYPE, state):
     user_id = update.effective_user.id
     
-    if not is_admin(user_id):
+    if update.message.text == CANCEL_LABEL:
+        await user_states.delete(user_id)
+        await update.message.reply_text("❌ Рассылка отменена", reply_markup=main_menu(True))
         return
         
-    if user_id in user_states and user_states[user_id] == 'broadcast':
-        if update.message.text == "❌ Отмена":
-            user_states.pop(user_id, None)
-            await update.message.reply_text("❌ Рассылка отменена", reply_markup=main_menu(True))
+    # Рассылка идёт в фоне, прогресс приходит отдельным сообщением
+    engine = context.bot_data['broadcast_engine']
+    broadcast_id = await engine.start(update.message.text, update.effective_chat.id)
+    
+    await user_states.delete(user_id)
+    await update.message.reply_text(
+        f"📢 Рассылка #{broadcast_id} запущена в фоне",
+        reply_markup=main_menu(True)
+    )
+
+async def import_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await user_states.set(update.effective_user.id, 'importing')
+    await update.message.reply_text(
+        "📥 Импорт товаров\n\n"
+        "Пришлите файл CSV или JSON документом. Столбцы (поля): "
+        "Артикул|Название|Описание|Цена|Категория|Изображение, артикул и изображение необязательны. "
+        "Товар с уже известным артикулом обновляется, остальные добавляются.\n\n"
+        "Чтобы только проверить файл, ничего не меняя, добавьте к нему подпись «проверка».",
+        reply_markup=cancel_keyboard()
+    )
+
+async def handle_import_input(update: Update, context: ContextTypes.DEFAULT_TYPE, state):
+    if update.message.text == CANCEL_LABEL:
+        await user_states.delete(update.effective_user.id)
+        await update.message.reply_text("❌ Импорт отменён", reply_markup=main_menu(True))
+        return
+    await update.message.reply_text("📎 Пришлите файл CSV или JSON документом или нажмите 'Отмена'")
+
+def import_report_text(report, finished):
+    if report.dry_run:
+        text = "✅ Проверка файла завершена\n" if finished else "⏳ Проверка файла...\n"
+    else:
+        text = "✅ Импорт товаров завершён\n" if finished else "⏳ Импорт товаров...\n"
+    text += f"Обработано строк: {report.rows}\n"
+    text += "Будет добавлено" if report.dry_run else "Добавлено"
+    text += f": {report.inserted}, обновлено: {report.updated}\n"
+    text += f"Ошибок: {report.failed}"
+    return text
+
+async def handle_import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    document = update.message.document
+    file_format = detect_format(document.file_name)
+    if file_format is None:
+        await update.message.reply_text("❌ Нужен файл .csv, .json или .jsonl")
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await update.message.reply_text(f"❌ Файл больше {IMPORT_MAX_FILE_SIZE // (1024 * 1024)} МБ")
+        return
+    dry_run = (update.message.caption or '').strip().lower().startswith('проверка')
+    status = await update.message.reply_text("⏳ Загружаю файл...")
+    
+    last_report = time.monotonic()
+    
+    async def progress(report):
+        nonlocal last_report
+        if time.monotonic() - last_report < IMPORT_PROGRESS_INTERVAL:
             return
-            
-        # Получаем всех пользователей
-        users = await get_all_users()
-        success_count = 0
-        fail_count = 0
-        
-        message_text = update.message.text
-        
-        # Отправляем сообщение всем пользователям
-        for user in users:
-            try:
-                await context.bot.send_message(
-                    chat_id=user['user_id'],
-                    text=f"📢 <b>Сообщение от JoJo Shop:</b>\n\n{message_text}",
-                    parse_mode='HTML'
-                )
-                success_count += 1
-            except Exception as e:
-                logger.error(f"Ошибка отправки сообщения пользователю {user['user_id']}: {e}")
-                fail_count += 1
-        
-        user_states.pop(user_id, None)
-        await update.message.reply_text(
-            f"✅ Рассылка завершена!\n"
-            f"Успешно: {success_count}\n"
-            f"Ошибок: {fail_count}",
-            reply_markup=main_menu(True)
+        last_report = time.monotonic()
+        try:
+            await status.edit_text(import_report_text(report, finished=False))
+        except BadRequest as e:
+            logger.warning(f"Не удалось обновить прогресс импорта: {e}")
+    
+    # Файл скачивается на диск и читается потоково, пачками
+    fd, path = tempfile.mkstemp(suffix='.' + file_format)
+    os.close(fd)
+    try:
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_drive(path)
+        report = await import_products(
+            path, file_format, CATEGORY_NAMES.values(), dry_run=dry_run,
+            chunk_size=IMPORT_CHUNK_SIZE, progress=progress
+        )
+    except Exception as e:
+        logger.error(f"Ошибка импорта товаров: {e}")
+        await status.edit_text(f"❌ Импорт прерван: {e}")
+        return
+    finally:
+        os.remove(path)
+    
+    text = import_report_text(report, finished=True)
+    for number, error in report.errors[:IMPORT_ERRORS_SHOWN]:
+        text += f"\n• строка {number}: {error[:200]}"
+    if report.failed > IMPORT_ERRORS_SHOWN:
+        text += f"\n… и ещё {report.failed - IMPORT_ERRORS_SHOWN}, полный список — в файле"
+    
+    # После проверки можно сразу прислать тот же файл для настоящего импорта
+    if not dry_run:
+        await user_states.delete(user_id)
+    await status.delete()
+    await update.message.reply_text(text, reply_markup=cancel_keyboard() if dry_run else main_menu(True))
+    if report.failed > IMPORT_ERRORS_SHOWN:
+        errors = '\n'.join(f"{number};{error}" for number, error in report.errors)
+        await update.message.reply_document(
+            io.BytesIO(f"строка;ошибка\n{errors}\n".encode('utf-8-sig')),
+            filename='import_errors.csv'
         )
 
+async def document_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Документы принимаются только в диалоге импорта товаров
+    user_id = update.effective_user.id
+    state = await user_states.get(user_id)
+    if TextRouter.state_name(state) == 'importing' and is_admin(user_id):
+        await handle_import_document(update, context)
+        return
+    await unknown_command(update, context)
+
+async def cancel_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE, broadcast_id):
+    # Кнопка под сообщением с прогрессом; итог пишется в то же сообщение
+    engine = context.bot_data['broadcast_engine']
+    if not await engine.cancel(broadcast_id):
+        await update.callback_query.message.reply_text(f"📢 Рассылка #{broadcast_id} уже завершена")
+
 # НОВЫЕ ФУНКЦИИ ДЛЯ РЕДАКТИРОВАНИЯ ТОВАРОВ
 # Показать меню редактирования товаров
 async def edit_products_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not is_admin(update.effective_user.id):
-        return
-        
-    products = await get_all_products()
+    await show_admin_products(update, context)
+
+# Страница списка товаров: фильтр (all/active/inactive или код категории)
+# либо поисковый запрос, листание по id в обе стороны
+async def show_admin_products(update: Update, context: ContextTypes.DEFAULT_TYPE, product_filter='all', direction='next', cursor_id=0, search=None, edit=False):
+    status, category = None, None
+    if product_filter in CATEGORY_NAMES:
+        category = CATEGORY_NAMES[product_filter]
+    elif product_filter in ('active', 'inactive'):
+        status = product_filter
+    backward = direction == 'prev'
+    
+    products, has_more = await get_admin_products_page(status, category, search, cursor_id, ADMIN_PAGE_SIZE, backward)
+    
+    # has_more говорит только о направлении листания; в обратную сторону
+    # товары есть, если страница открыта не с начала списка
+    if backward:
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = cursor_id > 0, has_more
+    prev_data = next_data = None
+    if products and has_prev:
+        prev_data = admin_page_data(product_filter, 'prev', products[0]['id'], search)
+    if products and has_next:
+        next_data = admin_page_data(product_filter, 'next', products[-1]['id'], search)
+    
+    if search is not None:
+        text = f"🔍 <b>Поиск:</b> {html.escape(search)}\n\n"
+        text += "Выберите товар для редактирования:" if products else "Ничего не найдено"
+        product_filter = None
+    else:
+        text = "✏️ <b>Редактирование товаров:</b>\n\n"
+        text += "Выберите товар для редактирования:" if products else "📦 Товары отсутствуют"
+    keyboard = admin_edit_products_keyboard(products, product_filter, prev_data, next_data)
     
-    if not products:
-        await update.message.reply_text("📦 Товары отсутствуют")
+    if edit:
+        try:
+            await update.effective_message.edit_text(text, parse_mode='HTML', reply_markup=keyboard)
+        except BadRequest as e:
+            # Повторное нажатие на ту же страницу
+            if 'not modified' not in str(e).lower():
+                raise
         return
+    await update.effective_message.reply_text(text, parse_mode='HTML', reply_markup=keyboard)
+
+async def admin_products_page(update: Update, context: ContextTypes.DEFAULT_TYPE, product_filter, direction, cursor_id):
+    await show_admin_products(update, context, product_filter, direction, cursor_id, edit=True)
+
+async def admin_search_page(update: Update, context: ContextTypes.DEFAULT_TYPE, direction, cursor_id, search):
+    await show_admin_products(update, context, direction=direction, cursor_id=cursor_id, search=search, edit=True)
+
+async def admin_search_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await user_states.set(update.effective_user.id, 'admin_search')
+    await update.effective_message.reply_text(
+        "🔍 Введите часть названия товара или его ID:",
+        reply_markup=cancel_keyboard()
+    )
+
+async def handle_search_input(update: Update, context: ContextTypes.DEFAULT_TYPE, state):
+    user_id = update.effective_user.id
+    await user_states.delete(user_id)
     
-    text = "✏️ <b>Редактирование товаров:</b>\n\n"
-    text += "Выберите товар для редактирования:"
+    if update.message.text == CANCEL_LABEL:
+        await update.message.reply_text("❌ Поиск отменён", reply_markup=main_menu(True))
+        return
     
-    await update.message.reply_text(text, parse_mode='HTML', reply_markup=admin_edit_products_keyboard(products))
+    # Запрос передаётся в callback_data кнопок листания, поэтому ограничен по длине
+    search = update.message.text.strip().encode('utf-8')[:SEARCH_QUERY_MAX_BYTES].decode('utf-8', 'ignore')
+    await update.message.reply_text("🔍 Результаты поиска:", reply_markup=main_menu(True))
+    await show_admin_products(update, context, search=search)
 
 # Показать меню редактирования конкретного товара
-async def edit_product_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def edit_product_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, product_id):
     query = update.callback_query
-    await query.answer()
-    
-    if not is_admin(query.from_user.id):
-        return
-    
-    product_id = int(query.data.split('_')[-1])
     product = await get_product(product_id)
     
     if not product:
@@ -407,16 +768,9 @@ async def edit_product_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.message.reply_text(text, parse_mode='HTML', reply_markup=product_edit_keyboard(product_id))
 
 # Начать редактирование поля
-async def start_edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def start_edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE, product_id, field):
+    # field: name, desc, price, category, image
     query = update.callback_query
-    await query.answer()
-    
-    if not is_admin(query.from_user.id):
-        return
-    
-    parts = query.data.split('_')
-    field = parts[1]  # name, desc, price, category, image
-    product_id = int(parts[2])
     
     field_names = {
         'name': 'название',
@@ -426,11 +780,11 @@ async def start_edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE):
         'image': 'путь к изображению'
     }
     
-    user_states[query.from_user.id] = {
+    await user_states.set(query.from_user.id, {
         'state': f'editing_{field}',
         'product_id': product_id,
         'field': field
-    }
+    })
     
     await query.message.reply_text(
         f"📝 Введите новое {field_names.get(field, field)} товара:",
@@ -438,21 +792,11 @@ async def start_edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 # Обработать ввод нового значения
-async def handle_edit_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def handle_edit_input(update: Update, context: ContextTypes.DEFAULT_TYPE, state_info):
     user_id = update.effective_user.id
     
-    if not is_admin(user_id):
-        return
-    
-    if user_id not in user_states or not isinstance(user_states[user_id], dict):
-        return
-    
-    state_info = user_states[user_id]
-    if not state_info.get('state', '').startswith('editing_'):
-        return
-    
-    if update.message.text == "❌ Отмена":
-        user_states.pop(user_id, None)
+    if update.message.text == CANCEL_LABEL:
+        await user_states.delete(user_id)
         await update.message.reply_text("❌ Редактирование отменено", reply_markup=main_menu(True))
         return
     
@@ -475,12 +819,16 @@ async def handle_edit_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif field == 'category':
         update_fields['category'] = new_value
     elif field == 'image':
-        update_fields['image_path'] = new_value
+        try:
+            update_fields['image_path'] = await images.ingest(new_value)
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {e}. Попробуйте ещё раз:")
+            return
     
     success = await update_product(product_id, **update_fields)
     
     if success:
-        user_states.pop(user_id, None)
+        await user_states.delete(user_id)
         await update.message.reply_text(
             "✅ Товар успешно обновлён!",
             reply_markup=main_menu(True)
@@ -489,14 +837,8 @@ async def handle_edit_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Ошибка при обновлении товара. Попробуйте ещё раз.")
 
 # Удаление товара
-async def delete_product_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def delete_product_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE, product_id):
     query = update.callback_query
-    await query.answer()
-    
-    if not is_admin(query.from_user.id):
-        return
-    
-    product_id = int(query.data.split('_')[-1])
     product = await get_product(product_id)
     
     if not product:
@@ -515,14 +857,8 @@ async def delete_product_confirm(update: Update, context: ContextTypes.DEFAULT_T
     )
 
 # Подтверждение удаления
-async def confirm_delete_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def confirm_delete_product(update: Update, context: ContextTypes.DEFAULT_TYPE, product_id):
     query = update.callback_query
-    await query.answer()
-    
-    if not is_admin(query.from_user.id):
-        return
-    
-    product_id = int(query.data.split('_')[-1])
     
     success = await delete_product(product_id)
     
@@ -537,73 +873,171 @@ async def confirm_delete_product(update: Update, context: ContextTypes.DEFAULT_T
             reply_markup=main_menu(True)
         )
 
+# Таблица маршрутов inline-кнопок
+callbacks = CallbackRouter()
+callbacks.exact('back_to_main', back_to_main)
+callbacks.exact('back_to_catalog', back_to_catalog)
+callbacks.exact('checkout', checkout_start)
+callbacks.exact('pay_order', pay_order)
+callbacks.prefix('pay_retry_', retry_payment, int)
+callbacks.prefix('ord_page_', orders_page, str, int)
+callbacks.prefix('order_', order_detail, int, int)
+callbacks.exact('clear_cart', clear_cart_callback)
+callbacks.exact('back_to_cart', show_cart)
+callbacks.exact('back_to_admin', back_to_admin, admin=True)
+callbacks.prefix('broadcast_cancel_', cancel_broadcast, int, admin=True)
+callbacks.exact('admin_edit_menu', edit_products_menu, admin=True)
+callbacks.exact('adm_search', admin_search_start, admin=True)
+callbacks.prefix('adm_list_', admin_products_page, str, str, int, admin=True)
+callbacks.prefix('adm_find_', admin_search_page, str, int, str, admin=True)
+callbacks.prefix('add_to_cart_', add_to_cart_callback, int)
+callbacks.prefix('cat_', show_category, str)
+callbacks.prefix('nav_prev_', catalog_prev, str, int)
+callbacks.prefix('nav_next_', catalog_next, str, int)
+callbacks.prefix('edit_product_', edit_product_menu, int, admin=True)
+for edit_field in ('name', 'desc', 'price', 'category', 'image'):
+    callbacks.prefix(f'edit_{edit_field}_', functools.partial(start_edit_field, field=edit_field), int, admin=True)
+callbacks.prefix('delete_product_', delete_product_confirm, int, admin=True)
+callbacks.prefix('confirm_delete_', confirm_delete_product, int, admin=True)
+
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await callbacks.dispatch(update, context)
+
 async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    
-    # Проверяем, находится ли пользователь в состоянии редактирования
-    if user_id in user_states:
-        state = user_states[user_id]
-        if isinstance(state, dict) and state.get('state', '').startswith('editing_'):
-            await handle_edit_input(update, context)
-            return
-        elif isinstance(state, str):
-            # Старая система состояний (добавление товара, рассылка)
-            if state == 'adding_product':
-                await handle_product_input(update, context)
-                return
-            elif state == 'broadcast':
-                await handle_broadcast_input(update, context.application)
-                return
-    
     await update.message.reply_text("❓ Неизвестная команда. Используйте меню для навигации.")
 
-def main():
-    # Инициализация базы данных
-    asyncio.run(init_db())
+# Таблица маршрутов текстовых сообщений. Надписи берутся из меню в
+# keyboards.py, поэтому кнопка без обработчика упадёт при запуске.
+# Флаг admin: маршрут доступен только админам.
+MENU_ACTIONS = {
+    'catalog': (show_catalog, False),
+    'cart': (show_cart, False),
+    'orders': (show_orders, False),
+    'profile': (show_profile, False),
+    'payment': (show_cart, False),
+    'support': (support, False),
+    'add_product': (add_product_start, True),
+    'edit_products': (edit_products_menu, True),
+    'statistics': (show_statistics, True),
+    'admin_orders': (show_admin_orders, True),
+    'users': (show_users, True),
+    'broadcast': (broadcast_start, True),
+    'import_products': (import_start, True),
+    'main_menu': (start, False),
+    'admin_panel': (admin_panel, False),
+}
+
+texts = TextRouter(user_states, fallback=unknown_command)
+for label, action in menu_buttons():
+    handler, admin_only = MENU_ACTIONS[action]
+    texts.route(label, handler, admin=admin_only)
+
+# Ввод в рамках диалога: состояние из user_states -> обработчик
+texts.state('adding_product', handle_product_input, admin=True)
+texts.state('broadcast', handle_broadcast_input, admin=True)
+texts.state('editing', handle_edit_input, admin=True)
+texts.state('admin_search', handle_search_input, admin=True)
+texts.state('importing', handle_import_input, admin=True)
+
+async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await texts.dispatch(update, context)
+
+async def purge_states_loop():
+    # Периодически удаляем просроченные состояния диалогов
+    while True:
+        await asyncio.sleep(STATE_PURGE_INTERVAL)
+        try:
+            await user_states.purge()
+        except Exception as e:
+            logger.error(f"Ошибка очистки состояний: {e}")
+
+async def on_startup(application: Application):
+    # Инициализация базы данных и пула соединений в цикле событий бота
+    await init_db()
+    images.start()
+    await payments.start()
+    application.bot_data['state_purge'] = asyncio.create_task(purge_states_loop())
+    
+    # Фоновые рассылки: продолжаем прерванные перезапуском
+    engine = BroadcastEngine(application.bot)
+    application.bot_data['broadcast_engine'] = engine
+    await engine.resume()
+    
+    # Статусы оплаты: уведомления платёжной системы и периодическая сверка
+    notifier = Notifier(application.bot, rate=NOTIFY_RATE)
+    notifier.start()
+    application.bot_data['notifier'] = notifier
+    payment_sync = PaymentSync(payments, notifier, ADMIN_CHAT_ID, interval=PAYMENT_RECONCILE_INTERVAL, expiry=PAYMENT_EXPIRY)
+    payment_sync.start()
+    if PAYMENT_WEBHOOK_PORT:
+        await payment_sync.serve(PAYMENT_WEBHOOK_HOST, PAYMENT_WEBHOOK_PORT, PAYMENT_WEBHOOK_PATH)
+    application.bot_data['payment_sync'] = payment_sync
+    
+    # Метрики для Prometheus
+    metrics_server = MetricsServer(metrics)
+    if METRICS_PORT:
+        await metrics_server.start(METRICS_HOST, METRICS_PORT)
+    application.bot_data['metrics_server'] = metrics_server
+
+async def on_shutdown(application: Application):
+    application.bot_data['state_purge'].cancel()
+    await application.bot_data['broadcast_engine'].stop()
+    await application.bot_data['payment_sync'].stop()
+    await application.bot_data['notifier'].stop()
+    await application.bot_data['metrics_server'].stop()
+    await images.close()
+    await payments.close()
+    await close_db()
+
+def add_handlers(application):
+    # Обработчики команд; время и ошибки каждого обработчика учитываются
+    # в metrics (обработчики кнопок и текста — в своих таблицах маршрутов)
+    application.add_handler(CommandHandler("start", metrics.instrument('handler', start)))
+    application.add_handler(CommandHandler("rebuild_stats", metrics.instrument('handler', rebuild_stats)))
+    application.add_handler(CommandHandler("stats", metrics.instrument('handler', show_metrics)))
     
-    # Создание приложения
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
-    
-    # Обработчики команд
-    application.add_handler(CommandHandler("start", start))
-    
-    # Обработчики текстовых сообщений
-    application.add_handler(MessageHandler(filters.Regex("🛍 Каталог"), show_catalog))
-    application.add_handler(MessageHandler(filters.Regex("🛒 Корзина"), show_cart))
-    application.add_handler(MessageHandler(filters.Regex("📦 Мои заказы"), show_orders))
-    application.add_handler(MessageHandler(filters.Regex("👤 Профиль"), show_profile))
-    application.add_handler(MessageHandler(filters.Regex("📞 Поддержка"), support))
-    application.add_handler(MessageHandler(filters.Regex("🏠 Главное меню"), start))
-    
-    # Админские функции
-    application.add_handler(MessageHandler(filters.Regex("➕ Добавить товар"), add_product_start))
-    application.add_handler(MessageHandler(filters.Regex("📊 Статистика"), show_statistics))
-    application.add_handler(MessageHandler(filters.Regex("👥 Пользователи"), show_users))
-    application.add_handler(MessageHandler(filters.Regex("📢 Рассылка"), broadcast_start))
-    application.add_handler(MessageHandler(filters.Regex("👑 Админ-панель"), admin_panel))
-    
-    # НОВЫЕ АДМИНСКИЕ ФУНКЦИИ
-    application.add_handler(MessageHandler(filters.Regex("✏️ Редактировать товары"), edit_products_menu))
-    
-    # Обработчики кнопок
-    application.add_handler(CallbackQueryHandler(button_handler))
+    # Все текстовые сообщения (меню и ввод в диалогах) — одна таблица маршрутов (texts)
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler))
     
-    # НОВЫЕ CALLBACK ОБРАБОТЧИКИ
-    application.add_handler(CallbackQueryHandler(edit_product_menu, pattern=r'^edit_product_\d+$'))
-    application.add_handler(CallbackQueryHandler(start_edit_field, pattern=r'^edit_(name|desc|price|category|image)_\d+$'))
-    application.add_handler(CallbackQueryHandler(delete_product_confirm, pattern=r'^delete_product_\d+$'))
-    application.add_handler(CallbackQueryHandler(confirm_delete_product, pattern=r'^confirm_delete_\d+$'))
-    application.add_handler(CallbackQueryHandler(lambda u, c: edit_products_menu(u, c), pattern=r'^admin_edit_menu$'))
+    # Файлы для импорта товаров
+    application.add_handler(MessageHandler(filters.Document.ALL, metrics.instrument('handler', document_handler)))
     
-    # Обработчик всех текстовых сообщений (для состояний)
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, unknown_command))
+    # Все inline-кнопки обрабатываются одной таблицей маршрутов (callbacks)
+    application.add_handler(CallbackQueryHandler(button_handler))
+    
+    # Поиск товаров: @бот запрос (inline-режим включается в @BotFather)
+    application.add_handler(InlineQueryHandler(metrics.instrument('handler', inline_search)))
+
+def main():
+    # Создание приложения
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES, USER_QUEUE_SIZE))
+        .build()
+    )
+    add_handlers(application)
     
     # Запуск бота
     print("🤖 JoJo Shop Bot запущен!")
     print("Для остановки нажмите Ctrl+C")
     
     try:
-        application.run_polling()
+        if UPDATE_MODE == 'webhook':
+            asyncio.run(run_webhook(
+                application,
+                url=WEBHOOK_URL,
+                path=WEBHOOK_PATH,
+                host=WEBHOOK_HOST,
+                port=WEBHOOK_PORT,
+                secret_token=WEBHOOK_SECRET,
+                queue_size=WEBHOOK_QUEUE_SIZE,
+                images_path=IMAGES_PATH,
+            ))
+        else:
+            application.run_polling()
     except KeyboardInterrupt:
         print("\n🛑 Бот остановлен")
     except Exception as e:
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from config import BROADCAST_RATE, BROADCAST_BATCH_SIZE, BROADCAST_CONCURRENCY
+from database import (
+    get_users_batch, create_broadcast, get_broadcast, get_running_broadcasts,
+    update_broadcast_progress, set_broadcast_status,
+)
+from keyboards import broadcast_keyboard
+
+logger = logging.getLogger(__name__)
+
+# Как часто обновлять сообщение с прогрессом у админа (секунды)
+PROGRESS_INTERVAL = 5
+
+
+class TokenBucket:
+    """Ограничитель скорости: не больше rate отправок в секунду в среднем."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def pause(self, seconds):
+        # После RetryAfter останавливаем все отправки, а не только одну
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def format_broadcast(text):
+    return f"📢 <b>Сообщение от JoJo Shop:</b>\n\n{text}"
+
+
+class BroadcastEngine:
+    """Фоновые рассылки с сохранением прогресса в SQLite.
+
+    Получатели читаются пачками по users.user_id, внутри пачки сообщения
+    отправляются параллельно через общий TokenBucket. После каждой пачки
+    курсор и счётчики сохраняются, поэтому после перезапуска рассылка
+    продолжается с места остановки (resume).
+    """
+
+    def __init__(self, bot, rate=BROADCAST_RATE, batch_size=BROADCAST_BATCH_SIZE, concurrency=BROADCAST_CONCURRENCY):
+        self.bot = bot
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate)
+        self._tasks = {}
+
+    async def start(self, text, admin_chat_id):
+        status = await self.bot.send_message(admin_chat_id, "📢 Рассылка запускается...")
+        broadcast_id = await create_broadcast(text, admin_chat_id, status.message_id)
+        await self._report({'id': broadcast_id, 'admin_chat_id': admin_chat_id, 'status_message_id': status.message_id},
+                           f"📢 Рассылка #{broadcast_id} запускается...", broadcast_keyboard(broadcast_id))
+        self._spawn(broadcast_id)
+        return broadcast_id
+
+    async def resume(self):
+        for job in await get_running_broadcasts():
+            logger.info(f"Продолжаем рассылку #{job['id']} с пользователя {job['cursor_user_id']}")
+            self._spawn(job['id'])
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def cancel(self, broadcast_id):
+        """Останавливает рассылку; False, если она уже завершена или отменена."""
+        job = await get_broadcast(broadcast_id)
+        if not job or job['status'] != 'running':
+            return False
+        task = self._tasks.get(broadcast_id)
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await set_broadcast_status(broadcast_id, 'cancelled')
+        job = await get_broadcast(broadcast_id)
+        await self._report(job, f"⛔ Рассылка #{broadcast_id} остановлена\n"
+                                f"Успешно: {job['sent_count']}\n"
+                                f"Ошибок: {job['failed_count']}")
+        return True
+
+    def _spawn(self, broadcast_id):
+        if broadcast_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda t: self._on_done(broadcast_id, t))
+
+    def _on_done(self, broadcast_id, task):
+        self._tasks.pop(broadcast_id, None)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Рассылка #{broadcast_id} прервана: {task.exception()}")
+
+    async def _send(self, user_id, text, semaphore):
+        async with semaphore:
+            while True:
+                await self.bucket.acquire()
+                try:
+                    await self.bot.send_message(chat_id=user_id, text=text, parse_mode='HTML')
+                    return True
+                except RetryAfter as e:
+                    logger.warning(f"Рассылка: лимит Telegram, пауза {e.retry_after} с")
+                    self.bucket.pause(e.retry_after)
+                except (Forbidden, BadRequest) as e:
+                    # Пользователь заблокировал бота или чат не существует — повтор не поможет
+                    logger.info(f"Рассылка: пользователь {user_id} недоступен: {e}")
+                    return False
+                except Exception as e:
+                    logger.error(f"Ошибка отправки сообщения пользователю {user_id}: {e}")
+                    return False
+
+    async def _run(self, broadcast_id):
+        job = await get_broadcast(broadcast_id)
+        text = format_broadcast(job['text'])
+        cursor_user_id = job['cursor_user_id']
+        sent, failed = job['sent_count'], job['failed_count']
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+        sent_this_run = 0
+        last_report = 0.0
+
+        while True:
+            user_ids = await get_users_batch(cursor_user_id, self.batch_size)
+            if not user_ids:
+                break
+            results = await asyncio.gather(*(self._send(user_id, text, semaphore) for user_id in user_ids))
+            batch_sent = sum(results)
+            batch_failed = len(results) - batch_sent
+            cursor_user_id = user_ids[-1]
+            await update_broadcast_progress(broadcast_id, cursor_user_id, batch_sent, batch_failed)
+            sent += batch_sent
+            failed += batch_failed
+            sent_this_run += len(results)
+
+            if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                rate = sent_this_run / max(last_report - started, 1e-6)
+                await self._report(job, f"📢 Рассылка #{broadcast_id} идёт...\n"
+                                        f"Обработано: {sent + failed} из {job['total_count']}\n"
+                                        f"Успешно: {sent}\n"
+                                        f"Ошибок: {failed}\n"
+                                        f"Скорость: {rate:.1f} сообщ./с",
+                                   broadcast_keyboard(broadcast_id))
+
+        await set_broadcast_status(broadcast_id, 'done')
+        elapsed = time.monotonic() - started
+        await self._report(job, f"✅ Рассылка #{broadcast_id} завершена!\n"
+                                f"Успешно: {sent}\n"
+                                f"Ошибок: {failed}\n"
+                                f"Время: {elapsed:.0f} с")
+
+    async def _report(self, job, text, keyboard=None):
+        try:
+            await self.bot.edit_message_text(text, chat_id=job['admin_chat_id'], message_id=job['status_message_id'],
+                                             reply_markup=keyboard)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить прогресс рассылки #{job['id']}: {e}")
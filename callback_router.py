@@ -0,0 +1,84 @@
+import logging
+
+from config import is_admin
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ограничение Telegram на размер callback_data
+MAX_CALLBACK_DATA = 64
+SEPARATOR = '_'
+
+
+def encode(prefix, *args):
+    """callback_data вида "<prefix><arg1>_<arg2>", например add_to_cart_15."""
+    data = prefix + SEPARATOR.join(str(arg) for arg in args)
+    if len(data.encode('utf-8')) > MAX_CALLBACK_DATA:
+        raise ValueError(f"callback_data длиннее {MAX_CALLBACK_DATA} байт: {data}")
+    return data
+
+
+class CallbackRouter:
+    """Маршрутизация callback_data без цепочки if/elif и регулярных выражений.
+
+    Точные значения ищутся в словаре, параметризованные действия — по
+    самому длинному совпавшему префиксу в дереве префиксов. Остаток строки
+    после префикса разбирается на аргументы один раз и передаётся в
+    обработчик: handler(update, context, *args). Время и ошибки каждого
+    обработчика учитываются в metrics.
+    """
+
+    def __init__(self):
+        self._exact = {}
+        self._trie = {}
+        self.unhandled = 0
+
+    def exact(self, data, handler, admin=False):
+        self._exact[data] = (metrics.instrument('handler', handler), (), admin)
+
+    def prefix(self, prefix, handler, *arg_types, admin=False):
+        node = self._trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[None] = (metrics.instrument('handler', handler), arg_types, admin)
+
+    def resolve(self, data):
+        route = self._exact.get(data)
+        if route:
+            return route[0], (), route[2]
+
+        # Самый длинный префикс, для которого зарегистрирован обработчик
+        node, match, match_end = self._trie, None, 0
+        for i, char in enumerate(data):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                match, match_end = node[None], i + 1
+        if match is None:
+            return None
+
+        handler, arg_types, admin = match
+        rest = data[match_end:]
+        parts = rest.split(SEPARATOR, len(arg_types) - 1) if arg_types else ([rest] if rest else [])
+        if len(parts) != len(arg_types):
+            return None
+        try:
+            args = tuple(arg_type(part) for arg_type, part in zip(arg_types, parts))
+        except ValueError:
+            return None
+        return handler, args, admin
+
+    async def dispatch(self, update, context):
+        query = update.callback_query
+        await query.answer()
+
+        route = self.resolve(query.data or '')
+        if route is None:
+            self.unhandled += 1
+            logger.info(f"Необработанный callback '{query.data}' от пользователя {query.from_user.id}")
+            return
+        handler, args, admin = route
+        if admin and not is_admin(query.from_user.id):
+            return
+        await handler(update, context, *args)
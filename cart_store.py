@@ -0,0 +1,128 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+UPSERT_SQL = '''
+    INSERT INTO cart (user_id, product_id, quantity)
+    VALUES (?, ?, ?)
+    ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+'''
+
+
+class CartStore:
+    """Корзины в памяти с отложенной пакетной записью в SQLite.
+
+    Добавления копятся как приращения количества по (user_id, product_id)
+    и записываются одной транзакцией раз в flush_interval секунд и при
+    остановке. Режим durability='sync' пишет каждое изменение сразу —
+    медленнее, но без потерь при падении процесса. Удаление и очистка
+    корзины всегда пишутся сразу.
+    """
+
+    def __init__(self, pool, durability='batched', flush_interval=1.0, max_carts=10000):
+        self.pool = pool
+        self.durability = durability
+        self.flush_interval = flush_interval
+        self.max_carts = max_carts
+        self._carts = OrderedDict()
+        self._pending = {}
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def start(self):
+        if self.durability == 'batched' and self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    @property
+    def pending_count(self):
+        return len(self._pending)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи корзин: {e}")
+
+    async def flush(self, user_id=None):
+        async with self._lock:
+            if user_id is None:
+                batch, self._pending = self._pending, {}
+            else:
+                batch = {key: delta for key, delta in self._pending.items() if key[0] == user_id}
+                for key in batch:
+                    del self._pending[key]
+            if not batch:
+                return
+            try:
+                async with self.pool.writer() as db:
+                    await db.executemany(UPSERT_SQL, [(u, p, delta) for (u, p), delta in batch.items()])
+            except Exception:
+                # Возвращаем приращения обратно, чтобы не потерять их
+                for key, delta in batch.items():
+                    self._pending[key] = self._pending.get(key, 0) + delta
+                raise
+
+    async def _load(self, user_id):
+        cart = self._carts.get(user_id)
+        if cart is not None:
+            self._carts.move_to_end(user_id)
+            return cart
+        async with self._lock:
+            async with self.pool.reader() as db:
+                async with db.execute('SELECT product_id, quantity FROM cart WHERE user_id = ?', (user_id,)) as cursor:
+                    cart = {row['product_id']: row['quantity'] for row in await cursor.fetchall()}
+            for (u, product_id), delta in self._pending.items():
+                if u == user_id:
+                    cart[product_id] = cart.get(product_id, 0) + delta
+        self._carts[user_id] = cart
+        while len(self._carts) > self.max_carts:
+            self._carts.popitem(last=False)
+        return cart
+
+    async def get(self, user_id):
+        return dict(await self._load(user_id))
+
+    async def add(self, user_id, product_id, quantity=1):
+        cart = self._carts.get(user_id)
+        if cart is not None:
+            cart[product_id] = cart.get(product_id, 0) + quantity
+        key = (user_id, product_id)
+        self._pending[key] = self._pending.get(key, 0) + quantity
+        if self.durability != 'batched':
+            await self.flush(user_id)
+
+    async def remove(self, user_id, product_id):
+        async with self._lock:
+            self._pending.pop((user_id, product_id), None)
+            cart = self._carts.get(user_id)
+            if cart is not None:
+                cart.pop(product_id, None)
+            async with self.pool.writer() as db:
+                await db.execute('DELETE FROM cart WHERE user_id = ? AND product_id = ?', (user_id, product_id))
+
+    async def clear(self, user_id):
+        async with self._lock:
+            self._drop_pending(user_id)
+            self._carts[user_id] = {}
+            async with self.pool.writer() as db:
+                await db.execute('DELETE FROM cart WHERE user_id = ?', (user_id,))
+
+    def reset(self, user_id):
+        # Корзина очищена в БД другим путём (например, при оформлении заказа)
+        self._drop_pending(user_id)
+        self._carts[user_id] = {}
+
+    def _drop_pending(self, user_id):
+        for key in [key for key in self._pending if key[0] == user_id]:
+            del self._pending[key]
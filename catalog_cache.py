@@ -0,0 +1,102 @@
+import asyncio
+import bisect
+
+
+class CatalogCache:
+    """Каталог товаров в памяти процесса.
+
+    Загружается целиком одним запросом при первом обращении, после чего
+    get_products_page/get_product отвечают без обращения к SQLite. Функции,
+    изменяющие товары, обновляют кэш точечно через put() или сбрасывают
+    его через invalidate(). Подписчики subscribe() узнают об изменениях:
+    callback(product_id) после put(), callback(None) после invalidate().
+    """
+
+    def __init__(self):
+        self._products = {}
+        self._views = {}
+        self._loaded = False
+        self._version = 0
+        self._listeners = []
+        self.hits = 0
+        self.misses = 0
+        # Загрузку выполняет один обработчик, остальные ждут её результата
+        self.load_lock = asyncio.Lock()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def begin_load(self):
+        # Запоминаем версию, чтобы не затереть изменения, сделанные во время загрузки
+        return self._version
+
+    def finish_load(self, rows, version):
+        if version != self._version:
+            return False
+        self._products = {row['id']: row for row in rows}
+        self._reset_views()
+        self._loaded = True
+        return True
+
+    def _reset_views(self):
+        self._views = {}
+
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    def _notify(self, product_id):
+        for callback in self._listeners:
+            callback(product_id)
+
+    def put(self, row):
+        self._version += 1
+        if self._loaded:
+            self._products[row['id']] = row
+            self._reset_views()
+        self._notify(row['id'])
+
+    def invalidate(self):
+        self._version += 1
+        self._products = {}
+        self._reset_views()
+        self._loaded = False
+        self._notify(None)
+
+    def record(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def get_product(self, product_id):
+        return self._products.get(product_id)
+
+    def _view(self, category=None):
+        # Активные товары (всего каталога или категории) по возрастанию id
+        # вместе со списком id для бинарного поиска при листании
+        key = category or None
+        if key not in self._views:
+            if key is None:
+                items = [p for _, p in sorted(self._products.items()) if p['is_active']]
+            else:
+                items = [p for p in self._view()[0] if p['category'] == key]
+            self._views[key] = (items, [p['id'] for p in items])
+        return self._views[key]
+
+    def get_page(self, category=None, cursor_id=None, limit=1, backward=False):
+        items, ids = self._view(category)
+        if backward:
+            end = len(ids) if cursor_id is None else bisect.bisect_left(ids, cursor_id)
+            return items[max(0, end - limit):end][::-1]
+        start = 0 if cursor_id is None else bisect.bisect_right(ids, cursor_id)
+        return items[start:start + limit]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self._products),
+        }
@@ -10,11 +10,101 @@ ADMIN_CHAT_ID = ADMIN_USER_IDS[0]
 # Платежи ЮKassa (опционально)
 YOOKASSA_SHOP_ID = ''      # Оставьте пустым если не используете
 YOOKASSA_SECRET_KEY = ''   # Оставьте пустым если не используете
+# Платёжная система: 'stub' — заглушка, 'yookassa' — ЮKassa
+PAYMENT_PROVIDER = 'stub'
+YOOKASSA_API_URL = 'https://api.yookassa.ru/v3'  # Для проверки — адрес fake_yookassa.py
+PAYMENT_RETURN_URL = 'https://t.me/your_bot'  # Куда вернуть покупателя после оплаты
+PAYMENT_TIMEOUT = 10  # Таймаут запроса к платёжной системе, секунд
+PAYMENT_RETRIES = 3  # Повторов при сбоях сети и ошибках 5xx
+# Уведомления ЮKassa о платежах: HTTP-сервер бота (0 — не запускать;
+# в личном кабинете ЮKassa указывается внешний адрес, проксируемый сюда)
+PAYMENT_WEBHOOK_HOST = '0.0.0.0'
+PAYMENT_WEBHOOK_PORT = 0
+PAYMENT_WEBHOOK_PATH = '/yookassa'
+PAYMENT_RECONCILE_INTERVAL = 60  # Как часто сверять неоплаченные заказы, секунд
+# Сколько секунд после создания платежа сверка следит за ним. ЮKassa за это
+# время проводит или отменяет платёж; заказы с более старыми платежами
+# (например, от заглушки) сверка не трогает, их статус меняется вручную
+PAYMENT_EXPIRY = 7 * 24 * 3600
+NOTIFY_RATE = 10  # Уведомлений об оплате в секунду
 
 # Пути к файлам
 DATABASE_PATH = 'data/products.db'
 IMAGES_PATH = 'data/images/'
 
+# База данных
+DB_READ_POOL_SIZE = 4  # Количество соединений для чтения в пуле
+# Запись корзин: 'batched' — изменения копятся и пишутся пачкой раз в
+# CART_FLUSH_INTERVAL секунд (при падении процесса можно потерять последние
+# добавления), 'sync' — каждое изменение записывается сразу
+CART_DURABILITY = 'batched'
+CART_FLUSH_INTERVAL = 1.0
+USER_FLUSH_INTERVAL = 2.0  # Интервал пакетной записи профилей пользователей
+
+# Состояния диалогов: 'memory' — в памяти процесса, 'sqlite' — в базе
+# (переживают перезапуск, общие для нескольких процессов бота)
+STATE_STORE = 'memory'
+STATE_TTL = 3600  # Через сколько секунд незавершённый диалог забывается
+STATE_MAX_SIZE = 10000  # Максимум состояний в памяти
+STATE_PURGE_INTERVAL = 300  # Интервал удаления просроченных состояний
+
+# Рассылки
+BROADCAST_RATE = 25  # Сообщений в секунду (лимит Telegram ~30)
+BROADCAST_BATCH_SIZE = 500  # Пользователей в одной пачке
+BROADCAST_CONCURRENCY = 20  # Одновременных отправок
+
+# Получение обновлений: 'polling' (getUpdates) или 'webhook' (aiohttp-сервер)
+UPDATE_MODE = 'polling'
+WEBHOOK_URL = ''  # Публичный адрес, например https://shop.example.com (пусто — не регистрировать webhook)
+WEBHOOK_PATH = '/telegram'
+WEBHOOK_HOST = '0.0.0.0'
+WEBHOOK_PORT = 8080
+# Секрет для заголовка X-Telegram-Bot-Api-Secret-Token. Пустой — генерируется
+# при запуске (если задан WEBHOOK_URL), иначе бот в режиме webhook не запустится
+WEBHOOK_SECRET = ''
+WEBHOOK_QUEUE_SIZE = 1000  # Максимум необработанных обновлений в очереди
+
+# Сколько обновлений разных пользователей обрабатывается одновременно
+# (обновления одного пользователя всегда идут по порядку)
+CONCURRENT_UPDATES = 64
+# Сколько обновлений одного пользователя может ждать своей очереди;
+# остальные отбрасываются, чтобы один пользователь не занял бота
+USER_QUEUE_SIZE = 20
+
+# Сколько клавиатур с параметрами (карточки товаров, меню редактирования)
+# хранится в памяти
+KEYBOARD_CACHE_SIZE = 2048
+
+# Заказов на одной странице истории заказов
+ORDERS_PAGE_SIZE = 5
+
+# Товаров на одной странице списка редактирования в админке
+ADMIN_PAGE_SIZE = 10
+
+# Изображения товаров: большая сторона фото и миниатюры (px), качество
+# JPEG и число процессов для обработки
+IMAGE_MAX_SIZE = 1280
+IMAGE_THUMB_SIZE = 320
+IMAGE_QUALITY = 85
+IMAGE_WORKERS = 2
+
+# Поиск товаров (inline-режим: @бот запрос)
+SEARCH_PAGE_SIZE = 20  # Результатов в одном ответе (максимум Telegram — 50)
+SEARCH_CACHE_SIZE = 1000  # Сколько страниц результатов хранить в памяти
+SEARCH_CACHE_TIME = 60  # Сколько секунд Telegram может кэшировать ответ
+
+# Массовый импорт товаров из CSV/JSON (админка, «📥 Импорт товаров»)
+IMPORT_CHUNK_SIZE = 500  # Строк в одной транзакции записи
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024  # Больше бот скачать не может (лимит Bot API)
+IMPORT_PROGRESS_INTERVAL = 3  # Как часто обновлять сообщение с прогрессом (секунды)
+IMPORT_ERRORS_SHOWN = 20  # Ошибок в итоговом сообщении, полный список — файлом
+
+# Метрики обработчиков и запросов к БД в формате Prometheus:
+# GET http://METRICS_HOST:METRICS_PORT/metrics (0 — сервер не запускается,
+# метрики доступны только командой /stats)
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 0
+
 # Другие настройки
 BOT_NAME = "JoJo Shop"
 
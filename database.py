@@ -1,263 +1,520 @@
-import aiosqlite
-import asyncio
+import inspect
 import os
-from config import DATABASE_PATH
+from config import DATABASE_PATH, DB_READ_POOL_SIZE, CART_DURABILITY, CART_FLUSH_INTERVAL, USER_FLUSH_INTERVAL, SEARCH_CACHE_SIZE
+from db_pool import ConnectionPool
+from catalog_cache import CatalogCache
+from cart_store import CartStore
+from user_store import UserProfileStore
+from stats import BACKFILL as STATS_BACKFILL, PERIODS as STATS_PERIODS
+from search import QUERY as SEARCH_QUERY, SearchCache, build_match
+from migrations import migrate
+from metrics import metrics
+
+# Общий пул соединений, открывается в init_db и закрывается в close_db
+pool = ConnectionPool(DATABASE_PATH, read_size=DB_READ_POOL_SIZE)
+
+# Кэш каталога: чтение товаров обслуживается из памяти
+catalog = CatalogCache()
+
+# Корзины в памяти с пакетной записью изменений
+carts = CartStore(pool, durability=CART_DURABILITY, flush_interval=CART_FLUSH_INTERVAL)
+
+# Профили пользователей: пишутся только при изменении, пачками в фоне
+profiles = UserProfileStore(pool, flush_interval=USER_FLUSH_INTERVAL)
+
+# Результаты полнотекстового поиска, сбрасываются при изменении каталога
+search_cache = SearchCache(SEARCH_CACHE_SIZE)
+catalog.subscribe(search_cache.invalidate)
 
 async def init_db():
     # Создаем папку data если её нет
     os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
+    await pool.start()
     
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        # Таблица товаров
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                description TEXT,
-                price INTEGER NOT NULL,
-                category TEXT,
-                image_path TEXT,
-                is_active BOOLEAN DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Таблица пользователей
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                phone TEXT,
-                address TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Таблица корзины
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS cart (
-                user_id INTEGER,
-                product_id INTEGER,
-                quantity INTEGER DEFAULT 1,
-                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
-                FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE,
-                PRIMARY KEY (user_id, product_id)
-            )
-        ''')
-        
-        # Таблица заказов
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                total_amount INTEGER,
-                status TEXT DEFAULT 'pending',
-                payment_id TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        
-        # Таблица элементов заказа
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS order_items (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                order_id INTEGER,
-                product_id INTEGER,
-                quantity INTEGER,
-                price INTEGER,
-                FOREIGN KEY (order_id) REFERENCES orders (id) ON DELETE CASCADE,
-                FOREIGN KEY (product_id) REFERENCES products (id)
-            )
-        ''')
-        
-        await db.commit()
-        print("✅ База данных инициализирована")
-
-async def get_products(category=None):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        if category:
-            async with db.execute('SELECT * FROM products WHERE is_active = 1 AND category = ?', (category,)) as cursor:
-                return await cursor.fetchall()
-        else:
-            async with db.execute('SELECT * FROM products WHERE is_active = 1') as cursor:
-                return await cursor.fetchall()
+    # Схема создаётся и обновляется миграциями; если версия базы
+    # актуальна, DDL при старте не выполняется
+    async with pool.writer() as db:
+        version = await migrate(db)
+        print(f"✅ База данных инициализирована (схема v{version})")
+    carts.start()
+    profiles.start()
+
+async def close_db():
+    await carts.close()
+    await profiles.close()
+    await pool.close()
+
+async def _load_catalog():
+    # Считает попадание или промах, поэтому вызывается один раз на публичное
+    # чтение; внутри database.py товары берутся из catalog напрямую
+    if catalog.loaded:
+        catalog.record(hit=True)
+        return True
+    catalog.record(hit=False)
+    async with catalog.load_lock:
+        # Пока ждали блокировку, каталог мог загрузить другой обработчик
+        if catalog.loaded:
+            return True
+        version = catalog.begin_load()
+        async with pool.reader() as db:
+            async with db.execute('SELECT * FROM products ORDER BY id') as cursor:
+                rows = await cursor.fetchall()
+        return catalog.finish_load(rows, version)
+
+async def _select_product(db, product_id):
+    async with db.execute('SELECT * FROM products WHERE id = ?', (product_id,)) as cursor:
+        return await cursor.fetchone()
+
+async def get_products_page(category=None, cursor_id=None, limit=1, backward=False):
+    # Keyset-пагинация: следующие (или предыдущие) limit товаров после cursor_id
+    if await _load_catalog():
+        return catalog.get_page(category, cursor_id, limit, backward)
+    
+    conditions = ['is_active = 1']
+    params = []
+    if category:
+        conditions.append('category = ?')
+        params.append(category)
+    if cursor_id is not None:
+        conditions.append('id < ?' if backward else 'id > ?')
+        params.append(cursor_id)
+    order = 'DESC' if backward else 'ASC'
+    params.append(limit)
+    query = f"SELECT * FROM products WHERE {' AND '.join(conditions)} ORDER BY id {order} LIMIT ?"
+    async with pool.reader() as db:
+        async with db.execute(query, params) as cursor:
+            return await cursor.fetchall()
+
+async def search_products(text, offset=0, limit=20):
+    # Активные товары, подходящие под запрос, от самых релевантных (bm25)
+    match = build_match(text)
+    if not match:
+        return []
+    key = (match, offset, limit)
+    rows = search_cache.get(key)
+    if rows is None:
+        async with pool.reader() as db:
+            async with db.execute(SEARCH_QUERY, (match, limit, offset)) as cursor:
+                rows = await cursor.fetchall()
+        search_cache.put(key, rows)
+    return rows
 
 async def get_product(product_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute('SELECT * FROM products WHERE id = ?', (product_id,)) as cursor:
-            return await cursor.fetchone()
+    if await _load_catalog():
+        return catalog.get_product(product_id)
+    async with pool.reader() as db:
+        return await _select_product(db, product_id)
 
 async def add_product(name, description, price, category, image_path=None):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with pool.writer() as db:
         cursor = await db.execute('''
             INSERT INTO products (name, description, price, category, image_path)
             VALUES (?, ?, ?, ?, ?)
         ''', (name, description, price, category, image_path))
-        await db.commit()
-        return cursor.lastrowid
+        row = await _select_product(db, cursor.lastrowid)
+    catalog.put(row)
+    return row['id']
 
 async def get_user_cart(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute('''
-            SELECT c.product_id, c.quantity, p.name, p.price, p.image_path
+    # Корзина берётся из памяти, данные товаров — из кэша каталога. Каталог
+    # проверяется один раз на корзину, а не через get_product на каждый
+    # товар, чтобы попадания в кэш считались по одному на чтение
+    items = []
+    cart = await carts.get(user_id)
+    if not cart:
+        return items
+    if await _load_catalog():
+        products = {product_id: catalog.get_product(product_id) for product_id in cart}
+    else:
+        async with pool.reader() as db:
+            products = {product_id: await _select_product(db, product_id) for product_id in cart}
+    for product_id, quantity in cart.items():
+        product = products[product_id]
+        if product:
+            items.append({
+                'product_id': product_id,
+                'quantity': quantity,
+                'name': product['name'],
+                'price': product['price'],
+                'image_path': product['image_path'],
+            })
+    return items
+
+async def add_to_cart(user_id, product_id, quantity=1):
+    await carts.add(user_id, product_id, quantity)
+
+async def clear_cart(user_id):
+    await carts.clear(user_id)
+
+async def checkout(user_id):
+    # Оформление заказа одной транзакцией: заказ, его позиции и очистка корзины.
+    # Возвращает (order_id, total) или None, если корзина пуста.
+    await carts.flush(user_id)
+    async with pool.writer() as db:
+        await db.execute('BEGIN IMMEDIATE')
+        cursor = await db.execute('''
+            INSERT INTO orders (user_id, total_amount)
+            SELECT ?, SUM(p.price * c.quantity)
             FROM cart c
             JOIN products p ON c.product_id = p.id
             WHERE c.user_id = ?
-        ''', (user_id,)) as cursor:
+            HAVING COUNT(*) > 0
+        ''', (user_id, user_id))
+        if cursor.rowcount == 0:
+            return None
+        order_id = cursor.lastrowid
+        
+        await db.execute('''
+            INSERT INTO order_items (order_id, product_id, quantity, price)
+            SELECT ?, c.product_id, c.quantity, p.price
+            FROM cart c
+            JOIN products p ON c.product_id = p.id
+            WHERE c.user_id = ?
+        ''', (order_id, user_id))
+        await db.execute('DELETE FROM cart WHERE user_id = ?', (user_id,))
+        
+        async with db.execute('SELECT total_amount FROM orders WHERE id = ?', (order_id,)) as cursor:
+            total = (await cursor.fetchone())['total_amount']
+    carts.reset(user_id)
+    return order_id, total
+
+async def get_order(order_id):
+    async with pool.reader() as db:
+        async with db.execute('SELECT * FROM orders WHERE id = ?', (order_id,)) as cursor:
+            return await cursor.fetchone()
+
+async def set_order_payment_id(order_id, payment_id):
+    async with pool.writer() as db:
+        await db.execute('''
+            UPDATE orders SET payment_id = ?, payment_created_at = CURRENT_TIMESTAMP WHERE id = ?
+        ''', (payment_id, order_id))
+
+async def get_pending_payments(max_age):
+    # Платежи заказов, ожидающих оплаты, созданные не раньше max_age секунд
+    # назад, от старых к новым: [(payment_id, payment_created_at)]
+    async with pool.reader() as db:
+        async with db.execute('''
+            SELECT payment_id, payment_created_at FROM orders
+            WHERE status = 'pending' AND payment_id IS NOT NULL
+              AND payment_created_at >= datetime('now', ?)
+            ORDER BY payment_created_at
+        ''', (f'-{int(max_age)} seconds',)) as cursor:
             return await cursor.fetchall()
 
-async def add_to_cart(user_id, product_id, quantity=1):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        # Проверяем существование записи
+async def apply_payment_statuses(statuses):
+    # Пакетное обновление статусов заказов по платежам: [(payment_id, status)].
+    # Меняются только заказы в статусе pending, поэтому повторное уведомление
+    # или повторная сверка ничего не изменят. Возвращает изменённые заказы.
+    if not statuses:
+        return []
+    async with pool.writer() as db:
+        await db.execute('BEGIN IMMEDIATE')
+        await db.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS payment_updates (
+                payment_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL
+            )
+        ''')
+        await db.execute('DELETE FROM temp.payment_updates')
+        await db.executemany('INSERT OR REPLACE INTO temp.payment_updates (payment_id, status) VALUES (?, ?)', statuses)
         async with db.execute('''
-            SELECT quantity FROM cart WHERE user_id = ? AND product_id = ?
-        ''', (user_id, product_id)) as cursor:
-            row = await cursor.fetchone()
-            
-        if row:
-            new_quantity = row[0] + quantity
-            await db.execute('''
-                UPDATE cart SET quantity = ? WHERE user_id = ? AND product_id = ?
-            ''', (new_quantity, user_id, product_id))
-        else:
-            await db.execute('''
-                INSERT INTO cart (user_id, product_id, quantity)
-                VALUES (?, ?, ?)
-            ''', (user_id, product_id, quantity))
-        await db.commit()
+            UPDATE orders SET status = u.status
+            FROM temp.payment_updates u
+            WHERE orders.payment_id = u.payment_id AND orders.status = 'pending'
+            RETURNING orders.id, orders.user_id, orders.total_amount, orders.status
+        ''') as cursor:
+            return await cursor.fetchall()
 
-async def remove_from_cart(user_id, product_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute('DELETE FROM cart WHERE user_id = ? AND product_id = ?', (user_id, product_id))
-        await db.commit()
+# Позиция заказа в истории пользователя: заказы идут от новых к старым
+ORDER_KEY = '(created_at, id)'
+ORDER_CURSOR = '(SELECT created_at, id FROM orders WHERE id = ?)'
 
-async def clear_cart(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute('DELETE FROM cart WHERE user_id = ?', (user_id,))
-        await db.commit()
+async def get_user_orders_page(user_id, cursor_id=None, limit=5, direction='older'):
+    # Keyset-страница истории заказов, от новых к старым. direction:
+    # 'older' — заказы старше cursor_id, 'newer' — новее, 'from' — начиная
+    # с cursor_id включительно. Возвращает (заказы, есть новее, есть старше)
+    async with pool.reader() as db:
+        if cursor_id is None:
+            condition, params, order = '', [], 'DESC'
+        elif direction == 'newer':
+            condition, params, order = f'AND {ORDER_KEY} > {ORDER_CURSOR}', [cursor_id], 'ASC'
+        elif direction == 'from':
+            condition, params, order = f'AND {ORDER_KEY} <= {ORDER_CURSOR}', [cursor_id], 'DESC'
+        else:
+            condition, params, order = f'AND {ORDER_KEY} < {ORDER_CURSOR}', [cursor_id], 'DESC'
+        async with db.execute(f'''
+            SELECT * FROM orders WHERE user_id = ? {condition}
+            ORDER BY created_at {order}, id {order} LIMIT ?
+        ''', [user_id, *params, limit + 1]) as cursor:
+            rows = await cursor.fetchall()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if direction == 'newer' and cursor_id is not None:
+            rows.reverse()
+            return rows, has_more, True
+        if direction == 'older' and cursor_id is not None:
+            return rows, True, has_more
+        if direction == 'from' and cursor_id is not None:
+            async with db.execute(f'''
+                SELECT EXISTS (SELECT 1 FROM orders WHERE user_id = ? AND {ORDER_KEY} > {ORDER_CURSOR}) as newer
+            ''', (user_id, cursor_id)) as cursor:
+                has_newer = bool((await cursor.fetchone())['newer'])
+            return rows, has_newer, has_more
+        return rows, False, has_more
 
-async def create_order(user_id, total_amount, payment_id=None):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cursor = await db.execute('''
-            INSERT INTO orders (user_id, total_amount, payment_id)
-            VALUES (?, ?, ?)
-        ''', (user_id, total_amount, payment_id))
-        order_id = cursor.lastrowid
-        await db.commit()
-        return order_id
-
-async def add_order_items(order_id, items):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        for item in items:
-            await db.execute('''
-                INSERT INTO order_items (order_id, product_id, quantity, price)
-                VALUES (?, ?, ?, ?)
-            ''', (order_id, item['product_id'], item['quantity'], item['price']))
-        await db.commit()
-
-async def get_user_orders(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
+async def get_order_items(order_id):
+    async with pool.reader() as db:
         async with db.execute('''
-            SELECT * FROM orders WHERE user_id = ? ORDER BY created_at DESC
-        ''', (user_id,)) as cursor:
+            SELECT oi.product_id, oi.quantity, oi.price, p.name
+            FROM order_items oi
+            LEFT JOIN products p ON p.id = oi.product_id
+            WHERE oi.order_id = ?
+            ORDER BY oi.id
+        ''', (order_id,)) as cursor:
             return await cursor.fetchall()
 
-async def save_user_info(user_id, username=None, first_name=None, last_name=None, phone=None, address=None):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute('''
-            INSERT OR REPLACE INTO users 
-            (user_id, username, first_name, last_name, phone, address)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, username, first_name, last_name, phone, address))
-        await db.commit()
+def update_user_profile(user_id, username=None, first_name=None, last_name=None):
+    # Данные из Telegram: запись только если что-то изменилось
+    return profiles.touch(user_id, username, first_name, last_name)
 
 async def get_user_info(user_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with pool.reader() as db:
         async with db.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)) as cursor:
             return await cursor.fetchone()
 
 async def get_all_users():
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with pool.reader() as db:
         async with db.execute('SELECT * FROM users') as cursor:
             return await cursor.fetchall()
 
 async def get_statistics():
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        stats = {}
-        
-        # Количество пользователей
-        async with db.execute('SELECT COUNT(*) as count FROM users') as cursor:
-            row = await cursor.fetchone()
-            stats['users_count'] = row['count']
-        
-        # Количество заказов
-        async with db.execute('SELECT COUNT(*) as count FROM orders') as cursor:
-            row = await cursor.fetchone()
-            stats['orders_count'] = row['count']
-        
-        # Общая сумма заказов
-        async with db.execute('SELECT SUM(total_amount) as total FROM orders WHERE status = "paid"') as cursor:
-            row = await cursor.fetchone()
-            stats['total_revenue'] = row['total'] or 0
-            
-        return stats
+    # Счётчики поддерживаются триггерами, полного сканирования таблиц нет
+    async with pool.reader() as db:
+        async with db.execute('SELECT name, value FROM stats_counters') as cursor:
+            counters = {row['name']: row['value'] for row in await cursor.fetchall()}
+    return {
+        'users_count': counters.get('users_count', 0),
+        'orders_count': counters.get('orders_count', 0),
+        'total_revenue': counters.get('total_revenue', 0),
+    }
+
+async def get_period_statistics():
+    # Сводка за сегодня/7/30 дней из дневных агрегатов: не больше 30 строк на период
+    periods = []
+    async with pool.reader() as db:
+        for title, days in STATS_PERIODS:
+            since = f'-{days - 1} days'
+            async with db.execute('''
+                SELECT COALESCE(SUM(orders_count), 0) as orders_count,
+                       COALESCE(SUM(paid_count), 0) as paid_count,
+                       COALESCE(SUM(revenue), 0) as revenue
+                FROM stats_daily WHERE day >= date('now', ?)
+            ''', (since,)) as cursor:
+                row = await cursor.fetchone()
+            async with db.execute('''
+                SELECT category, SUM(items_count) as items_count, SUM(revenue) as revenue
+                FROM stats_daily_category WHERE day >= date('now', ?)
+                GROUP BY category ORDER BY revenue DESC LIMIT 3
+            ''', (since,)) as cursor:
+                categories = await cursor.fetchall()
+            periods.append({
+                'title': title,
+                'orders_count': row['orders_count'],
+                'paid_count': row['paid_count'],
+                'revenue': row['revenue'],
+                'categories': categories,
+            })
+    return periods
+
+async def rebuild_statistics():
+    # Полный пересчёт агрегатов по истории заказов
+    async with pool.writer() as db:
+        await db.execute('BEGIN IMMEDIATE')
+        for statement in STATS_BACKFILL:
+            await db.execute(statement)
 
 # НОВЫЕ ФУНКЦИИ ДЛЯ РЕДАКТИРОВАНИЯ ТОВАРОВ
-async def get_all_products():
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute('SELECT * FROM products ORDER BY id') as cursor:
-            return await cursor.fetchall()
+async def get_admin_products_page(status=None, category=None, search=None, cursor_id=0, limit=10, backward=False):
+    # Страница списка товаров для админки: keyset по id, не более limit строк.
+    # status: None — все, 'active' или 'inactive'; search — часть названия или id.
+    # Возвращает (товары по возрастанию id, есть ли ещё товары в эту сторону)
+    conditions = []
+    params = []
+    if status == 'active':
+        conditions.append('is_active = 1')
+    elif status == 'inactive':
+        conditions.append('is_active = 0')
+    if category:
+        conditions.append('category = ?')
+        params.append(category)
+    if search:
+        pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        if search.isdigit():
+            conditions.append("(id = ? OR name LIKE ? ESCAPE '\\')")
+            params.extend([int(search), pattern])
+        else:
+            conditions.append("name LIKE ? ESCAPE '\\'")
+            params.append(pattern)
+    if backward:
+        conditions.append('id < ?')
+    else:
+        conditions.append('id > ?')
+    params.append(cursor_id)
+    order = 'DESC' if backward else 'ASC'
+    params.append(limit + 1)
+    query = f"SELECT * FROM products WHERE {' AND '.join(conditions)} ORDER BY id {order} LIMIT ?"
+    async with pool.reader() as db:
+        async with db.execute(query, params) as cursor:
+            rows = await cursor.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+    return rows, has_more
 
 async def update_product(product_id, name=None, description=None, price=None, category=None, image_path=None):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        # Строим динамический запрос
-        updates = []
-        params = []
+    # Строим динамический запрос
+    updates = []
+    params = []
+    
+    if name is not None:
+        updates.append("name = ?")
+        params.append(name)
+    if description is not None:
+        updates.append("description = ?")
+        params.append(description)
+    if price is not None:
+        updates.append("price = ?")
+        params.append(price)
+    if category is not None:
+        updates.append("category = ?")
+        params.append(category)
+    if image_path is not None:
+        updates.append("image_path = ?")
+        params.append(image_path)
+        # Новое изображение нужно загрузить в Telegram заново
+        updates.append("image_file_id = NULL")
         
-        if name is not None:
-            updates.append("name = ?")
-            params.append(name)
-        if description is not None:
-            updates.append("description = ?")
-            params.append(description)
-        if price is not None:
-            updates.append("price = ?")
-            params.append(price)
-        if category is not None:
-            updates.append("category = ?")
-            params.append(category)
-        if image_path is not None:
-            updates.append("image_path = ?")
-            params.append(image_path)
-            
-        if updates:
-            params.append(product_id)
-            query = f"UPDATE products SET {', '.join(updates)} WHERE id = ?"
-            await db.execute(query, params)
-            await db.commit()
-            return True
+    if not updates:
         return False
+    
+    params.append(product_id)
+    query = f"UPDATE products SET {', '.join(updates)} WHERE id = ?"
+    async with pool.writer() as db:
+        await db.execute(query, params)
+        row = await _select_product(db, product_id)
+    if row:
+        catalog.put(row)
+    return True
+
+async def upsert_products(rows, dry_run=False):
+    # Пачка товаров из импорта одной транзакцией: [(sku, name, description,
+    # price, category, image_path)]. Товар с уже известным артикулом
+    # обновляется, остальные добавляются. Возвращает (добавлено, обновлено);
+    # при dry_run только считает, ничего не записывая
+    skus = [row[0] for row in rows if row[0] is not None]
+    existing_query = f"SELECT COUNT(*) as count FROM products WHERE sku IN ({', '.join('?' * len(skus))})"
+    if dry_run:
+        updated = 0
+        if skus:
+            async with pool.reader() as db:
+                async with db.execute(existing_query, skus) as cursor:
+                    updated = (await cursor.fetchone())['count']
+        return len(rows) - updated, updated
+    
+    async with pool.writer() as db:
+        await db.execute('BEGIN IMMEDIATE')
+        updated = 0
+        if skus:
+            async with db.execute(existing_query, skus) as cursor:
+                updated = (await cursor.fetchone())['count']
+        # Новое изображение нужно загрузить в Telegram заново
+        await db.executemany('''
+            INSERT INTO products (sku, name, description, price, category, image_path)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (sku) WHERE sku IS NOT NULL DO UPDATE SET
+                name = excluded.name,
+                description = excluded.description,
+                price = excluded.price,
+                category = excluded.category,
+                image_file_id = CASE WHEN image_path IS excluded.image_path THEN image_file_id END,
+                image_path = excluded.image_path
+        ''', rows)
+    catalog.invalidate()
+    return len(rows) - updated, updated
+
+async def set_product_file_id(product_id, file_id):
+    # Сохраняем file_id, который Telegram вернул после первой загрузки фото
+    async with pool.writer() as db:
+        await db.execute('UPDATE products SET image_file_id = ? WHERE id = ?', (file_id, product_id))
+        row = await _select_product(db, product_id)
+    if row:
+        catalog.put(row)
 
 async def delete_product(product_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with pool.writer() as db:
         await db.execute('UPDATE products SET is_active = 0 WHERE id = ?', (product_id,))
-        await db.commit()
-        return True
+        row = await _select_product(db, product_id)
+    if row:
+        catalog.put(row)
+    return True
 
 async def restore_product(product_id):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with pool.writer() as db:
         await db.execute('UPDATE products SET is_active = 1 WHERE id = ?', (product_id,))
-        await db.commit()
-        return True
+        row = await _select_product(db, product_id)
+    if row:
+        catalog.put(row)
+    return True
+
+# РАССЫЛКИ
+async def get_users_batch(after_user_id=0, limit=500):
+    # Keyset-пагинация по первичному ключу, чтобы не загружать всех пользователей сразу
+    async with pool.reader() as db:
+        async with db.execute('''
+            SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?
+        ''', (after_user_id, limit)) as cursor:
+            return [row['user_id'] for row in await cursor.fetchall()]
+
+async def create_broadcast(text, admin_chat_id, status_message_id=None):
+    async with pool.writer() as db:
+        async with db.execute('SELECT COUNT(*) as count FROM users') as cursor:
+            total = (await cursor.fetchone())['count']
+        cursor = await db.execute('''
+            INSERT INTO broadcasts (text, total_count, admin_chat_id, status_message_id)
+            VALUES (?, ?, ?, ?)
+        ''', (text, total, admin_chat_id, status_message_id))
+        return cursor.lastrowid
+
+async def get_broadcast(broadcast_id):
+    async with pool.reader() as db:
+        async with db.execute('SELECT * FROM broadcasts WHERE id = ?', (broadcast_id,)) as cursor:
+            return await cursor.fetchone()
+
+async def get_running_broadcasts():
+    async with pool.reader() as db:
+        async with db.execute("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id") as cursor:
+            return await cursor.fetchall()
+
+async def update_broadcast_progress(broadcast_id, cursor_user_id, sent_delta, failed_delta):
+    async with pool.writer() as db:
+        await db.execute('''
+            UPDATE broadcasts
+            SET cursor_user_id = ?, sent_count = sent_count + ?, failed_count = failed_count + ?
+            WHERE id = ?
+        ''', (cursor_user_id, sent_delta, failed_delta, broadcast_id))
+
+async def set_broadcast_status(broadcast_id, status):
+    async with pool.writer() as db:
+        await db.execute('''
+            UPDATE broadcasts SET status = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?
+        ''', (status, broadcast_id))
+
+# Время, ошибки и число строк каждой функции запросов (см. metrics.py).
+# Обёртки подменяют функции модуля до того, как их импортирует bot.py
+for _name, _func in list(globals().items()):
+    if (inspect.iscoroutinefunction(_func) and _func.__module__ == __name__
+            and not _name.startswith('_') and _name not in ('init_db', 'close_db')):
+        globals()[_name] = metrics.instrument('query', _func)
+del _name, _func
@@ -0,0 +1,99 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+# Настройки соединений: WAL позволяет читать параллельно с записью,
+# synchronous=NORMAL в режиме WAL не теряет целостность при сбое процесса
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -8000',
+    'PRAGMA mmap_size = 67108864',
+    'PRAGMA busy_timeout = 5000',
+)
+
+# Размер кэша подготовленных выражений sqlite3 на каждое соединение
+STATEMENT_CACHE_SIZE = 256
+
+
+class ConnectionPool:
+    """Долгоживущие соединения с БД: один писатель и несколько читателей.
+
+    Запускается один раз при старте бота (init_db) и закрывается при остановке.
+    Запись сериализуется блокировкой, чтобы транзакции разных обработчиков
+    не перемешивались на общем соединении.
+    """
+
+    def __init__(self, path, read_size=4):
+        self.path = path
+        self.read_size = read_size
+        self._writer = None
+        self._write_lock = None
+        self._readers = None
+        self._all_readers = []
+        # Ленивый запуск из reader()/writer(): без блокировки две корутины
+        # открыли бы по набору соединений, и первый набор бы потерялся
+        self._start_lock = asyncio.Lock()
+
+    @property
+    def started(self):
+        return self._writer is not None
+
+    async def _connect(self, readonly=False):
+        db = await aiosqlite.connect(self.path, cached_statements=STATEMENT_CACHE_SIZE)
+        db.row_factory = aiosqlite.Row
+        for pragma in PRAGMAS:
+            await db.execute(pragma)
+        if readonly:
+            await db.execute('PRAGMA query_only = ON')
+        return db
+
+    async def start(self):
+        async with self._start_lock:
+            if self.started:
+                return
+            writer = await self._connect()
+            self._write_lock = asyncio.Lock()
+            self._readers = asyncio.Queue()
+            for _ in range(self.read_size):
+                db = await self._connect(readonly=True)
+                self._all_readers.append(db)
+                self._readers.put_nowait(db)
+            # started становится True, только когда все соединения открыты
+            self._writer = writer
+
+    async def close(self):
+        if not self.started:
+            return
+        async with self._write_lock:
+            for db in self._all_readers:
+                await db.close()
+            self._all_readers.clear()
+            await self._writer.close()
+            self._writer = None
+
+    @asynccontextmanager
+    async def reader(self):
+        if not self.started:
+            await self.start()
+        db = await self._readers.get()
+        try:
+            yield db
+        finally:
+            self._readers.put_nowait(db)
+
+    @asynccontextmanager
+    async def writer(self):
+        """Транзакция на соединении писателя: commit при успехе, rollback при ошибке."""
+        if not self.started:
+            await self.start()
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import sys
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Семафор BaseUpdateProcessor берётся до очереди пользователя, поэтому один
+# пользователь мог бы занять его целиком. Отключаем его: глобальный лимит
+# берётся в do_process_update, а очередь ограничена для каждого пользователя
+UNLIMITED = sys.maxsize
+
+
+class _UserQueue:
+    __slots__ = ('lock', 'depth')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений разных пользователей.
+
+    Обновления одного пользователя выполняются строго по очереди (корзина
+    и состояния диалогов меняются в правильном порядке), обновления разных
+    пользователей — параллельно, но не более max_concurrent одновременно.
+    Слот из max_concurrent занимается только когда подошла очередь
+    пользователя, а в очереди одного пользователя ждут не больше
+    max_user_queue обновлений: лишние отбрасываются, поэтому поток
+    обновлений от одного пользователя не мешает остальным.
+    Очередь пользователя удаляется, как только в ней не остаётся обновлений.
+    """
+
+    def __init__(self, max_concurrent=64, max_user_queue=20):
+        super().__init__(UNLIMITED)
+        self.max_concurrent = max_concurrent
+        self.max_user_queue = max_user_queue
+        self._limit = asyncio.Semaphore(max_concurrent)
+        self._queues = {}
+        self.running = 0
+        self.dropped = 0
+
+    @staticmethod
+    def _key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    @property
+    def queue_depth(self):
+        return sum(queue.depth for queue in self._queues.values())
+
+    @property
+    def active_users(self):
+        return len(self._queues)
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'queue_depth': self.queue_depth,
+            'active_users': self.active_users,
+            'max_concurrent': self.max_concurrent,
+            'dropped': self.dropped,
+        }
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        # Регистрируемся в очереди пользователя до первого await, чтобы
+        # сохранить порядок поступления обновлений
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = _UserQueue()
+        elif queue.depth > self.max_user_queue:
+            # Одно обновление выполняется и max_user_queue ждут — лишнее отбрасываем
+            coroutine.close()
+            self.dropped += 1
+            logger.warning(f"Пользователь {key}: в очереди {queue.depth} обновлений, новое отброшено")
+            return
+        queue.depth += 1
+        try:
+            async with queue.lock:
+                await self._run(coroutine)
+        finally:
+            queue.depth -= 1
+            if queue.depth == 0 and self._queues.get(key) is queue:
+                del self._queues[key]
+
+    async def _run(self, coroutine):
+        # Глобальный лимит берём уже после очереди пользователя, чтобы
+        # ожидающие своей очереди обновления не занимали слоты
+        async with self._limit:
+            self.running += 1
+            try:
+                await coroutine
+            finally:
+                self.running -= 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,123 @@
+"""Локальная имитация API ЮKassa для разработки и проверки оплаты без
+настоящего магазина.
+
+Запуск: python fake_yookassa.py --port 8081, затем в config.py:
+PAYMENT_PROVIDER = 'yookassa', YOOKASSA_API_URL = 'http://127.0.0.1:8081/v3'.
+
+Поддерживаются POST /v3/payments (с Idempotence-Key), GET /v3/payments
+(список с created_at.gte, status и курсором) и GET /v3/payments/{id}. Служебные
+адреса: POST /fake/payments/{id}/succeed и /cancel меняют статус платежа,
+а если задан --notify, отправляют уведомление, как это делает ЮKassa. Параметры --fail и --delay позволяют
+проверить повторы и таймауты клиента.
+"""
+import argparse
+import asyncio
+import uuid
+from datetime import datetime, timezone
+
+import aiohttp
+from aiohttp import web
+
+
+class FakeYooKassa:
+    def __init__(self, fail_first=0, delay=0.0, notify_url=None):
+        self.notify_url = notify_url
+        self.payments = {}
+        self.by_key = {}
+        self.fail_first = fail_first
+        self.delay = delay
+        self.requests = 0
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post('/v3/payments', self.create_payment)
+        app.router.add_get('/v3/payments', self.list_payments)
+        app.router.add_get('/v3/payments/{payment_id}', self.get_payment)
+        app.router.add_post('/fake/payments/{payment_id}/{action:succeed|cancel}', self.set_status)
+        return app
+
+    async def _simulate(self):
+        # Первые fail_first запросов отвечают 500, каждый запрос ждёт delay секунд
+        self.requests += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.requests <= self.fail_first:
+            raise web.HTTPInternalServerError()
+
+    async def create_payment(self, request):
+        await self._simulate()
+        key = request.headers.get('Idempotence-Key')
+        if not key:
+            return web.json_response({'type': 'error', 'code': 'invalid_request'}, status=400)
+        if key in self.by_key:
+            return web.json_response(self.payments[self.by_key[key]])
+
+        data = await request.json()
+        payment_id = str(uuid.uuid4())
+        payment = {
+            'id': payment_id,
+            'status': 'pending',
+            'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+            'paid': False,
+            'amount': data['amount'],
+            'description': data.get('description', ''),
+            'metadata': data.get('metadata', {}),
+            'confirmation': {
+                'type': 'redirect',
+                'confirmation_url': f"{request.scheme}://{request.host}/fake/checkout/{payment_id}",
+            },
+        }
+        self.payments[payment_id] = payment
+        self.by_key[key] = payment_id
+        return web.json_response(payment)
+
+    async def get_payment(self, request):
+        await self._simulate()
+        payment = self.payments.get(request.match_info['payment_id'])
+        if payment is None:
+            return web.json_response({'type': 'error', 'code': 'not_found'}, status=404)
+        return web.json_response(payment)
+
+    async def list_payments(self, request):
+        await self._simulate()
+        created_after = request.query.get('created_at.gte', '')
+        status = request.query.get('status')
+        limit = int(request.query.get('limit', 10))
+        start = int(request.query.get('cursor', 0))
+        # Платежи в порядке создания, курсор — позиция в этом списке
+        items = [p for p in self.payments.values()
+                 if p['created_at'] >= created_after and (status is None or p['status'] == status)]
+        page = items[start:start + limit]
+        result = {'type': 'list', 'items': page}
+        if start + limit < len(items):
+            result['next_cursor'] = str(start + limit)
+        return web.json_response(result)
+
+    async def set_status(self, request):
+        payment = self.payments.get(request.match_info['payment_id'])
+        if payment is None:
+            raise web.HTTPNotFound()
+        succeeded = request.match_info['action'] == 'succeed'
+        payment['status'] = 'succeeded' if succeeded else 'canceled'
+        payment['paid'] = succeeded
+        if self.notify_url:
+            event = 'payment.succeeded' if succeeded else 'payment.canceled'
+            async with aiohttp.ClientSession() as session:
+                await session.post(self.notify_url, json={'type': 'notification', 'event': event, 'object': payment})
+        return web.json_response(payment)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Имитация API ЮKassa')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--fail', type=int, default=0, help='сколько первых запросов ответят 500')
+    parser.add_argument('--delay', type=float, default=0.0, help='задержка ответа, секунд')
+    parser.add_argument('--notify', help='адрес для уведомлений о платежах (PAYMENT_WEBHOOK_* бота)')
+    args = parser.parse_args()
+    fake = FakeYooKassa(args.fail, args.delay, args.notify)
+    web.run_app(fake.create_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
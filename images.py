@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Обработанные изображения лежат в <IMAGES_PATH>/<2 символа хэша>/<sha256>.jpg,
+# рядом — миниатюра <sha256>_thumb.jpg
+_STORED_NAME = re.compile(r'^[0-9a-f]{64}\.jpg$')
+THUMB_SUFFIX = '_thumb.jpg'
+
+
+def _to_jpeg(image, max_side, quality):
+    image = image.copy()
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def process_image(source_path, images_dir, max_side, thumb_side, quality):
+    """Нормализация изображения товара; выполняется в отдельном процессе.
+
+    Файл сохраняется под хэшем исходных байтов, поэтому одно и то же
+    изображение хранится и обрабатывается один раз. Возвращает путь к
+    обработанному изображению.
+    """
+    with open(source_path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    target_dir = os.path.join(images_dir, digest[:2])
+    target_path = os.path.join(target_dir, digest + '.jpg')
+    if os.path.exists(target_path):
+        return target_path
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except Image.DecompressionBombError as e:
+        raise ValueError(f"Изображение {source_path} слишком большое") from e
+    except (UnidentifiedImageError, OSError) as e:
+        # OSError — в том числе обрезанный или повреждённый файл
+        raise ValueError(f"Файл {source_path} не является изображением") from e
+
+    # Поворот по EXIF и перевод в RGB: прозрачность заливаем белым
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    os.makedirs(target_dir, exist_ok=True)
+    _write_atomic(target_path[:-4] + THUMB_SUFFIX, _to_jpeg(image, thumb_side, quality))
+    _write_atomic(target_path, _to_jpeg(image, max_side, quality))
+    return target_path
+
+
+def is_stored(path):
+    return bool(path) and _STORED_NAME.match(os.path.basename(path)) is not None
+
+
+def thumbnail_path(path):
+    return path[:-4] + THUMB_SUFFIX
+
+
+class ImagePipeline:
+    """Приём изображений товаров: уменьшение до размеров, удобных Telegram,
+    пережатие в JPEG, миниатюра и хранение по хэшу содержимого.
+
+    Pillow работает в пуле процессов, цикл событий бота не блокируется.
+    """
+
+    def __init__(self, images_dir, max_side=1280, thumb_side=320, quality=85, workers=2):
+        self.images_dir = images_dir
+        self.max_side = max_side
+        self.thumb_side = thumb_side
+        self.quality = quality
+        self.workers = workers
+        self._executor = None
+
+    def start(self):
+        # spawn: дочерние процессы не наследуют потоки aiosqlite и цикл событий
+        self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    async def close(self):
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.to_thread(executor.shutdown)
+
+    async def ingest(self, source_path):
+        """Путь к обработанному изображению; ошибка в файле — ValueError с описанием."""
+        if not os.path.isfile(source_path):
+            raise ValueError(f"Файл {source_path} не найден")
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self._executor, process_image,
+                source_path, self.images_dir, self.max_side, self.thumb_side, self.quality
+            )
+        except OSError as e:
+            raise ValueError(f"Не удалось прочитать {source_path}: {e.strerror or e}") from e
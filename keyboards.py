@@ -1,90 +1,306 @@
+from collections import OrderedDict
+
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
+from callback_router import encode
+from config import KEYBOARD_CACHE_SIZE
+
+# Объекты клавиатур PTB неизменяемы после создания, поэтому одну и ту же
+# разметку можно отдавать во все сообщения. Постоянные клавиатуры создаются
+# один раз при импорте, клавиатуры с параметрами хранятся в KeyboardCache.
+
+
+class KeyboardCache:
+    """LRU-кэш клавиатур с параметрами.
+
+    Запись помечается id товара (или None, если клавиатура зависит от всего
+    каталога). invalidate_product(product_id) удаляет клавиатуры этого
+    товара и все клавиатуры каталога, invalidate() очищает кэш целиком.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._markups = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, product_id, build):
+        entry = self._markups.get(key)
+        if entry is not None:
+            self._markups.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        markup = build()
+        self._markups[key] = (product_id, markup)
+        while len(self._markups) > self.max_size:
+            self._markups.popitem(last=False)
+        return markup
+
+    def invalidate_product(self, product_id=None):
+        if product_id is None:
+            self.invalidate()
+            return
+        stale = [key for key, (tag, _) in self._markups.items() if tag is None or tag == product_id]
+        for key in stale:
+            del self._markups[key]
+
+    def invalidate(self):
+        self._markups.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self._markups),
+        }
+
+
+keyboard_cache = KeyboardCache(KEYBOARD_CACHE_SIZE)
+
+# Главное меню: надпись кнопки и действие, по которому bot.py находит обработчик
+USER_MENU = [
+    [("🛍 Каталог", "catalog"), ("🛒 Корзина", "cart")],
+    [("📦 Мои заказы", "orders"), ("👤 Профиль", "profile")],
+    [("💳 Оплата", "payment"), ("📞 Поддержка", "support")],
+]
+ADMIN_MENU = [
+    [("➕ Добавить товар", "add_product"), ("✏️ Редактировать товары", "edit_products")],
+    [("📊 Статистика", "statistics"), ("📦 Заказы", "admin_orders")],
+    [("👥 Пользователи", "users"), ("📢 Рассылка", "broadcast")],
+    [("📥 Импорт товаров", "import_products"), ("🏠 Главное меню", "main_menu")],
+]
+# Надписи, которых нет в меню, но которые бот понимает: остались на
+# клавиатурах, отправленных прежними версиями бота
+MENU_ALIASES = [("👑 Админ-панель", "admin_panel")]
+CANCEL_LABEL = "❌ Отмена"
+
+def menu_buttons():
+    # Все кнопки обоих меню и надписи из MENU_ALIASES: (надпись, действие)
+    for menu in (USER_MENU, ADMIN_MENU):
+        for row in menu:
+            yield from row
+    yield from MENU_ALIASES
+
+def _build_main_menu(menu):
+    return ReplyKeyboardMarkup([[label for label, _ in row] for row in menu], resize_keyboard=True)
+
+_MAIN_MENUS = {False: _build_main_menu(USER_MENU), True: _build_main_menu(ADMIN_MENU)}
 
 def main_menu(is_admin=False):
-    if is_admin:
-        return ReplyKeyboardMarkup([
-            ["➕ Добавить товар", "✏️ Редактировать товары"],
-            ["📊 Статистика", "📦 Заказы"],
-            ["👥 Пользователи", "📢 Рассылка"],
-            ["🏠 Главное меню"]
-        ], resize_keyboard=True)
-    else:
-        return ReplyKeyboardMarkup([
-            ["🛍 Каталог", "🛒 Корзина"],
-            ["📦 Мои заказы", "👤 Профиль"],
-            ["💳 Оплата", "📞 Поддержка"]
-        ], resize_keyboard=True)
+    return _MAIN_MENUS[bool(is_admin)]
+
+# Категории каталога: код для callback_data, кнопка и название категории в БД
+CATEGORIES = [
+    ("figures", "🎭 Фигурки", "Фигурки"),
+    ("clothes", "👕 Одежда", "Одежда"),
+    ("accessories", "💍 Аксессуары", "Аксессуары"),
+    ("manga", "📚 Манга", "Манга"),
+    ("games", "🎮 Игры", "Игры"),
+]
+CATEGORY_NAMES = {slug: name for slug, _, name in CATEGORIES}
+
+_CATEGORY_MENU = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(label, callback_data=encode("cat_", slug))] for slug, label, _ in CATEGORIES]
+    + [[InlineKeyboardButton("📦 Все товары", callback_data="cat_all")]]
+    # Поиск идёт через inline-режим прямо в этом чате
+    + [[InlineKeyboardButton("🔍 Поиск", switch_inline_query_current_chat="")]]
+    + [[InlineKeyboardButton("🏠 « Назад", callback_data="back_to_main")]]
+)
 
 def category_menu():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🎭 Фигурки", callback_data="cat_figures")],
-        [InlineKeyboardButton("👕 Одежда", callback_data="cat_clothes")],
-        [InlineKeyboardButton("💍 Аксессуары", callback_data="cat_accessories")],
-        [InlineKeyboardButton("📚 Манга", callback_data="cat_manga")],
-        [InlineKeyboardButton("🎮 Игры", callback_data="cat_games")],
-        [InlineKeyboardButton("🏠 « Назад", callback_data="back_to_main")]
-    ])
+    return _CATEGORY_MENU
 
-def product_keyboard(product_id, quantity_in_cart=0):
+def product_keyboard(product_id, quantity_in_cart=0, category_slug=None):
+    return keyboard_cache.get(
+        ('product', product_id, quantity_in_cart, category_slug), product_id,
+        lambda: _build_product_keyboard(product_id, quantity_in_cart, category_slug)
+    )
+
+def _build_product_keyboard(product_id, quantity_in_cart, category_slug):
     buttons = [
-        [InlineKeyboardButton("🛒 Добавить в корзину", callback_data=f"add_to_cart_{product_id}")],
-        [InlineKeyboardButton("⭐ В избранное", callback_data=f"favorite_{product_id}")],
+        [InlineKeyboardButton("🛒 Добавить в корзину", callback_data=encode("add_to_cart_", product_id))],
+        [InlineKeyboardButton("⭐ В избранное", callback_data=encode("favorite_", product_id))],
     ]
     
     if quantity_in_cart > 0:
         buttons.append([InlineKeyboardButton(f"✅ В корзине: {quantity_in_cart} шт.", callback_data="already_in_cart")])
     
+    # Листание карусели каталога
+    if category_slug:
+        buttons.append([
+            InlineKeyboardButton("◀️", callback_data=encode("nav_prev_", category_slug, product_id)),
+            InlineKeyboardButton("▶️", callback_data=encode("nav_next_", category_slug, product_id)),
+        ])
+    
     buttons.append([InlineKeyboardButton("🏠 « Назад", callback_data="back_to_catalog")])
     return InlineKeyboardMarkup(buttons)
 
+_CART_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Оформить заказ", callback_data="checkout")],
+    [InlineKeyboardButton("🗑 Очистить корзину", callback_data="clear_cart")],
+    [InlineKeyboardButton("🏠 « Назад", callback_data="back_to_main")]
+])
+
+# Ссылка из результата поиска открывает товар в чате с ботом: /start product_<id>
+PRODUCT_DEEP_LINK = "product_"
+
+def search_result_keyboard(product_id, bot_username):
+    return keyboard_cache.get(
+        ('search', product_id, bot_username), product_id,
+        lambda: InlineKeyboardMarkup([[InlineKeyboardButton(
+            "🛒 Открыть в магазине",
+            url=f"https://t.me/{bot_username}?start={PRODUCT_DEEP_LINK}{product_id}"
+        )]])
+    )
+
+# Статусы заказа: значок и подпись
+ORDER_STATUS_LABELS = {
+    'pending': ("⏳", "Ожидает оплаты"),
+    'paid': ("✅", "Оплачен"),
+    'canceled': ("❌", "Отменён"),
+}
+
+def order_status_label(status):
+    icon, label = ORDER_STATUS_LABELS.get(status, ("📦", status))
+    return f"{icon} {label}"
+
+def orders_keyboard(orders, newer_data=None, older_data=None):
+    # Страница истории: кнопка на заказ, листание к новым/старым заказам.
+    # Из карточки заказа можно вернуться на эту же страницу (по первому заказу)
+    page_id = orders[0]['id'] if orders else 0
+    buttons = []
+    for order in orders:
+        icon = ORDER_STATUS_LABELS.get(order['status'], ("📦",))[0]
+        buttons.append([InlineKeyboardButton(
+            f"{icon} #{order['id']} · {order['total_amount']} руб. · {order['created_at'][:10]}",
+            callback_data=encode("order_", order['id'], page_id)
+        )])
+    nav = []
+    if newer_data:
+        nav.append(InlineKeyboardButton("◀️ Новее", callback_data=newer_data))
+    if older_data:
+        nav.append(InlineKeyboardButton("Старше ▶️", callback_data=older_data))
+    if nav:
+        buttons.append(nav)
+    return InlineKeyboardMarkup(buttons)
+
+def order_detail_keyboard(order_id, status, page_id):
+    buttons = []
+    if status == 'pending':
+        buttons.append([InlineKeyboardButton("💳 Оплатить", callback_data=encode("pay_retry_", order_id))])
+    buttons.append([InlineKeyboardButton("« К заказам", callback_data=encode("ord_page_from_", page_id))])
+    return InlineKeyboardMarkup(buttons)
+
 def cart_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("✅ Оформить заказ", callback_data="checkout")],
-        [InlineKeyboardButton("🗑 Очистить корзину", callback_data="clear_cart")],
-        [InlineKeyboardButton("🏠 « Назад", callback_data="back_to_main")]
-    ])
+    return _CART_KEYBOARD
+
+_CHECKOUT_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💳 Оплатить", callback_data="pay_order")],
+    [InlineKeyboardButton("📱 Ввести данные", callback_data="enter_data")],
+    [InlineKeyboardButton("🏠 « Назад", callback_data="back_to_cart")]
+])
 
 def checkout_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("💳 Оплатить", callback_data="pay_order")],
-        [InlineKeyboardButton("📱 Ввести данные", callback_data="enter_data")],
-        [InlineKeyboardButton("🏠 « Назад", callback_data="back_to_cart")]
-    ])
+    return _CHECKOUT_KEYBOARD
+
+_ADMIN_ORDERS_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🏠 « Назад", callback_data="back_to_admin")]
+])
 
 def admin_orders_keyboard():
+    return _ADMIN_ORDERS_KEYBOARD
+
+def broadcast_keyboard(broadcast_id):
+    # Кнопка под сообщением с прогрессом рассылки
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("📋 Все заказы", callback_data="admin_all_orders")],
-        [InlineKeyboardButton("🔍 Поиск заказа", callback_data="admin_search_order")],
-        [InlineKeyboardButton("🏠 « Назад", callback_data="back_to_admin")]
+        [InlineKeyboardButton("⛔ Остановить рассылку", callback_data=encode("broadcast_cancel_", broadcast_id))]
     ])
 
+_CANCEL_KEYBOARD = ReplyKeyboardMarkup([[CANCEL_LABEL]], resize_keyboard=True)
+
 def cancel_keyboard():
-    return ReplyKeyboardMarkup([["❌ Отмена"]], resize_keyboard=True)
+    return _CANCEL_KEYBOARD
 
 # НОВЫЕ КЛАВИАТУРЫ ДЛЯ РЕДАКТИРОВАНИЯ
-def admin_edit_products_keyboard(products):
+# Фильтры списка товаров в админке: код для callback_data и кнопка.
+# Кроме них фильтром может быть код категории из CATEGORIES.
+ADMIN_PRODUCT_FILTERS = [
+    ("all", "📋 Все"),
+    ("active", "✅ Активные"),
+    ("inactive", "🚫 Скрытые"),
+]
+
+# Поисковый запрос хранится в callback_data кнопок листания (лимит 64 байта)
+SEARCH_QUERY_MAX_BYTES = 32
+
+def admin_page_data(product_filter, direction, cursor_id, search=None):
+    # Листание обычного списка: adm_list_<фильтр>_<next|prev>_<id>,
+    # результатов поиска: adm_find_<next|prev>_<id>_<запрос>
+    if search is None:
+        return encode("adm_list_", product_filter, direction, cursor_id)
+    return encode("adm_find_", direction, cursor_id, search)
+
+def admin_edit_products_keyboard(products, product_filter='all', prev_data=None, next_data=None):
+    # Клавиатура зависит от названий, цен и видимости, поэтому они входят в ключ
+    key = ('admin_edit', product_filter, prev_data, next_data) + tuple(
+        (p['id'], p['name'], p['price'], p['is_active']) for p in products
+    )
+    return keyboard_cache.get(
+        key, None, lambda: _build_admin_edit_products_keyboard(products, product_filter, prev_data, next_data)
+    )
+
+def _build_admin_edit_products_keyboard(products, product_filter, prev_data, next_data):
     buttons = []
     for product in products:
+        mark = "✏️" if product['is_active'] else "🚫"
         buttons.append([InlineKeyboardButton(
-            f"✏️ {product['name']} ({product['price']} руб.)", 
-            callback_data=f"edit_product_{product['id']}"
+            f"{mark} {product['name']} ({product['price']} руб.)", 
+            callback_data=encode("edit_product_", product['id'])
         )])
+    
+    nav = []
+    if prev_data:
+        nav.append(InlineKeyboardButton("◀️", callback_data=prev_data))
+    if next_data:
+        nav.append(InlineKeyboardButton("▶️", callback_data=next_data))
+    if nav:
+        buttons.append(nav)
+    
+    # Текущий фильтр отмечается точкой
+    def filter_button(code, label):
+        if code == product_filter:
+            label = "• " + label
+        return InlineKeyboardButton(label, callback_data=admin_page_data(code, "next", 0))
+    
+    buttons.append([filter_button(code, label) for code, label in ADMIN_PRODUCT_FILTERS])
+    category_buttons = [filter_button(slug, label) for slug, label, _ in CATEGORIES]
+    for i in range(0, len(category_buttons), 3):
+        buttons.append(category_buttons[i:i + 3])
+    buttons.append([InlineKeyboardButton("🔍 Поиск по названию или ID", callback_data="adm_search")])
     buttons.append([InlineKeyboardButton("🏠 « Назад", callback_data="back_to_admin")])
     return InlineKeyboardMarkup(buttons)
 
 def product_edit_keyboard(product_id):
+    return keyboard_cache.get(('edit', product_id), product_id, lambda: _build_product_edit_keyboard(product_id))
+
+def _build_product_edit_keyboard(product_id):
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("📝 Изменить название", callback_data=f"edit_name_{product_id}")],
-        [InlineKeyboardButton("📝 Изменить описание", callback_data=f"edit_desc_{product_id}")],
-        [InlineKeyboardButton("💰 Изменить цену", callback_data=f"edit_price_{product_id}")],
-        [InlineKeyboardButton("📁 Изменить категорию", callback_data=f"edit_category_{product_id}")],
-        [InlineKeyboardButton("🖼 Изменить изображение", callback_data=f"edit_image_{product_id}")],
-        [InlineKeyboardButton("🗑 Удалить товар", callback_data=f"delete_product_{product_id}")],
+        [InlineKeyboardButton("📝 Изменить название", callback_data=encode("edit_name_", product_id))],
+        [InlineKeyboardButton("📝 Изменить описание", callback_data=encode("edit_desc_", product_id))],
+        [InlineKeyboardButton("💰 Изменить цену", callback_data=encode("edit_price_", product_id))],
+        [InlineKeyboardButton("📁 Изменить категорию", callback_data=encode("edit_category_", product_id))],
+        [InlineKeyboardButton("🖼 Изменить изображение", callback_data=encode("edit_image_", product_id))],
+        [InlineKeyboardButton("🗑 Удалить товар", callback_data=encode("delete_product_", product_id))],
         [InlineKeyboardButton("🏠 « Назад", callback_data="admin_edit_menu")]
     ])
 
 def confirm_delete_keyboard(product_id):
+    return keyboard_cache.get(('delete', product_id), product_id, lambda: _build_confirm_delete_keyboard(product_id))
+
+def _build_confirm_delete_keyboard(product_id):
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("✅ Да, удалить", callback_data=f"confirm_delete_{product_id}")],
-        [InlineKeyboardButton("❌ Отмена", callback_data=f"edit_product_{product_id}")]
+        [InlineKeyboardButton("✅ Да, удалить", callback_data=encode("confirm_delete_", product_id))],
+        [InlineKeyboardButton("❌ Отмена", callback_data=encode("edit_product_", product_id))]
     ])
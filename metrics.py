@@ -0,0 +1,173 @@
+# Метрики обработчиков и запросов к БД: число вызовов, ошибок, строк и
+# гистограмма времени выполнения для каждого обработчика и запроса.
+# Отдаются в текстовом формате Prometheus (MetricsServer, /metrics) и
+# кратко — командой /stats. Замер — два вызова perf_counter и поиск
+# корзины гистограммы, поэтому метрики можно держать включёнными всегда.
+import bisect
+import functools
+import logging
+import time
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Верхние границы корзин гистограммы, секунды
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PREFIX = 'jojo'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Вид замера -> (метка в Prometheus, описание)
+KINDS = {
+    'handler': ('handler', 'Обработчики обновлений Telegram'),
+    'query': ('query', 'Функции запросов к БД (database.py)'),
+}
+
+
+def handler_name(handler):
+    # functools.partial (например, start_edit_field) называем по функции
+    while isinstance(handler, functools.partial):
+        handler = handler.func
+    return getattr(handler, '__name__', repr(handler))
+
+
+def count_rows(result):
+    # Сколько строк вернул запрос: список строк, (строки, флаги...) или одна строка
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])
+    if isinstance(result, (bool, int, float, str)):
+        return None
+    return 1
+
+
+class Timer:
+    """Счётчики и гистограмма одного обработчика или запроса."""
+
+    __slots__ = ('count', 'errors', 'rows', 'total', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, seconds, error=False, rows=None):
+        self.count += 1
+        self.total += seconds
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        if error:
+            self.errors += 1
+        if rows:
+            self.rows += rows
+
+    def quantile(self, fraction):
+        # Оценка сверху: граница корзины, в которую попадает квантиль
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    def __init__(self):
+        self._timers = {kind: {} for kind in KINDS}
+
+    def timer(self, kind, name):
+        timers = self._timers[kind]
+        timer = timers.get(name)
+        if timer is None:
+            timer = timers[name] = Timer()
+        return timer
+
+    def instrument(self, kind, func, name=None):
+        """Обёртка async-функции, которая замеряет каждый её вызов."""
+        timer = self.timer(kind, name or handler_name(func))
+        measure_rows = kind == 'query'
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception:
+                timer.observe(time.perf_counter() - started, error=True)
+                raise
+            timer.observe(time.perf_counter() - started, rows=count_rows(result) if measure_rows else None)
+            return result
+
+        return wrapper
+
+    def top(self, kind, limit=10):
+        # Самые затратные по суммарному времени: [(имя, Timer)]
+        timers = sorted(self._timers[kind].items(), key=lambda item: item[1].total, reverse=True)
+        return [(name, timer) for name, timer in timers[:limit] if timer.count]
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus."""
+        lines = []
+        for kind, (label, description) in KINDS.items():
+            timers = sorted(self._timers[kind].items())
+            metric = f'{PREFIX}_{kind}_duration_seconds'
+            lines.append(f'# HELP {metric} {description}: время выполнения')
+            lines.append(f'# TYPE {metric} histogram')
+            for name, timer in timers:
+                cumulative = 0
+                for bound, count in zip(BUCKETS, timer.buckets):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{label}="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{label}="{name}",le="+Inf"}} {timer.count}')
+                lines.append(f'{metric}_sum{{{label}="{name}"}} {timer.total}')
+                lines.append(f'{metric}_count{{{label}="{name}"}} {timer.count}')
+
+            metric = f'{PREFIX}_{kind}_errors_total'
+            lines.append(f'# HELP {metric} {description}: завершились исключением')
+            lines.append(f'# TYPE {metric} counter')
+            for name, timer in timers:
+                lines.append(f'{metric}{{{label}="{name}"}} {timer.errors}')
+
+            if kind == 'query':
+                metric = f'{PREFIX}_query_rows_total'
+                lines.append(f'# HELP {metric} {description}: возвращено строк')
+                lines.append(f'# TYPE {metric} counter')
+                for name, timer in timers:
+                    lines.append(f'{metric}{{{label}="{name}"}} {timer.rows}')
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """HTTP-сервер для сбора метрик Prometheus: GET /metrics."""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self._runner = None
+
+    async def handle_metrics(self, request):
+        return web.Response(body=self.metrics.render().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
+
+    async def start(self, host, port):
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Метрики доступны на {host}:{port}/metrics")
+
+    async def stop(self):
+        if self._runner:
+            runner, self._runner = self._runner, None
+            await runner.cleanup()
+
+
+# Общий реестр метрик процесса
+metrics = Metrics()
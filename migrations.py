@@ -0,0 +1,210 @@
+# Версионные миграции схемы базы. Номер последней применённой миграции
+# хранится в PRAGMA user_version. При старте применяются только миграции
+# с большим номером, каждая в своей транзакции вместе с новым user_version,
+# поэтому сбой посередине не оставляет схему в промежуточном состоянии.
+# Новые изменения схемы добавляются в конец MIGRATIONS и не переписываются.
+#
+# Базы, созданные до появления миграций, имеют user_version = 0: шаги
+# написаны так, чтобы их можно было применить поверх уже существующих таблиц.
+import logging
+
+from stats import SCHEMA as STATS_SCHEMA, BACKFILL as STATS_BACKFILL
+from search import SCHEMA as SEARCH_SCHEMA, BACKFILL as SEARCH_BACKFILL
+
+logger = logging.getLogger(__name__)
+
+
+def add_column(table, column, definition):
+    # ALTER TABLE ADD COLUMN не поддерживает IF NOT EXISTS
+    async def step(db):
+        async with db.execute(f'PRAGMA table_info({table})') as cursor:
+            columns = [row['name'] for row in await cursor.fetchall()]
+        if column not in columns:
+            await db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    return step
+
+
+MIGRATIONS = [
+    (1, 'Товары, пользователи, корзина и заказы', [
+        '''
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            price INTEGER NOT NULL,
+            category TEXT,
+            image_path TEXT,
+            image_file_id TEXT,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # file_id изображения в Telegram для старых баз без этой колонки
+        add_column('products', 'image_file_id', 'TEXT'),
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            phone TEXT,
+            address TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS cart (
+            user_id INTEGER,
+            product_id INTEGER,
+            quantity INTEGER DEFAULT 1,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
+            FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE,
+            PRIMARY KEY (user_id, product_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            total_amount INTEGER,
+            status TEXT DEFAULT 'pending',
+            payment_id TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS order_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER,
+            product_id INTEGER,
+            quantity INTEGER,
+            price INTEGER,
+            FOREIGN KEY (order_id) REFERENCES orders (id) ON DELETE CASCADE,
+            FOREIGN KEY (product_id) REFERENCES products (id)
+        )
+        ''',
+    ]),
+    (2, 'Рассылки и состояния диалогов', [
+        # Состояние задания рассылки и позиция курсора по users.user_id
+        '''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            status TEXT DEFAULT 'running',
+            cursor_user_id INTEGER DEFAULT 0,
+            total_count INTEGER DEFAULT 0,
+            sent_count INTEGER DEFAULT 0,
+            failed_count INTEGER DEFAULT 0,
+            admin_chat_id INTEGER,
+            status_message_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''',
+        # Состояния диалогов для SqliteStateStore
+        '''
+        CREATE TABLE IF NOT EXISTS user_states (
+            user_id INTEGER PRIMARY KEY,
+            state TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        ''',
+    ]),
+    (3, 'Статистика на триггерах', STATS_SCHEMA + STATS_BACKFILL),
+    (4, 'Полнотекстовый поиск товаров', SEARCH_SCHEMA + SEARCH_BACKFILL),
+    (5, 'Индексы для частых запросов', [
+        # Карусель каталога: активные товары категории по id
+        'CREATE INDEX IF NOT EXISTS idx_products_active_category ON products (is_active, category, id)',
+        # Список товаров в админке с фильтром по категории
+        'CREATE INDEX IF NOT EXISTS idx_products_category ON products (category, id)',
+        # История заказов пользователя: keyset по (created_at, id)
+        'CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at)',
+        # Сверка неоплаченных заказов и поиск заказа по платежу
+        'CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders (status, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_payment_id ON orders (payment_id)',
+        # Состав заказа
+        'CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)',
+        # Удаление просроченных состояний
+        'CREATE INDEX IF NOT EXISTS idx_user_states_expires ON user_states (expires_at)',
+    ]),
+    (6, 'Артикул товара для импорта каталога', [
+        add_column('products', 'sku', 'TEXT'),
+        # Уникален только у товаров с артикулом: добавленные вручную его не имеют
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_products_sku ON products (sku) WHERE sku IS NOT NULL',
+    ]),
+    (7, 'Время создания платежа заказа', [
+        # Повторная оплата создаёт новый платёж: сверка отсчитывает его
+        # возраст от создания платежа, а не заказа
+        add_column('orders', 'payment_created_at', 'TIMESTAMP'),
+        'UPDATE orders SET payment_created_at = created_at WHERE payment_id IS NOT NULL AND payment_created_at IS NULL',
+        'CREATE INDEX IF NOT EXISTS idx_orders_status_payment_created ON orders (status, payment_created_at)',
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Частые запросы и индексы, которые они должны использовать. После
+# миграций планы проверяются через EXPLAIN QUERY PLAN: если запрос стал
+# читать таблицу целиком, в журнал пишется предупреждение
+QUERY_PLANS = [
+    ('каталог по категории', 'idx_products_active_category',
+     'SELECT * FROM products WHERE is_active = 1 AND category = ? AND id > ? ORDER BY id LIMIT ?', ('', 0, 1)),
+    ('товары категории в админке', 'idx_products_category',
+     'SELECT * FROM products WHERE category = ? AND id > ? ORDER BY id LIMIT ?', ('', 0, 1)),
+    ('история заказов', 'idx_orders_user_created',
+     'SELECT * FROM orders WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT ?', (0, 1)),
+    ('неоплаченные платежи', 'idx_orders_status_payment_created',
+     "SELECT payment_id, payment_created_at FROM orders WHERE status = 'pending' AND payment_id IS NOT NULL "
+     "AND payment_created_at >= ? ORDER BY payment_created_at", ('',)),
+    ('заказ по платежу', 'idx_orders_payment_id',
+     'SELECT id FROM orders WHERE payment_id = ?', ('',)),
+    ('состав заказа', 'idx_order_items_order',
+     'SELECT * FROM order_items WHERE order_id = ? ORDER BY id', (0,)),
+]
+
+
+async def get_version(db):
+    async with db.execute('PRAGMA user_version') as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def migrate(db):
+    """Применяет недостающие миграции; возвращает номер версии схемы."""
+    version = await get_version(db)
+    if version >= SCHEMA_VERSION:
+        return version
+
+    for number, title, steps in MIGRATIONS:
+        if number <= version:
+            continue
+        logger.info(f"Миграция {number}: {title}")
+        await db.execute('BEGIN IMMEDIATE')
+        try:
+            for step in steps:
+                if callable(step):
+                    await step(db)
+                else:
+                    await db.execute(step)
+            await db.execute(f'PRAGMA user_version = {number}')
+        except BaseException:
+            await db.rollback()
+            raise
+        await db.commit()
+        version = number
+
+    for title, plan in await check_query_plans(db):
+        logger.warning(f"Запрос «{title}» не использует индекс: {plan}")
+    return version
+
+
+async def check_query_plans(db):
+    """Возвращает [(запрос, план)] для запросов, которые не используют свой индекс."""
+    problems = []
+    for title, index, sql, params in QUERY_PLANS:
+        async with db.execute(f'EXPLAIN QUERY PLAN {sql}', params) as cursor:
+            plan = '; '.join(row['detail'] for row in await cursor.fetchall())
+        if index not in plan:
+            problems.append((title, plan))
+    return problems
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from broadcast import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class Notifier:
+    """Очередь служебных уведомлений (оплата заказа и т.п.).
+
+    send() только ставит сообщение в очередь и не ждёт Telegram, поэтому
+    его можно вызывать из обработчиков и фоновых задач. Отправка идёт в
+    одной фоновой задаче с ограничением скорости; при переполнении очереди
+    новые сообщения отбрасываются с предупреждением в логе.
+    """
+
+    def __init__(self, bot, rate=10, queue_size=10000):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self._queue = asyncio.Queue(queue_size)
+        self._task = None
+        self.sent = 0
+        self.dropped = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout=5):
+        # Даём отправить то, что уже в очереди, но не ждём бесконечно
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не отправлено уведомлений при остановке: {self._queue.qsize()}")
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def send(self, chat_id, text):
+        try:
+            self._queue.put_nowait((chat_id, text))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"Очередь уведомлений заполнена, сообщение для {chat_id} отброшено")
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    async def _run(self):
+        while True:
+            chat_id, text = await self._queue.get()
+            try:
+                await self._deliver(chat_id, text)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, chat_id, text):
+        while True:
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, parse_mode='HTML')
+                self.sent += 1
+                return
+            except RetryAfter as e:
+                logger.warning(f"Уведомления: лимит Telegram, пауза {e.retry_after} с")
+                self.bucket.pause(e.retry_after)
+            except (Forbidden, BadRequest) as e:
+                logger.info(f"Уведомление для {chat_id} не доставлено: {e}")
+                return
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомления {chat_id}: {e}")
+                return
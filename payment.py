@@ -1,34 +1,149 @@
-# Пока заглушка, можно расширить интеграцией с ЮKassa
-def create_payment_stub(amount, description, user_id):
-    # Здесь будет интеграция с платежной системой
-    payment_url = "https://example.com/payment"  # Заглушка
-    payment_id = "payment_12345"  # Заглушка
-    return payment_url, payment_id
-
-# Реальная интеграция с ЮKassa (раскомментируйте при необходимости)
-"""
-from yookassa import Payment, Configuration
-from config import YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY
+import asyncio
+import logging
+import random
 import uuid
+from abc import ABC, abstractmethod
 
-Configuration.account_id = YOOKASSA_SHOP_ID
-Configuration.secret_key = YOOKASSA_SECRET_KEY
-
-def create_payment(amount, description, user_id, return_url="https://t.me/your_bot"):
-    payment = Payment.create({
-        "amount": {
-            "value": str(amount),
-            "currency": "RUB"
-        },
-        "confirmation": {
-            "type": "redirect",
-            "return_url": return_url
-        },
-        "capture": True,
-        "description": description,
-        "metadata": {
-            "user_id": user_id
-        }
-    })
-    return payment.confirmation.confirmation_url, payment.id
-"""
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Пространство имён для ключей идемпотентности: ключ зависит только от
+# магазина и номера заказа, поэтому повторный запрос по тому же заказу
+# (повтор после таймаута, повторное нажатие «Оплатить») не создаёт второй платёж
+IDEMPOTENCE_NAMESPACE = uuid.UUID('6f1c2a5e-3b7d-4f0e-9a8c-2d4b6e8f0a1c')
+
+
+class PaymentError(Exception):
+    """Платёж не удалось создать или получить (после всех повторов)."""
+
+
+def idempotence_key(shop_id, order_id):
+    return str(uuid.uuid5(IDEMPOTENCE_NAMESPACE, f"{shop_id}:order:{order_id}"))
+
+
+class PaymentProvider(ABC):
+    """Платёжная система. create_payment возвращает (payment_url, payment_id),
+    get_payment — словарь платежа с полем status (pending, succeeded, canceled),
+    list_payments — страницу платежей, созданных не раньше created_after
+    (ISO 8601, UTC) и, если задан status, только в этом статусе, и курсор
+    следующей страницы (None — страниц больше нет)."""
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def create_payment(self, order_id, amount, description, user_id):
+        pass
+
+    @abstractmethod
+    async def get_payment(self, payment_id):
+        pass
+
+    @abstractmethod
+    async def list_payments(self, created_after, cursor=None, status=None):
+        pass
+
+
+class StubPaymentProvider(PaymentProvider):
+    """Заглушка, пока платёжная система не подключена."""
+
+    async def create_payment(self, order_id, amount, description, user_id):
+        return "https://example.com/payment", f"payment_{order_id}"
+
+    async def get_payment(self, payment_id):
+        return {'id': payment_id, 'status': 'pending'}
+
+    async def list_payments(self, created_after, cursor=None, status=None):
+        return [], None
+
+
+class YooKassaProvider(PaymentProvider):
+    """Клиент API ЮKassa на aiohttp.
+
+    Одна сессия с пулом соединений на всё время работы бота, таймаут на
+    каждый запрос, повтор при сетевых ошибках, 429 и 5xx с экспоненциальной
+    задержкой. Создание платежа идемпотентно по номеру заказа.
+    """
+
+    def __init__(self, shop_id, secret_key, return_url, api_url='https://api.yookassa.ru/v3',
+                 timeout=10, retries=3, backoff=0.5, pool_size=20):
+        self.shop_id = shop_id
+        self.secret_key = secret_key
+        self.return_url = return_url
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self._session = None
+
+    async def start(self):
+        self._session = aiohttp.ClientSession(
+            auth=aiohttp.BasicAuth(str(self.shop_id), self.secret_key),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+        )
+
+    async def close(self):
+        if self._session is not None:
+            session, self._session = self._session, None
+            await session.close()
+
+    async def _request(self, method, path, payload=None, key=None, params=None):
+        headers = {'Idempotence-Key': key} if key else {}
+        url = self.api_url + path
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2 ** attempt * (1 + random.random())
+            try:
+                async with self._session.request(method, url, json=payload, headers=headers, params=params) as response:
+                    if response.status < 400:
+                        return await response.json()
+                    body = await response.text()
+                    if response.status != 429 and response.status < 500:
+                        raise PaymentError(f"ЮKassa ответила {response.status}: {body}")
+                    retry_after = response.headers.get('Retry-After', '')
+                    if retry_after.isdigit():
+                        delay = max(delay, int(retry_after))
+                    error = f"ЮKassa ответила {response.status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = f"ошибка соединения с ЮKassa: {e!r}"
+            if attempt < self.retries:
+                logger.warning(f"{method} {path}: {error}, повтор через {delay:.1f} с")
+                await asyncio.sleep(delay)
+        raise PaymentError(error)
+
+    async def create_payment(self, order_id, amount, description, user_id):
+        payment = await self._request('POST', '/payments', {
+            'amount': {'value': f"{amount:.2f}", 'currency': 'RUB'},
+            'confirmation': {'type': 'redirect', 'return_url': self.return_url},
+            'capture': True,
+            'description': description,
+            'metadata': {'order_id': order_id, 'user_id': user_id},
+        }, key=idempotence_key(self.shop_id, order_id))
+        return payment['confirmation']['confirmation_url'], payment['id']
+
+    async def get_payment(self, payment_id):
+        return await self._request('GET', f'/payments/{payment_id}')
+
+    async def list_payments(self, created_after, cursor=None, status=None):
+        params = {'created_at.gte': created_after, 'limit': 100}
+        if status:
+            params['status'] = status
+        if cursor:
+            params['cursor'] = cursor
+        page = await self._request('GET', '/payments', params=params)
+        return page.get('items', []), page.get('next_cursor')
+
+
+def create_payment_provider(backend, shop_id='', secret_key='', return_url='', api_url=None,
+                            timeout=10, retries=3):
+    if backend == 'stub':
+        return StubPaymentProvider()
+    if backend == 'yookassa':
+        return YooKassaProvider(shop_id, secret_key, return_url, api_url or 'https://api.yookassa.ru/v3',
+                                timeout=timeout, retries=retries)
+    raise ValueError(f"Неизвестная платёжная система: {backend}")
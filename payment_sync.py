@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from aiohttp import web
+
+from database import get_pending_payments, apply_payment_statuses
+from payment import PaymentError
+
+logger = logging.getLogger(__name__)
+
+# Итоговые статусы платежа ЮKassa -> статус заказа
+ORDER_STATUSES = {
+    'succeeded': 'paid',
+    'canceled': 'canceled',
+}
+
+# Запас на расхождение часов бота и платёжной системы при сверке
+CLOCK_SKEW = timedelta(minutes=5)
+
+
+class PaymentSync:
+    """Обновление статусов заказов по данным платёжной системы.
+
+    Два источника: уведомления ЮKassa (HTTP POST на path) и периодическая
+    сверка. Сверка берёт платежи неоплаченных заказов, созданные не раньше
+    expiry секунд назад, листает у платёжной системы только ещё не
+    проведённые платежи и перечитывает те платежи заказов, которых в этом
+    списке нет: их итоговый статус не дошёл уведомлением. Заказ меняет
+    статус только по ответу платёжной системы.
+    Данным из тела уведомления не доверяем: платёж перечитывается через API.
+    Об изменениях сообщается покупателю и в ADMIN_CHAT_ID через Notifier.
+    """
+
+    def __init__(self, provider, notifier, admin_chat_id, interval=60, expiry=24 * 3600):
+        self.provider = provider
+        self.notifier = notifier
+        self.admin_chat_id = admin_chat_id
+        self.interval = interval
+        self.expiry = expiry
+        self._task = None
+        self._runner = None
+        self.updated = 0
+
+    async def apply(self, payments):
+        statuses = [
+            (payment['id'], ORDER_STATUSES[payment['status']])
+            for payment in payments if payment.get('status') in ORDER_STATUSES
+        ]
+        orders = await apply_payment_statuses(statuses)
+        for order in orders:
+            self._notify(order)
+        self.updated += len(orders)
+        return len(orders)
+
+    def _notify(self, order):
+        if order['status'] == 'paid':
+            self.notifier.send(order['user_id'], f"✅ Заказ #{order['id']} оплачен!\n"
+                                                 f"💰 Сумма: {order['total_amount']} руб.\n"
+                                                 "Спасибо за покупку!")
+            self.notifier.send(self.admin_chat_id, f"💰 Оплачен заказ #{order['id']} на {order['total_amount']} руб. "
+                                                   f"(пользователь {order['user_id']})")
+        else:
+            self.notifier.send(order['user_id'], f"❌ Оплата заказа #{order['id']} отменена.")
+
+    async def reconcile(self):
+        pending = await get_pending_payments(self.expiry)
+        if not pending:
+            return 0
+        # payment_created_at в SQLite хранится в UTC как 'YYYY-MM-DD HH:MM:SS'
+        since = datetime.strptime(pending[0]['payment_created_at'], '%Y-%m-%d %H:%M:%S') - CLOCK_SKEW
+        created_after = since.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+        # Список только ожидающих оплаты платежей не растёт вместе с числом
+        # уже проведённых и отменённых
+        still_pending = set()
+        cursor = None
+        while True:
+            payments, cursor = await self.provider.list_payments(created_after, cursor, status='pending')
+            still_pending.update(payment['id'] for payment in payments)
+            if not cursor:
+                break
+
+        resolved = []
+        for row in pending:
+            if row['payment_id'] in still_pending:
+                continue
+            try:
+                resolved.append(await self.provider.get_payment(row['payment_id']))
+            except PaymentError as e:
+                logger.warning(f"Сверка платежа {row['payment_id']}: {e}")
+        return await self.apply(resolved)
+
+    async def _reconcile_loop(self):
+        while True:
+            try:
+                updated = await self.reconcile()
+                if updated:
+                    logger.info(f"Сверка платежей: обновлено заказов {updated}")
+            except Exception as e:
+                logger.error(f"Ошибка сверки платежей: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def handle_notification(self, request):
+        try:
+            data = await request.json()
+            payment_id = data['object']['id']
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=400)
+        try:
+            payment = await self.provider.get_payment(payment_id)
+        except PaymentError as e:
+            # Не 200 — ЮKassa повторит уведомление позже
+            logger.warning(f"Уведомление о платеже {payment_id}: {e}")
+            return web.Response(status=503)
+        await self.apply([payment])
+        return web.Response()
+
+    def start(self):
+        self._task = asyncio.create_task(self._reconcile_loop())
+
+    async def serve(self, host, port, path):
+        app = web.Application()
+        app.router.add_post(path, self.handle_notification)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Уведомления о платежах принимаются на {host}:{port}{path}")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
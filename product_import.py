@@ -0,0 +1,286 @@
+# Массовый импорт товаров из CSV или JSON. Файл читается потоково, по
+# chunk_size строк: чтение и проверка пачки идут в отдельном потоке, запись —
+# одной транзакцией executemany на пачку, поэтому большой каталог не держит
+# цикл событий и соединение-писатель дольше, чем нужно на одну пачку.
+#
+# Поля строки: sku (артикул), name, description, price, category, image.
+# В CSV допускаются и русские заголовки (Артикул, Название, ...), разделитель
+# «,», «;» или табуляция определяется автоматически. JSON — массив объектов
+# или JSON Lines (по объекту в строке). Товар с артикулом, который уже есть
+# в базе, обновляется, без артикула — добавляется как новый.
+import asyncio
+import csv
+import itertools
+import json
+import os
+
+from database import upsert_products
+
+# Заголовки столбцов -> поле товара
+FIELD_ALIASES = {
+    'sku': 'sku', 'артикул': 'sku',
+    'name': 'name', 'название': 'name',
+    'description': 'description', 'описание': 'description',
+    'price': 'price', 'цена': 'price',
+    'category': 'category', 'категория': 'category',
+    'image': 'image', 'image_path': 'image', 'изображение': 'image', 'путь': 'image',
+}
+NAME_MAX_LENGTH = 200
+DESCRIPTION_MAX_LENGTH = 4000
+SKU_MAX_LENGTH = 64
+PRICE_MAX = 100_000_000
+
+# Размер блока при чтении JSON-массива
+JSON_READ_SIZE = 65536
+# Больше этого одна запись JSON-массива быть не может: дальше файл не
+# дочитывается, а импорт останавливается
+JSON_RECORD_MAX_SIZE = 1024 * 1024
+
+
+def detect_format(filename):
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.json', '.jsonl'):
+        return 'json'
+    return None
+
+
+def iter_csv(f):
+    """(номер строки, словарь) для каждой строки CSV после заголовка."""
+    sample = f.read(4096)
+    f.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(f, dialect=dialect)
+    for record in reader:
+        yield reader.line_num, record
+
+
+# Открывающая скобка для каждой закрывающей
+_OPENERS = {'}': '{', ']': '['}
+_SPACE = ' \t\r\n'
+
+
+def _element_end(buffer, position):
+    # Конец элемента массива, начинающегося с position: следующая запятая
+    # или «]» верхнего уровня либо закрытие скобки, открытой элементом.
+    # Скобки ведутся стеком, поэтому закрывающая скобка не своего типа
+    # закрывает и всё, что открыто после парной ей: {"a": [1} — один элемент.
+    # None, если элемент не закончился в буфере
+    stack = []
+    in_string = escaped = False
+    for index in range(position, len(buffer)):
+        char = buffer[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append(char)
+        elif char in '}]':
+            if not stack:
+                # «]» закрывает массив, лишняя «}» относится к элементу
+                return index if char == ']' else index + 1
+            opener = _OPENERS[char]
+            if opener in stack:
+                del stack[len(stack) - 1 - stack[::-1].index(opener):]
+                if not stack:
+                    return index + 1
+        elif char == ',' and not stack:
+            return index
+    return None
+
+
+def iter_json(f):
+    """(номер записи, объект) из JSON-массива или JSON Lines.
+
+    Массив разбирается по одному объекту из буфера, поэтому файл не
+    загружается в память целиком. Некорректная запись возвращается как
+    ошибка, и разбор продолжается со следующей; если конец записи не
+    найден в пределах JSON_RECORD_MAX_SIZE, импорт на ней останавливается.
+    Файл без закрывающей «]» тоже даёт ошибку.
+    """
+    decoder = json.JSONDecoder()
+    buffer = f.read(JSON_READ_SIZE).lstrip()
+    if not buffer.startswith('['):
+        # JSON Lines
+        f.seek(0)
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError as e:
+                    yield number, e
+        return
+
+    position = 1
+    number = 0
+    while True:
+        # Пропускаем пробелы и запятые между объектами, дочитывая файл
+        while True:
+            while position < len(buffer) and buffer[position] in _SPACE + ',':
+                position += 1
+            if position < len(buffer):
+                break
+            chunk = f.read(JSON_READ_SIZE)
+            if not chunk:
+                yield number + 1, ValueError(f"файл оборвался после записи {number}: нет закрывающей «]»")
+                return
+            buffer, position = chunk, 0
+        if buffer[position] == ']':
+            return
+        number += 1
+        while True:
+            error = None
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+                # После записи должен идти разделитель: 123abc — одна
+                # некорректная запись, а не две
+                after = end
+                while after < len(buffer) and buffer[after] in _SPACE:
+                    after += 1
+                if after < len(buffer):
+                    if buffer[after] in ',]':
+                        break
+                    raise ValueError(f"лишние символы после значения: «{buffer[after:after + 20]}»")
+            except ValueError as e:
+                error = e
+                end = _element_end(buffer, position)
+                if end is not None:
+                    # Запись целиком в буфере, но с ошибкой — переходим к следующей
+                    # (лишняя закрывающая скобка — запись из одного символа)
+                    value, end = error, max(end, position + 1)
+                    break
+                if len(buffer) - position > JSON_RECORD_MAX_SIZE:
+                    yield number, ValueError(f"конец записи не найден в пределах {JSON_RECORD_MAX_SIZE} байт, "
+                                             f"импорт остановлен на записи {number}: {error}")
+                    return
+            # Запись не поместилась в буфер целиком или кончается на его
+            # границе (число могло оборваться) — читаем дальше
+            chunk = f.read(JSON_READ_SIZE)
+            if not chunk:
+                if error is None:
+                    break
+                yield number, error
+                return
+            buffer, position = buffer[position:] + chunk, 0
+        yield number, value
+        position = end
+
+
+def parse_price(value):
+    text = str(value).strip().replace(' ', '').replace('\u00a0', '').replace(',', '.')
+    try:
+        price = float(text)
+    except ValueError:
+        raise ValueError(f"цена «{value}» не число")
+    if not 0 < price <= PRICE_MAX or price != int(price):
+        raise ValueError(f"цена должна быть целым положительным числом рублей, а не «{value}»")
+    return int(price)
+
+
+def validate(record, categories):
+    """Запись файла -> (sku, name, description, price, category, image_path).
+
+    categories — допустимые названия категорий; категория приводится к
+    написанию из этого списка. Ошибка в данных — ValueError с описанием.
+    """
+    if not isinstance(record, dict):
+        if isinstance(record, Exception):
+            raise ValueError(f"некорректный JSON: {record}")
+        raise ValueError("ожидался объект с полями товара")
+    fields = {}
+    for key, value in record.items():
+        field = FIELD_ALIASES.get(str(key).strip().lower())
+        if field and value is not None:
+            fields[field] = str(value).strip()
+
+    sku = fields.get('sku') or None
+    if sku is not None:
+        if len(sku) > SKU_MAX_LENGTH:
+            raise ValueError(f"артикул длиннее {SKU_MAX_LENGTH} символов")
+    name = fields.get('name')
+    if not name:
+        raise ValueError("нет названия")
+    if len(name) > NAME_MAX_LENGTH:
+        raise ValueError(f"название длиннее {NAME_MAX_LENGTH} символов")
+    description = fields.get('description', '')
+    if len(description) > DESCRIPTION_MAX_LENGTH:
+        raise ValueError(f"описание длиннее {DESCRIPTION_MAX_LENGTH} символов")
+    if not fields.get('price'):
+        raise ValueError("нет цены")
+    price = parse_price(fields['price'])
+    category = categories.get(fields.get('category', '').lower())
+    if category is None:
+        raise ValueError(f"неизвестная категория «{fields.get('category', '')}»")
+    image_path = fields.get('image') or None
+    if image_path and not os.path.isfile(image_path):
+        raise ValueError(f"файл изображения {image_path} не найден")
+    return sku, name, description, price, category, image_path
+
+
+class ImportReport:
+    def __init__(self, dry_run):
+        self.dry_run = dry_run
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.errors = []
+
+    @property
+    def failed(self):
+        return len(self.errors)
+
+
+def _read_chunk(records, categories, seen_skus, report, chunk_size):
+    # Выполняется в отдельном потоке: чтение и проверка очередной пачки строк
+    rows = []
+    for number, record in itertools.islice(records, chunk_size):
+        report.rows += 1
+        try:
+            row = validate(record, categories)
+        except ValueError as e:
+            report.errors.append((number, str(e)))
+            continue
+        sku = row[0]
+        if sku is not None:
+            if sku in seen_skus:
+                report.errors.append((number, f"артикул {sku} уже был в строке {seen_skus[sku]}"))
+                continue
+            seen_skus[sku] = number
+        rows.append(row)
+    return rows
+
+
+async def import_products(path, file_format, categories, dry_run=False, chunk_size=500, progress=None):
+    """Импорт товаров из файла; возвращает ImportReport.
+
+    categories — названия категорий каталога. progress(report), если
+    задан, вызывается после каждой пачки. В режиме dry_run файл
+    проверяется целиком, но в базу ничего не записывается.
+    """
+    categories = {name.lower(): name for name in categories}
+    report = ImportReport(dry_run)
+    seen_skus = {}
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        records = iter_csv(f) if file_format == 'csv' else iter_json(f)
+        while True:
+            position = report.rows
+            rows = await asyncio.to_thread(_read_chunk, records, categories, seen_skus, report, chunk_size)
+            if rows:
+                inserted, updated = await upsert_products(rows, dry_run=dry_run)
+                report.inserted += inserted
+                report.updated += updated
+            if report.rows == position:
+                break
+            if progress:
+                await progress(report)
+    return report
@@ -0,0 +1,129 @@
+# Полнотекстовый поиск товаров на SQLite FTS5. Таблица products_fts хранит
+# название, описание и категорию товара (rowid = products.id) и обновляется
+# триггерами при любом изменении products. Буква «ё» в индексе и в запросах
+# заменяется на «е», регистр FTS5 сворачивает сам (токенизатор unicode61).
+import re
+from collections import OrderedDict
+
+
+def _normalized(column):
+    return f"replace(replace({column}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def _insert(prefix):
+    return f'''
+        INSERT INTO products_fts (rowid, name, description, category)
+        VALUES ({prefix}.id, {_normalized(prefix + '.name')},
+                {_normalized(f"coalesce({prefix}.description, '')")},
+                {_normalized(f"coalesce({prefix}.category, '')")});
+    '''
+
+
+SCHEMA = [
+    # Префиксные индексы на 2 и 3 символа ускоряют поиск по началу слова
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, description, category,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products
+    BEGIN
+        {_insert('new')}
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products
+    BEGIN
+        DELETE FROM products_fts WHERE rowid = old.id;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, description, category ON products
+    BEGIN
+        DELETE FROM products_fts WHERE rowid = old.id;
+        {_insert('new')}
+    END
+    ''',
+]
+
+# Заполнение индекса для базы, созданной до появления поиска
+BACKFILL = [
+    'DELETE FROM products_fts',
+    f'''
+    INSERT INTO products_fts (rowid, name, description, category)
+    SELECT id, {_normalized('name')}, {_normalized("coalesce(description, '')")},
+           {_normalized("coalesce(category, '')")}
+    FROM products
+    ''',
+]
+
+# Веса столбцов для bm25: совпадение в названии важнее, чем в описании
+QUERY = '''
+    SELECT products.* FROM products_fts
+    JOIN products ON products.id = products_fts.rowid
+    WHERE products_fts MATCH ? AND products.is_active = 1
+    ORDER BY bm25(products_fts, 10.0, 1.0, 3.0)
+    LIMIT ? OFFSET ?
+'''
+
+_WORD = re.compile(r'\w+')
+# Окончания, которые отбрасываются, чтобы «фигурки» находили «фигурка»
+_ENDING = re.compile(r'[аеиоуыэюяйь]+$')
+
+
+def build_match(text):
+    """Запрос пользователя -> выражение MATCH: все слова по префиксу.
+
+    Каждое слово берётся в кавычки (операторы FTS5 в запросе не работают),
+    у русских слов длиннее четырёх букв отбрасывается гласное окончание.
+    Пустая строка означает, что искать нечего.
+    """
+    terms = []
+    for word in _WORD.findall(text.lower().replace('ё', 'е')):
+        stem = _ENDING.sub('', word) if len(word) > 4 else word
+        if len(stem) < 3:
+            stem = word
+        terms.append(f'"{stem}"*')
+    return ' '.join(terms)
+
+
+class SearchCache:
+    """LRU-кэш результатов поиска: (запрос, смещение, лимит) -> товары.
+
+    Сбрасывается целиком при любом изменении каталога.
+    """
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        rows = self._results.get(key)
+        if rows is None:
+            self.misses += 1
+            return None
+        self._results.move_to_end(key)
+        self.hits += 1
+        return rows
+
+    def put(self, key, rows):
+        self._results[key] = rows
+        while len(self._results) > self.max_size:
+            self._results.popitem(last=False)
+
+    def invalidate(self, product_id=None):
+        self._results.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': len(self._results),
+        }
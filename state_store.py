@@ -0,0 +1,141 @@
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+
+def dumps(state):
+    # Компактная запись: без пробелов и без экранирования кириллицы
+    return json.dumps(state, separators=(',', ':'), ensure_ascii=False)
+
+
+def loads(data):
+    return json.loads(data)
+
+
+class StateStore(ABC):
+    """Хранилище состояний диалогов (добавление товара, рассылка, редактирование).
+
+    Состояние — строка или словарь. Записи живут ttl секунд с момента
+    последней записи, после чего считаются удалёнными.
+    """
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self.evictions = 0
+
+    @abstractmethod
+    async def get(self, user_id):
+        pass
+
+    @abstractmethod
+    async def set(self, user_id, state):
+        pass
+
+    @abstractmethod
+    async def delete(self, user_id):
+        pass
+
+    @abstractmethod
+    async def size(self):
+        pass
+
+    async def purge(self):
+        return 0
+
+    async def stats(self):
+        return {'size': await self.size(), 'evictions': self.evictions}
+
+
+class MemoryStateStore(StateStore):
+    """Состояния в памяти процесса: LRU ограниченного размера с TTL."""
+
+    def __init__(self, ttl=3600, max_size=10000):
+        super().__init__(ttl)
+        self.max_size = max_size
+        self._states = OrderedDict()
+
+    async def get(self, user_id):
+        entry = self._states.get(user_id)
+        if entry is None:
+            return None
+        data, expires_at = entry
+        if expires_at <= time.time():
+            del self._states[user_id]
+            self.evictions += 1
+            return None
+        self._states.move_to_end(user_id)
+        return loads(data)
+
+    async def set(self, user_id, state):
+        self._states[user_id] = (dumps(state), time.time() + self.ttl)
+        self._states.move_to_end(user_id)
+        while len(self._states) > self.max_size:
+            self._states.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, user_id):
+        self._states.pop(user_id, None)
+
+    async def size(self):
+        return len(self._states)
+
+    async def purge(self):
+        now = time.time()
+        expired = [user_id for user_id, (_, expires_at) in self._states.items() if expires_at <= now]
+        for user_id in expired:
+            del self._states[user_id]
+        self.evictions += len(expired)
+        return len(expired)
+
+
+class SqliteStateStore(StateStore):
+    """Состояния в таблице user_states: переживают перезапуск и доступны
+    нескольким процессам бота, работающим с одной базой."""
+
+    def __init__(self, pool, ttl=3600):
+        super().__init__(ttl)
+        self.pool = pool
+
+    async def get(self, user_id):
+        async with self.pool.reader() as db:
+            async with db.execute('SELECT state, expires_at FROM user_states WHERE user_id = ?', (user_id,)) as cursor:
+                row = await cursor.fetchone()
+        if row is None:
+            return None
+        if row['expires_at'] <= time.time():
+            await self.delete(user_id)
+            self.evictions += 1
+            return None
+        return loads(row['state'])
+
+    async def set(self, user_id, state):
+        async with self.pool.writer() as db:
+            await db.execute('''
+                INSERT INTO user_states (user_id, state, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET state = excluded.state, expires_at = excluded.expires_at
+            ''', (user_id, dumps(state), time.time() + self.ttl))
+
+    async def delete(self, user_id):
+        async with self.pool.writer() as db:
+            await db.execute('DELETE FROM user_states WHERE user_id = ?', (user_id,))
+
+    async def size(self):
+        async with self.pool.reader() as db:
+            async with db.execute('SELECT COUNT(*) as count FROM user_states') as cursor:
+                return (await cursor.fetchone())['count']
+
+    async def purge(self):
+        async with self.pool.writer() as db:
+            cursor = await db.execute('DELETE FROM user_states WHERE expires_at <= ?', (time.time(),))
+            purged = cursor.rowcount
+        self.evictions += purged
+        return purged
+
+
+def create_state_store(backend, pool=None, ttl=3600, max_size=10000):
+    if backend == 'sqlite':
+        return SqliteStateStore(pool, ttl=ttl)
+    if backend == 'memory':
+        return MemoryStateStore(ttl=ttl, max_size=max_size)
+    raise ValueError(f"Неизвестное хранилище состояний: {backend}")
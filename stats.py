@@ -0,0 +1,137 @@
+# Статистика магазина, которая поддерживается триггерами при каждой записи,
+# поэтому отчёты читают несколько готовых строк вместо полного сканирования
+# users и orders. Выручка считается только по оплаченным заказам и
+# относится к дню создания заказа.
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS stats_counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS stats_daily (
+        day TEXT PRIMARY KEY,
+        orders_count INTEGER NOT NULL DEFAULT 0,
+        paid_count INTEGER NOT NULL DEFAULT 0,
+        revenue INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS stats_daily_category (
+        day TEXT NOT NULL,
+        category TEXT NOT NULL,
+        items_count INTEGER NOT NULL DEFAULT 0,
+        revenue INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, category)
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS stats_users_insert AFTER INSERT ON users
+    BEGIN
+        UPDATE stats_counters SET value = value + 1 WHERE name = 'users_count';
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS stats_users_delete AFTER DELETE ON users
+    BEGIN
+        UPDATE stats_counters SET value = value - 1 WHERE name = 'users_count';
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS stats_orders_insert AFTER INSERT ON orders
+    BEGIN
+        UPDATE stats_counters SET value = value + 1 WHERE name = 'orders_count';
+        INSERT INTO stats_daily (day, orders_count) VALUES (date(NEW.created_at), 1)
+            ON CONFLICT (day) DO UPDATE SET orders_count = orders_count + 1;
+    END
+    ''',
+    # Переход в статус paid и обратно (возврат) меняет выручку
+    '''
+    CREATE TRIGGER IF NOT EXISTS stats_orders_paid AFTER UPDATE OF status ON orders
+    WHEN NEW.status = 'paid' AND OLD.status IS NOT 'paid'
+    BEGIN
+        UPDATE stats_counters SET value = value + COALESCE(NEW.total_amount, 0) WHERE name = 'total_revenue';
+        INSERT INTO stats_daily (day, paid_count, revenue) VALUES (date(NEW.created_at), 1, COALESCE(NEW.total_amount, 0))
+            ON CONFLICT (day) DO UPDATE SET paid_count = paid_count + 1, revenue = revenue + excluded.revenue;
+        INSERT INTO stats_daily_category (day, category, items_count, revenue)
+            SELECT date(NEW.created_at), COALESCE(p.category, ''), SUM(oi.quantity), SUM(oi.quantity * oi.price)
+            FROM order_items oi JOIN products p ON oi.product_id = p.id
+            WHERE oi.order_id = NEW.id
+            GROUP BY 2
+            ON CONFLICT (day, category) DO UPDATE SET
+                items_count = items_count + excluded.items_count,
+                revenue = revenue + excluded.revenue;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS stats_orders_unpaid AFTER UPDATE OF status ON orders
+    WHEN OLD.status = 'paid' AND NEW.status IS NOT 'paid'
+    BEGIN
+        UPDATE stats_counters SET value = value - COALESCE(OLD.total_amount, 0) WHERE name = 'total_revenue';
+        UPDATE stats_daily SET paid_count = paid_count - 1, revenue = revenue - COALESCE(OLD.total_amount, 0)
+            WHERE day = date(OLD.created_at);
+        UPDATE stats_daily_category SET
+            items_count = items_count - (
+                SELECT COALESCE(SUM(oi.quantity), 0) FROM order_items oi JOIN products p ON oi.product_id = p.id
+                WHERE oi.order_id = OLD.id AND COALESCE(p.category, '') = stats_daily_category.category),
+            revenue = revenue - (
+                SELECT COALESCE(SUM(oi.quantity * oi.price), 0) FROM order_items oi JOIN products p ON oi.product_id = p.id
+                WHERE oi.order_id = OLD.id AND COALESCE(p.category, '') = stats_daily_category.category)
+            WHERE day = date(OLD.created_at);
+    END
+    ''',
+    # Позиции, добавленные к уже оплаченному заказу
+    '''
+    CREATE TRIGGER IF NOT EXISTS stats_order_items_insert AFTER INSERT ON order_items
+    WHEN (SELECT status FROM orders WHERE id = NEW.order_id) = 'paid'
+    BEGIN
+        INSERT INTO stats_daily_category (day, category, items_count, revenue)
+            SELECT date(o.created_at), COALESCE(p.category, ''), NEW.quantity, NEW.quantity * NEW.price
+            FROM orders o, products p
+            WHERE o.id = NEW.order_id AND p.id = NEW.product_id
+            ON CONFLICT (day, category) DO UPDATE SET
+                items_count = items_count + excluded.items_count,
+                revenue = revenue + excluded.revenue;
+    END
+    ''',
+]
+
+# Полный пересчёт из users/orders/order_items: первый запуск на старой базе
+# или команда /rebuild_stats
+BACKFILL = [
+    'DELETE FROM stats_counters',
+    'DELETE FROM stats_daily',
+    'DELETE FROM stats_daily_category',
+    '''
+    INSERT INTO stats_counters (name, value)
+    SELECT 'users_count', COUNT(*) FROM users
+    UNION ALL SELECT 'orders_count', COUNT(*) FROM orders
+    UNION ALL SELECT 'total_revenue', COALESCE(SUM(total_amount), 0) FROM orders WHERE status = 'paid'
+    ''',
+    '''
+    INSERT INTO stats_daily (day, orders_count, paid_count, revenue)
+    SELECT date(created_at), COUNT(*),
+           SUM(status = 'paid'),
+           COALESCE(SUM(CASE WHEN status = 'paid' THEN total_amount END), 0)
+    FROM orders
+    GROUP BY 1
+    ''',
+    '''
+    INSERT INTO stats_daily_category (day, category, items_count, revenue)
+    SELECT date(o.created_at), COALESCE(p.category, ''), SUM(oi.quantity), SUM(oi.quantity * oi.price)
+    FROM orders o
+    JOIN order_items oi ON oi.order_id = o.id
+    JOIN products p ON oi.product_id = p.id
+    WHERE o.status = 'paid'
+    GROUP BY 1, 2
+    ''',
+]
+
+# Периоды для отчёта: название и количество дней, включая сегодня
+PERIODS = [
+    ('Сегодня', 1),
+    ('7 дней', 7),
+    ('30 дней', 30),
+]
@@ -0,0 +1,35 @@
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# База для тестов создаётся во временной папке; путь нужно подменить до
+# импорта database, который открывает пул по config.DATABASE_PATH
+import config
+
+config.DATABASE_PATH = os.path.join(tempfile.mkdtemp(), 'data', 'test.db')
+
+import database
+
+_user_ids = itertools.count(1000)
+
+
+@pytest.fixture(scope='session')
+def run():
+    """Выполняет корутину в общем цикле событий с открытой тестовой базой."""
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(database.init_db())
+    yield loop.run_until_complete
+    loop.run_until_complete(database.close_db())
+    loop.close()
+
+
+@pytest.fixture
+def user_id():
+    # У каждого теста свой покупатель, чтобы корзины и заказы не пересекались
+    return next(_user_ids)
@@ -0,0 +1,22 @@
+import pytest
+
+from callback_router import MAX_CALLBACK_DATA, encode
+
+
+def test_encode_joins_arguments():
+    assert encode('add_to_cart_', 15) == 'add_to_cart_15'
+    assert encode('orders_page_', 10, 'older') == 'orders_page_10_older'
+    assert encode('back_to_admin') == 'back_to_admin'
+
+
+def test_encode_limit_is_64_bytes():
+    assert len(encode('p_', 'x' * (MAX_CALLBACK_DATA - 2))) == MAX_CALLBACK_DATA
+    with pytest.raises(ValueError):
+        encode('p_', 'x' * (MAX_CALLBACK_DATA - 1))
+
+
+def test_encode_counts_bytes_not_characters():
+    # 33 кириллические буквы — 66 байт в UTF-8
+    with pytest.raises(ValueError):
+        encode('', 'я' * 33)
+    assert encode('', 'я' * 32) == 'я' * 32
@@ -0,0 +1,30 @@
+from db_pool import ConnectionPool
+from migrations import SCHEMA_VERSION, check_query_plans, get_version, migrate
+
+
+def test_query_plans_use_indexes(run, tmp_path):
+    async def scenario():
+        pool = ConnectionPool(str(tmp_path / 'plans.db'), read_size=1)
+        try:
+            async with pool.writer() as db:
+                assert await migrate(db) == SCHEMA_VERSION
+                assert await get_version(db) == SCHEMA_VERSION
+                return await check_query_plans(db)
+        finally:
+            await pool.close()
+
+    assert run(scenario()) == []
+
+
+def test_migrate_is_idempotent(run, tmp_path):
+    async def scenario():
+        pool = ConnectionPool(str(tmp_path / 'twice.db'), read_size=1)
+        try:
+            async with pool.writer() as db:
+                await migrate(db)
+            async with pool.writer() as db:
+                return await migrate(db)
+        finally:
+            await pool.close()
+
+    assert run(scenario()) == SCHEMA_VERSION
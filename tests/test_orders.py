@@ -0,0 +1,134 @@
+import sqlite3
+
+import pytest
+
+import database
+from payment_sync import PaymentSync
+
+
+async def _fill_cart(user_id, *items):
+    # items — пары (цена, количество); возвращает id созданных товаров
+    product_ids = []
+    for price, quantity in items:
+        product_id = await database.add_product(f"Товар {price}", "", price, "Тест")
+        await database.add_to_cart(user_id, product_id, quantity)
+        product_ids.append(product_id)
+    return product_ids
+
+
+async def _count(table, user_id):
+    async with database.pool.reader() as db:
+        async with db.execute(f'SELECT COUNT(*) as count FROM {table} WHERE user_id = ?', (user_id,)) as cursor:
+            return (await cursor.fetchone())['count']
+
+
+async def _create_orders(user_id, count):
+    order_ids = []
+    async with database.pool.writer() as db:
+        for _ in range(count):
+            cursor = await db.execute('INSERT INTO orders (user_id, total_amount) VALUES (?, 100)', (user_id,))
+            order_ids.append(cursor.lastrowid)
+    return order_ids
+
+
+def test_checkout_moves_cart_to_order(run, user_id):
+    async def scenario():
+        product_ids = await _fill_cart(user_id, (100, 2), (250, 1))
+        order_id, total = await database.checkout(user_id)
+        items = await database.get_order_items(order_id)
+        return product_ids, order_id, total, items
+
+    product_ids, order_id, total, items = run(scenario())
+    assert total == 450
+    assert run(database.get_order(order_id))['total_amount'] == 450
+    assert [(item['product_id'], item['quantity'], item['price']) for item in items] == [
+        (product_ids[0], 2, 100), (product_ids[1], 1, 250)]
+    assert run(database.get_user_cart(user_id)) == []
+    assert run(_count('cart', user_id)) == 0
+
+
+def test_checkout_empty_cart(run, user_id):
+    assert run(database.checkout(user_id)) is None
+    assert run(_count('orders', user_id)) == 0
+
+
+def test_checkout_failure_leaves_no_partial_order(run, user_id):
+    async def scenario():
+        await _fill_cart(user_id, (100, 1), (300, 77))
+        # Сбой на второй позиции заказа, когда сам заказ уже вставлен
+        async with database.pool.writer() as db:
+            await db.execute('''
+                CREATE TEMP TRIGGER fail_order_items BEFORE INSERT ON order_items
+                WHEN NEW.quantity = 77 BEGIN SELECT RAISE(ABORT, 'сбой'); END
+            ''')
+        try:
+            with pytest.raises(sqlite3.DatabaseError):
+                await database.checkout(user_id)
+        finally:
+            async with database.pool.writer() as db:
+                await db.execute('DROP TRIGGER temp.fail_order_items')
+
+    run(scenario())
+    assert run(_count('orders', user_id)) == 0
+    assert run(_count('cart', user_id)) == 2
+    assert len(run(database.get_user_cart(user_id))) == 2
+
+
+def test_apply_payment_statuses_is_idempotent(run, user_id):
+    first, second = run(_create_orders(user_id, 2))
+    run(database.set_order_payment_id(first, f'pay-{first}'))
+    run(database.set_order_payment_id(second, f'pay-{second}'))
+
+    changed = run(database.apply_payment_statuses([(f'pay-{first}', 'paid')]))
+    assert [(order['id'], order['status']) for order in changed] == [(first, 'paid')]
+    # Повторное уведомление и поздний отказ по уже оплаченному заказу ничего не меняют
+    assert run(database.apply_payment_statuses([(f'pay-{first}', 'paid')])) == []
+    assert run(database.apply_payment_statuses([(f'pay-{first}', 'canceled')])) == []
+    assert run(database.get_order(first))['status'] == 'paid'
+    assert run(database.get_order(second))['status'] == 'pending'
+    assert run(database.apply_payment_statuses([])) == []
+
+
+def test_payment_sync_notifies_once(run, user_id):
+    class Notifier:
+        def __init__(self):
+            self.sent = []
+
+        def send(self, chat_id, text):
+            self.sent.append(chat_id)
+
+    order_id, = run(_create_orders(user_id, 1))
+    run(database.set_order_payment_id(order_id, f'pay-{order_id}'))
+    notifier = Notifier()
+    sync = PaymentSync(provider=None, notifier=notifier, admin_chat_id=1)
+    payments = [{'id': f'pay-{order_id}', 'status': 'succeeded'}, {'id': 'unknown', 'status': 'succeeded'}]
+
+    assert run(sync.apply(payments)) == 1
+    assert run(sync.apply(payments)) == 0
+    assert run(sync.apply([{'id': f'pay-{order_id}', 'status': 'pending'}])) == 0
+    assert notifier.sent == [user_id, 1]
+    assert sync.updated == 1
+
+
+def test_user_orders_keyset_paging(run, user_id):
+    order_ids = run(_create_orders(user_id, 7))
+    newest_first = order_ids[::-1]
+
+    def page(cursor_id=None, direction='older'):
+        rows, has_newer, has_older = run(database.get_user_orders_page(user_id, cursor_id, 3, direction))
+        return [row['id'] for row in rows], has_newer, has_older
+
+    assert page() == (newest_first[0:3], False, True)
+    assert page(newest_first[2]) == (newest_first[3:6], True, True)
+    assert page(newest_first[5]) == (newest_first[6:7], True, False)
+    # Назад от третьей страницы — снова вторая, в том же порядке
+    assert page(newest_first[6], 'newer') == (newest_first[3:6], True, True)
+    assert page(newest_first[3], 'newer') == (newest_first[0:3], False, True)
+    # Возврат к странице, начиная с заказа включительно
+    assert page(newest_first[3], 'from') == (newest_first[3:6], True, True)
+    assert page(newest_first[0], 'from') == (newest_first[0:3], False, True)
+
+
+def test_user_orders_paging_is_per_user(run, user_id):
+    run(_create_orders(user_id + 100000, 2))
+    assert run(database.get_user_orders_page(user_id)) == ([], False, False)
@@ -0,0 +1,90 @@
+import io
+import json
+
+import pytest
+
+import product_import
+from product_import import import_products, iter_json, parse_price, validate
+
+CATEGORIES = {'одежда': 'Одежда', 'электроника': 'Электроника'}
+
+
+def _records(text, read_size=65536, monkeypatch=None):
+    if monkeypatch:
+        monkeypatch.setattr(product_import, 'JSON_READ_SIZE', read_size)
+    return list(iter_json(io.StringIO(text)))
+
+
+def _summary(records):
+    return [(number, 'ошибка' if isinstance(value, Exception) else value) for number, value in records]
+
+
+def test_parse_price():
+    assert parse_price('1 500') == 1500
+    assert parse_price('990,00') == 990
+    for value in ('abc', '0', '-5', '10.5', ''):
+        with pytest.raises(ValueError):
+            parse_price(value)
+
+
+def test_validate_accepts_aliases_and_normalizes_category():
+    record = {'Артикул': ' A-1 ', 'name': 'Футболка', 'price': '990', 'category': 'ОДЕЖДА'}
+    assert validate(record, CATEGORIES) == ('A-1', 'Футболка', '', 990, 'Одежда', None)
+
+
+@pytest.mark.parametrize('record', [
+    {'price': '100', 'category': 'Одежда'},
+    {'name': 'Футболка', 'category': 'Одежда'},
+    {'name': 'Футболка', 'price': 'дорого', 'category': 'Одежда'},
+    {'name': 'Футболка', 'price': '100', 'category': 'Еда'},
+    {'name': 'x' * 1000, 'price': '100', 'category': 'Одежда'},
+    {'name': 'Футболка', 'price': '100', 'category': 'Одежда', 'image': '/нет/такого/файла.jpg'},
+    ['Футболка', 100],
+    ValueError('сломанная запись'),
+])
+def test_validate_rejects(record):
+    with pytest.raises(ValueError):
+        validate(record, CATEGORIES)
+
+
+@pytest.mark.parametrize('read_size', [65536, 3])
+def test_iter_json_resyncs_after_bad_records(read_size, monkeypatch):
+    text = '[{"name": "a"}, {"name": [1}, 123abc, {"name": "b"}, }, {"name": "c"}]'
+    assert _summary(_records(text, read_size, monkeypatch)) == [
+        (1, {'name': 'a'}), (2, 'ошибка'), (3, 'ошибка'), (4, {'name': 'b'}), (5, 'ошибка'), (6, {'name': 'c'})]
+
+
+@pytest.mark.parametrize('read_size', [65536, 3])
+def test_iter_json_reports_missing_closing_bracket(read_size, monkeypatch):
+    records = _records('[{"name": "a"}, {"name": "b"}', read_size, monkeypatch)
+    assert _summary(records) == [(1, {'name': 'a'}), (2, {'name': 'b'}), (3, 'ошибка')]
+    assert 'нет закрывающей' in str(records[-1][1])
+
+
+def test_iter_json_numbers_across_buffer_boundary(monkeypatch):
+    assert _summary(_records('[12345, 67]', 3, monkeypatch)) == [(1, 12345), (2, 67)]
+
+
+def test_iter_json_lines():
+    assert _summary(_records('{"name": "a"}\n\n{oops\n{"name": "b"}\n')) == [
+        (1, {'name': 'a'}), (3, 'ошибка'), (4, {'name': 'b'})]
+
+
+def test_import_dry_run_reports_errors_without_writing(run, tmp_path):
+    path = tmp_path / 'products.json'
+    path.write_text(json.dumps([
+        {'sku': 'dry-1', 'name': 'Футболка', 'price': 990, 'category': 'Одежда'},
+        {'sku': 'dry-1', 'name': 'Копия', 'price': 990, 'category': 'Одежда'},
+        {'sku': 'dry-2', 'name': 'Наушники', 'price': 0, 'category': 'Электроника'},
+        {'sku': 'dry-3', 'name': 'Наушники', 'price': 2990, 'category': 'Электроника'},
+    ], ensure_ascii=False), encoding='utf-8')
+
+    report = run(import_products(str(path), 'json', CATEGORIES.values(), dry_run=True, chunk_size=2))
+    assert (report.rows, report.inserted, report.updated) == (4, 2, 0)
+    assert [number for number, _ in report.errors] == [2, 3]
+
+    report = run(import_products(str(path), 'json', CATEGORIES.values()))
+    assert (report.inserted, report.updated, report.failed) == (2, 0, 2)
+    # Повторный импорт обновляет товары по артикулу
+    report = run(import_products(str(path), 'json', CATEGORIES.values(), dry_run=True))
+    assert (report.inserted, report.updated) == (0, 2)
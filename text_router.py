@@ -0,0 +1,61 @@
+import logging
+
+from config import is_admin
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class TextRouter:
+    """Маршрутизация текстовых сообщений одним поиском в словаре.
+
+    Надписи кнопок меню сопоставляются с обработчиками точным совпадением.
+    Если надпись не найдена, сообщение передаётся обработчику текущего
+    состояния диалога пользователя (добавление товара, рассылка,
+    редактирование): handler(update, context, state). Маршруты с admin=True
+    доступны только админам. Время и ошибки каждого обработчика
+    учитываются в metrics.
+    """
+
+    def __init__(self, state_store, fallback):
+        self.state_store = state_store
+        self.fallback = metrics.instrument('handler', fallback)
+        self._routes = {}
+        self._states = {}
+
+    def route(self, text, handler, admin=False):
+        self._routes[text] = (metrics.instrument('handler', handler), admin)
+
+    def state(self, name, handler, admin=False):
+        self._states[name] = (metrics.instrument('handler', handler), admin)
+
+    @staticmethod
+    def state_name(state):
+        # Состояния-строки ('broadcast') и словари ({'state': 'editing_price', ...})
+        if isinstance(state, dict):
+            return state.get('state', '').split('_', 1)[0]
+        return state
+
+    async def dispatch(self, update, context):
+        user_id = update.effective_user.id
+
+        route = self._routes.get(update.message.text)
+        if route:
+            handler, admin = route
+            if admin and not is_admin(user_id):
+                return
+            await handler(update, context)
+            return
+
+        state = await self.state_store.get(user_id)
+        if state is not None:
+            route = self._states.get(self.state_name(state))
+            if route:
+                handler, admin = route
+                if admin and not is_admin(user_id):
+                    return
+                await handler(update, context, state)
+                return
+            logger.warning(f"Неизвестное состояние диалога у пользователя {user_id}: {state}")
+
+        await self.fallback(update, context)
@@ -0,0 +1,109 @@
+import asyncio
+import functools
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Поля профиля, которые приходят из Telegram; phone и address не трогаются
+TELEGRAM_FIELDS = ('username', 'first_name', 'last_name')
+
+
+@functools.lru_cache(maxsize=None)
+def upsert_sql(columns):
+    # UPSERT, который переписывает только перечисленные колонки и только
+    # если они изменились; по запросу на каждый набор изменённых полей
+    assignments = ', '.join(f'{column} = excluded.{column}' for column in columns)
+    changed = ' OR '.join(f'users.{column} IS NOT excluded.{column}' for column in columns)
+    return f'''
+        INSERT INTO users (user_id, {', '.join(TELEGRAM_FIELDS)})
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET {assignments}
+        WHERE {changed}
+    '''
+
+
+class UserProfileStore:
+    """Отложенная запись профилей пользователей из Telegram.
+
+    Для каждого пользователя помнится отпечаток последних записанных
+    (username, first_name, last_name). Повторный /start с теми же данными
+    ничего не пишет, изменения копятся и записываются пачкой в фоне.
+    Записываются только поля, отличающиеся от отпечатка; для пользователя
+    без отпечатка (новый или вытесненный из памяти) — все три.
+    """
+
+    def __init__(self, pool, flush_interval=2.0, max_users=100000):
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.max_users = max_users
+        self._fingerprints = OrderedDict()
+        self._pending = {}
+        self._task = None
+        self.skipped = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    @property
+    def pending_count(self):
+        return len(self._pending)
+
+    def touch(self, user_id, username=None, first_name=None, last_name=None):
+        fingerprint = (username, first_name, last_name)
+        previous = self._fingerprints.get(user_id)
+        if previous == fingerprint:
+            self._fingerprints.move_to_end(user_id)
+            self.skipped += 1
+            return False
+        if previous is None:
+            columns = TELEGRAM_FIELDS
+        else:
+            columns = tuple(column for column, old, new in zip(TELEGRAM_FIELDS, previous, fingerprint) if old != new)
+        self._fingerprints[user_id] = fingerprint
+        while len(self._fingerprints) > self.max_users:
+            self._fingerprints.popitem(last=False)
+        self._queue(user_id, fingerprint, columns)
+        return True
+
+    def _queue(self, user_id, fingerprint, columns):
+        # Изменения, ещё не записанные в базу, объединяются по колонкам
+        queued = self._pending.get(user_id)
+        if queued:
+            columns = tuple(column for column in TELEGRAM_FIELDS if column in columns or column in queued[1])
+        self._pending[user_id] = (fingerprint, columns)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи профилей пользователей: {e}")
+
+    async def flush(self):
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        groups = {}
+        for user_id, (fields, columns) in batch.items():
+            groups.setdefault(columns, []).append((user_id, *fields))
+        try:
+            async with self.pool.writer() as db:
+                for columns, rows in groups.items():
+                    await db.executemany(upsert_sql(columns), rows)
+        except Exception:
+            # Более свежие данные, пришедшие во время записи, не затираем,
+            # но колонки несохранённой пачки добавляем к ним
+            for user_id, (fields, columns) in batch.items():
+                queued = self._pending.get(user_id)
+                self._queue(user_id, queued[0] if queued else fields, columns)
+            raise
@@ -0,0 +1,149 @@
+import asyncio
+import hmac
+import logging
+import os
+import secrets
+import signal
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer:
+    """Приём обновлений Telegram через webhook на aiohttp.
+
+    Принятые обновления передаются в update_processor приложения
+    (см. dispatcher.PerUserUpdateProcessor), который задаёт параллельность
+    и порядок обработки. Число принятых, но ещё не обработанных обновлений
+    ограничено queue_size: сверх него сервер отвечает 503, и Telegram
+    повторит доставку позже — так нагрузка не копится в памяти бесконечно.
+    Если задан images_path, сервер также раздаёт изображения товаров по
+    /images/ (миниатюры для результатов inline-поиска).
+    Без совпадающего заголовка X-Telegram-Bot-Api-Secret-Token обновление
+    отклоняется с 403, поэтому secret_token обязателен.
+    """
+
+    def __init__(self, application, path='/telegram', secret_token='', queue_size=1000, images_path=None):
+        if not secret_token:
+            raise ValueError("Для приёма обновлений через webhook нужен secret_token")
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token
+        self.queue_size = queue_size
+        self.images_path = images_path
+        self._pending = set()
+        self._accepting = False
+        self.rejected = 0
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get('/health', self.handle_health)
+        if self.images_path:
+            os.makedirs(self.images_path, exist_ok=True)
+            app.router.add_static('/images/', self.images_path)
+        return app
+
+    async def handle_update(self, request):
+        received = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(received.encode(), self.secret_token.encode()):
+            return web.Response(status=403)
+        if not self._accepting:
+            return web.Response(status=503)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if len(self._pending) >= self.queue_size:
+            self.rejected += 1
+            logger.warning("Очередь обновлений заполнена, отвечаем 503")
+            return web.Response(status=503, headers={'Retry-After': '1'})
+        update = Update.de_json(data, self.application.bot)
+        task = asyncio.create_task(self._process(update))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        return web.Response()
+
+    async def handle_health(self, request):
+        return web.json_response({
+            'accepting': self._accepting,
+            'queue_size': len(self._pending),
+            'rejected': self.rejected,
+        })
+
+    async def _process(self, update):
+        try:
+            await self.application.update_processor.process_update(
+                update, self.application.process_update(update)
+            )
+        except Exception as e:
+            logger.error(f"Ошибка обработки обновления {update.update_id}: {e}")
+
+    def start(self):
+        self._accepting = True
+
+    async def stop(self):
+        # Перестаём принимать новые обновления и дорабатываем уже принятые
+        self._accepting = False
+        while self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+
+async def run_webhook(application, url, path, host, port, secret_token, queue_size, images_path=None):
+    """Запуск бота в режиме webhook в одном цикле событий до SIGINT/SIGTERM.
+
+    Жизненный цикл приложения тот же, что у run_polling: initialize,
+    post_init, start, а при остановке stop, post_stop, shutdown, post_shutdown.
+    Если секрет не задан, но бот сам регистрирует webhook (задан url),
+    секрет генерируется при запуске; без url запуск без секрета невозможен.
+    """
+    if not secret_token:
+        if not url:
+            raise RuntimeError("WEBHOOK_SECRET не задан: без него любой, кто достучится до порта, "
+                               "сможет прислать поддельные обновления")
+        secret_token = secrets.token_urlsafe(32)
+        logger.info("WEBHOOK_SECRET не задан, для webhook сгенерирован случайный секрет")
+    server = WebhookServer(application, path, secret_token, queue_size, images_path)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+
+    runner = web.AppRunner(server.create_app())
+    await runner.setup()
+    try:
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        await application.start()
+        server.start()
+
+        if url:
+            await application.bot.set_webhook(
+                url=url.rstrip('/') + path,
+                secret_token=secret_token,
+                allowed_updates=Update.ALL_TYPES,
+            )
+        logger.info(f"Webhook слушает {host}:{port}{path}")
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass
+        await stop.wait()
+    finally:
+        await server.stop()
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)